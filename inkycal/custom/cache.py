@@ -0,0 +1,244 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Persistent image cache for Inkycal
+Copyright by aceisace
+"""
+import hashlib
+import json
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+filename = os.path.basename(__file__).split('.py')[0]
+logger = logging.getLogger(filename)
+
+# File layout (little endian):
+#   header: magic, version, timestamp (float64), number of images (uint16)
+#   per image: mode (4 bytes, space padded), width, height (uint16),
+#              size of the zlib compressed pixels (uint32), pixels
+MAGIC = b'IKCH'
+VERSION = 1
+_header = struct.Struct('<4sBdH')
+_image_header = struct.Struct('<4sHHI')
+
+
+def pack_images(images, timestamp=None):
+  """Packs PIL images into a compact binary blob.
+
+  The raw pixels of each image are compressed with zlib, which is lossless
+  and much faster than PNG encoding for the mostly black-white images
+  generated by Inkycal.
+
+  Args:
+    - images: A list of PIL Image objects (mode '1', 'L', 'P', 'RGB', 'RGBA').
+    - timestamp: Unix time to store with the images, defaults to now.
+
+  Returns:
+    bytes
+  """
+  if timestamp is None:
+    timestamp = time.time()
+
+  parts = [_header.pack(MAGIC, VERSION, timestamp, len(images))]
+  for image in images:
+    if image.mode == 'P':
+      image = image.convert('RGB')
+    pixels = zlib.compress(image.tobytes(), 6)
+    parts.append(_image_header.pack(image.mode.ljust(4).encode('ascii'),
+                                    image.width, image.height, len(pixels)))
+    parts.append(pixels)
+  return b''.join(parts)
+
+
+def unpack_images(data):
+  """Unpacks a blob created by pack_images.
+
+  Returns:
+    (images, timestamp) -> a list of PIL Image objects and the unix time
+    they were packed at.
+
+  Raises:
+    ValueError if the data is not a valid blob.
+  """
+  try:
+    magic, version, timestamp, count = _header.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+      raise ValueError('not an inkycal image cache or unsupported version')
+
+    offset = _header.size
+    images = []
+    for _ in range(count):
+      mode, width, height, size = _image_header.unpack_from(data, offset)
+      offset += _image_header.size
+      pixels = zlib.decompress(data[offset:offset + size])
+      offset += size
+      images.append(Image.frombytes(mode.decode('ascii').strip(),
+                                    (width, height), pixels))
+    return images, timestamp
+
+  except (struct.error, zlib.error, UnicodeDecodeError) as error:
+    raise ValueError(f'corrupted image cache: {error}')
+
+
+class ModuleCache:
+  """Keeps the last good images of each module, in memory and on disk.
+
+  Entries are keyed by the position of the module and a hash of its
+  settings, so changing the config of a module invalidates its entry. Files
+  are written by a background thread and replaced atomically, so a power
+  cut never leaves a half written entry behind.
+
+  Args:
+    - folder: The folder to store the cache files in, created if needed.
+  """
+
+  def __init__(self, folder):
+    self.folder = folder
+    self._entries = {}
+    self._writer = ThreadPoolExecutor(max_workers=1,
+                                      thread_name_prefix='inkycal-cache')
+
+  @staticmethod
+  def config_hash(config):
+    """Returns a short, stable hash of a module's settings"""
+    text = json.dumps(config, sort_keys=True, default=str)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()[:12]
+
+  def _path(self, position, config):
+    return os.path.join(self.folder,
+                        f'module{position}_{self.config_hash(config)}.bin')
+
+  def get(self, position, config):
+    """Returns the cached (black, colour, timestamp) of a module.
+
+    Looks in memory first, then on disk. Returns None if there is no valid
+    entry for this position and config.
+    """
+    path = self._path(position, config)
+    if path in self._entries:
+      return self._entries[path]
+
+    try:
+      with open(path, 'rb') as file:
+        (black, colour), timestamp = unpack_images(file.read())
+    except FileNotFoundError:
+      return None
+    except ValueError as error:
+      logger.warning(f'ignoring {path}: {error}')
+      return None
+
+    self._entries[path] = (black, colour, timestamp)
+    return self._entries[path]
+
+  def put(self, position, config, black, colour, timestamp=None):
+    """Stores the images of a module and writes them to disk in background"""
+    if timestamp is None:
+      timestamp = time.time()
+    path = self._path(position, config)
+    entry = (black.copy(), colour.copy(), timestamp)
+    self._entries[path] = entry
+    return self._writer.submit(self._write, path, entry)
+
+  def _write(self, path, entry):
+    black, colour, timestamp = entry
+    try:
+      os.makedirs(self.folder, exist_ok=True)
+      # remove entries of older configs of this module
+      prefix = os.path.basename(path).rsplit('_', 1)[0] + '_'
+      for name in os.listdir(self.folder):
+        if name.startswith(prefix) and name != os.path.basename(path):
+          os.remove(os.path.join(self.folder, name))
+
+      temp_path = path + '.tmp'
+      with open(temp_path, 'wb') as file:
+        file.write(pack_images([black, colour], timestamp))
+      os.replace(temp_path, path)
+    except OSError:
+      logger.exception(f'Could not write cache file {path}')
+
+  def flush(self):
+    """Blocks until all pending writes are done"""
+    self._writer.submit(lambda: None).result()
+
+
+class ImageCache:
+  """Keeps processed images on disk, keyed by what they were made from.
+
+  Used by modules that process the same source images again and again, e.g.
+  the slideshow. Keys are tuples of plain values, like the path and
+  modification time of the source and the settings used to process it.
+  Files are replaced atomically, so this can be used from worker threads.
+  The least recently used entries are removed once there are more than
+  max_entries.
+
+  Args:
+    - folder: The folder to store the cache files in, created if needed.
+    - max_entries: The number of entries to keep.
+  """
+
+  def __init__(self, folder, max_entries=256):
+    self.folder = folder
+    self.max_entries = max_entries
+
+  def _path(self, key):
+    text = json.dumps(key, default=str)
+    digest = hashlib.sha1(text.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(self.folder, f'{digest}.bin')
+
+  def __contains__(self, key):
+    return os.path.exists(self._path(key))
+
+  def get(self, key):
+    """Returns the images stored for key, or None if there are none"""
+    path = self._path(key)
+    try:
+      with open(path, 'rb') as file:
+        images, _ = unpack_images(file.read())
+      # the modification time tells which entries were used recently
+      os.utime(path)
+    except FileNotFoundError:
+      return None
+    except ValueError as error:
+      logger.warning(f'ignoring {path}: {error}')
+      return None
+    return images
+
+  def put(self, key, images):
+    """Stores images for key"""
+    path = self._path(key)
+    try:
+      os.makedirs(self.folder, exist_ok=True)
+      temp_path = f'{path}.{threading.get_ident()}.tmp'
+      with open(temp_path, 'wb') as file:
+        file.write(pack_images(images))
+      os.replace(temp_path, path)
+      self._prune()
+    except OSError:
+      logger.exception(f'Could not write cache file {path}')
+
+  def _prune(self):
+    """Removes the least recently used entries above max_entries"""
+    entries = []
+    for entry in os.scandir(self.folder):
+      if entry.name.endswith('.bin'):
+        try:
+          entries.append((entry.stat().st_mtime, entry.path))
+        except FileNotFoundError:
+          continue
+    entries.sort()
+    for _, path in entries[:-self.max_entries]:
+      try:
+        os.remove(path)
+      except FileNotFoundError:
+        pass
+
+
+if __name__ == '__main__':
+  print(f'running {filename} in standalone mode')
@@ -0,0 +1,136 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Connectivity monitor for Inkycal
+Copyright by aceisace
+"""
+import ipaddress
+import logging
+import os
+import socket
+import threading
+import time
+from urllib.parse import urlsplit
+
+filename = os.path.basename(__file__).split('.py')[0]
+logger = logging.getLogger(filename)
+
+
+# Routing tables of the kernel and how to spot a default route in them:
+# destination 0.0.0.0 with mask 0.0.0.0, or ::/0
+_route_tables = [
+  ('/proc/net/route',
+   lambda fields: fields[1] == '00000000' and fields[7] == '00000000'),
+  ('/proc/net/ipv6_route',
+   lambda fields: fields[0] == '0' * 32 and fields[1] == '00'),
+  ]
+
+
+def has_default_route():
+  """Checks the routing tables of the kernel for a default route.
+
+  Returns:
+    True or False, or None if the routing tables can not be read (e.g. not
+    on Linux).
+  """
+  found = None
+  for path, is_default in _route_tables:
+    try:
+      with open(path) as file:
+        rows = [line.split() for line in file.read().splitlines()]
+    except OSError:
+      continue
+    found = False
+    if any(len(fields) > 7 and is_default(fields) for fields in rows):
+      return True
+  return found
+
+
+class ConnectivityMonitor:
+  """Checks if the network can be reached, shared by all modules.
+
+  The result is cached for `ttl` seconds (failures for `failure_ttl`
+  seconds), so all modules updated in one cycle share one check. Checks are
+  made of cheap signals first:
+
+    1. resolving the host of probe_url (answered by the DNS cache of the
+       system in most cases),
+    2. looking for a default route (for hosts outside the local network),
+    3. opening a TCP connection to the host, without TLS or HTTP.
+
+  Args:
+    - probe_url: The URL whose host and port are probed. Defaults to the
+      environment variable INKYCAL_PROBE_URL or https://google.com.
+    - ttl: Seconds a successful check is reused.
+    - failure_ttl: Seconds a failed check is reused.
+    - timeout: Timeout in seconds of the TCP connection.
+  """
+
+  def __init__(self, probe_url=None, ttl=60, failure_ttl=10, timeout=5):
+    self.probe_url = probe_url or os.environ.get('INKYCAL_PROBE_URL',
+                                                 'https://google.com')
+    self.ttl = ttl
+    self.failure_ttl = failure_ttl
+    self.timeout = timeout
+    self._lock = threading.Lock()
+    self._result = None
+    self._checked = None
+    self.stats = {'checks': 0, 'hits': 0}
+
+  def available(self):
+    """Returns True if the network can be reached, see check.
+
+    Modules asking at the same time wait for one check and share its result.
+    """
+    with self._lock:
+      if self._checked is not None:
+        age = time.monotonic() - self._checked
+        if age < (self.ttl if self._result else self.failure_ttl):
+          self.stats['hits'] += 1
+          return self._result
+
+      self._result = self.check()
+      self._checked = time.monotonic()
+      self.stats['checks'] += 1
+      return self._result
+
+  def check(self):
+    """Checks the connectivity now, without using the cached result"""
+    parts = urlsplit(self.probe_url)
+    host = parts.hostname
+    port = parts.port or (443 if parts.scheme == 'https' else 80)
+
+    try:
+      address = socket.getaddrinfo(host, port, proto=socket.IPPROTO_TCP)[0]
+    except (socket.gaierror, UnicodeError) as error:
+      logger.info(f'could not resolve {host}: {error}')
+      return False
+
+    family, kind, proto, _, sockaddr = address
+    ip = ipaddress.ip_address(sockaddr[0])
+    if ip.is_global and has_default_route() == False:
+      logger.info('no default route, network not reachable')
+      return False
+
+    try:
+      with socket.socket(family, kind, proto) as connection:
+        connection.settimeout(self.timeout)
+        connection.connect(sockaddr)
+      return True
+    except OSError as error:
+      logger.info(f'could not connect to {host}:{port}: {error}')
+      return False
+
+  def invalidate(self):
+    """Forgets the cached result, the next call of available checks again"""
+    with self._lock:
+      self._checked = None
+
+
+# Shared by all modules, see internet_available
+monitor = ConnectivityMonitor()
+
+
+if __name__ == '__main__':
+  print(f'running {filename} in standalone mode')
+  print(f'network available: {monitor.available()}')
@@ -8,7 +8,12 @@ Copyright by aceisace
 import logging
 from PIL import Image, ImageDraw, ImageFont, ImageColor
 from urllib.request import urlopen
+from . import connectivity
+from collections import OrderedDict
+from collections.abc import Mapping
+import json
 import os
+import threading
 import time
 
 logs = logging.getLogger('inkycal_custom')
@@ -22,20 +27,284 @@ top_level = os.path.dirname(
 fonts_location = top_level + '/fonts/'
 images = top_level + '/images/'
 
-# Get available fonts within fonts folder
-fonts = {}
+class FontIndex(Mapping):
+  """The font files (.ttf, .otf) within a folder by name, e.g.
+  fonts['NotoSansUI-Regular'] -> path of NotoSansUI-Regular.ttf
 
-for path,dirs,files in os.walk(fonts_location):
-  for filename in files:
-    if filename.endswith('.otf'):
-      name = filename.split('.otf')[0]
-      fonts[name] = os.path.join(path, filename)
+  The folder is only searched on the first lookup. The result is stored in
+  index_file together with the modification times of all directories, so
+  later runs only need to stat the directories instead of walking the
+  folder. The index is rebuilt if any of the directories changed.
 
-    if filename.endswith('.ttf'):
-      name = filename.split('.ttf')[0]
-      fonts[name] = os.path.join(path, filename)
+  Args:
+    - folder: The folder with the fonts (searched recursively).
+    - index_file: Where to store the index, None to not store it.
+  """
+
+  def __init__(self, folder, index_file=None):
+    self.folder = folder
+    self.index_file = index_file
+    self._fonts = None
+    self._lock = threading.Lock()
+
+  @property
+  def _index(self):
+    if self._fonts is None:
+      with self._lock:
+        if self._fonts is None:
+          self._fonts = self._load()
+    return self._fonts
+
+  def __getitem__(self, name):
+    return self._index[name]
+
+  def __iter__(self):
+    return iter(self._index)
+
+  def __len__(self):
+    return len(self._index)
+
+  def _load(self):
+    """Returns the stored index if no directory changed, else a new one"""
+    try:
+      with open(self.index_file) as file:
+        stored = json.load(file)
+      if stored['folder'] == self.folder and all(
+          os.stat(path).st_mtime == mtime
+          for path, mtime in stored['directories'].items()):
+        return stored['fonts']
+    except (OSError, TypeError, ValueError, KeyError):
+      pass
+    return self.rebuild()
+
+  def rebuild(self):
+    """Searches the folder for fonts and stores the index"""
+    found, directories = {}, {}
+    for path, dirs, files in os.walk(self.folder):
+      directories[path] = os.stat(path).st_mtime
+      for filename in files:
+        name, extension = os.path.splitext(filename)
+        if extension in ('.otf', '.ttf'):
+          found[name] = os.path.join(path, filename)
+
+    if self.index_file:
+      try:
+        os.makedirs(os.path.dirname(self.index_file), exist_ok=True)
+        temp_path = self.index_file + '.tmp'
+        with open(temp_path, 'w') as file:
+          json.dump({'folder': self.folder, 'directories': directories,
+                     'fonts': found}, file)
+        os.replace(temp_path, self.index_file)
+      except OSError as error:
+        logs.debug(f'could not store the font index: {error}')
+
+    self._fonts = found
+    return found
+
+
+# Get available fonts within fonts folder, searched on first use
+fonts = FontIndex(fonts_location, os.path.join(top_level, 'cache',
+                                               'fonts.json'))
+available_fonts = fonts.keys()
+
+class _LRUCache:
+  """A thread-safe dict with at most maxsize entries, the least recently
+  used entries are dropped first. Counts hits and misses in stats."""
+
+  def __init__(self, maxsize):
+    self.maxsize = maxsize
+    self._data = OrderedDict()
+    self._lock = threading.Lock()
+    self.stats = {'hits': 0, 'misses': 0}
+
+  def get(self, key):
+    """Returns the value of key or None"""
+    with self._lock:
+      value = self._data.get(key)
+      if value is None:
+        self.stats['misses'] += 1
+      else:
+        self._data.move_to_end(key)
+        self.stats['hits'] += 1
+      return value
+
+  def put(self, key, value):
+    with self._lock:
+      self._data[key] = value
+      while len(self._data) > self.maxsize:
+        self._data.popitem(last=False)
+
+  def statistics(self):
+    """Returns a copy of stats with the current number of entries"""
+    with self._lock:
+      return dict(self.stats, size=len(self._data))
+
+  def clear(self):
+    """Drops all entries and resets the statistics"""
+    with self._lock:
+      self._data.clear()
+      self.stats.update(hits=0, misses=0)
+
+
+# Loaded fonts by (path, size), shared by all modules, as loading a font
+# means opening and parsing the font file.
+_font_cache = _LRUCache(128)
+
+# Layouts of texts in write() by font, box, text and options (see _layout).
+# Most labels, e.g. weekday names and day numbers, are the same every time.
+_layout_cache = _LRUCache(1024)
+
+
+def get_font(path, size):
+  """Returns the font at path with the given size, loading it only once.
+
+  Use this instead of ImageFont.truetype(path, size). Up to 128 fonts are
+  kept, the least recently used ones are dropped first.
+
+  Args:
+    - path: The path of the font file, e.g. fonts['fontname'].
+    - size: The fontsize in pixels.
+
+  Returns:
+    A PIL FreeTypeFont object.
+  """
+  key = (path, size)
+  font = _font_cache.get(key)
+  if font is None:
+    font = ImageFont.truetype(path, size)
+    _font_cache.put(key, font)
+  return font
+
+
+def font_cache_statistics():
+  """Returns the hits, misses and number of fonts of the font cache"""
+  return _font_cache.statistics()
+
+
+def layout_cache_statistics():
+  """Returns the hits, misses and number of layouts cached by write"""
+  return _layout_cache.statistics()
+
+
+def clear_font_cache():
+  """Drops all cached fonts and text layouts and resets the statistics"""
+  _font_cache.clear()
+  _layout_cache.clear()
+
+
+def _smallest_size(start, grows):
+  """Returns the smallest size >= start for which grows(size) is False.
+
+  grows has to be True up to some size and False from there on, which
+  holds for text sizes as glyphs get larger with the fontsize. Finds the
+  size with an exponential, then a binary search.
+  """
+  if not grows(start):
+    return start
+  low, high = start, start * 2
+  while grows(high):
+    low, high = high, high * 2
+  # grows(low) is True and grows(high) is False
+  while high - low > 1:
+    middle = (low + high) // 2
+    if grows(middle):
+      low = middle
+    else:
+      high = middle
+  return high
+
+
+def fit_fontsize(path, text, max_width, max_height, height_text='hg'):
+  """Returns the fontsize for a text to fill max_width or max_height.
+
+  This is the first fontsize from 8 upwards at which the text is at least
+  max_width wide or height_text at least max_height high, the same size
+  the previous loop increasing the fontsize by 1 ended with, found in
+  O(log size) measurements.
+
+  Args:
+    - path: The path of the font file.
+    - text: The text which should fit.
+    - max_width, max_height: The size to fill in pixels.
+    - height_text: The text used to measure the height, 'hg' by default for
+      the full height of a line.
+  """
+  def grows(size):
+    font = get_font(path, size)
+    return (font.getsize(text)[0] < max_width and
+            font.getsize(height_text)[1] < max_height)
+  return _smallest_size(8, grows)
+
+
+def truncate(text, font, max_width, max_height):
+  """Returns the longest beginning of text which fits max_width.
+
+  Texts fit if (width, height) <= (max_width, max_height), with the height
+  of 'hg'. The widths of the beginnings of a text grow with their length,
+  so the cut is found by bisection instead of removing one character at a
+  time.
+  """
+  height = font.getsize('hg')[1]
+  fits = lambda length: ((font.getsize(text[:length])[0], height) <=
+                         (max_width, max_height))
+  if fits(len(text)):
+    return text
+  low, high = 0, len(text)
+  while high - low > 1:
+    middle = (low + high) // 2
+    if fits(middle):
+      low = middle
+    else:
+      high = middle
+  return text[:low]
+
+
+def fonts_in_settings(settings):
+  """Returns the fonts named in settings.json as (name, fontsize) pairs.
+
+  This is the default font of the modules at the fontsize of each module,
+  fonts named in the config of a module and the font of the info-section.
+  """
+  default = 'NotoSansUI-Regular'
+  pairs = []
+  if settings.get('info_section'):
+    pairs.append((default, 14))
+  for module in settings.get('modules', []):
+    config = module.get('config', {})
+    size = config.get('fontsize')
+    if not size:
+      continue
+    pairs.append((default, size))
+    pairs += [(value, size) for value in config.values()
+              if isinstance(value, str) and value in fonts]
+  return list(dict.fromkeys(pairs))
+
+
+def prewarm_fonts(pairs, background=True):
+  """Loads fonts into the font cache before they are needed.
+
+  Args:
+    - pairs: (name, fontsize) pairs, e.g. from fonts_in_settings.
+    - background: Load the fonts in a background thread, so this can
+      overlap with other work done at startup.
+
+  Returns:
+    The thread loading the fonts, or None if background is False.
+  """
+  def load():
+    for name, size in pairs:
+      try:
+        get_font(fonts[name], size)
+      except (KeyError, OSError) as error:
+        logs.debug(f'could not prewarm font {name}: {error}')
+
+  if not background:
+    load()
+    return None
+  thread = threading.Thread(target=load, name='inkycal-fonts', daemon=True)
+  thread.start()
+  return thread
 
-available_fonts = [key for key,values in fonts.items()]
 
 def get_fonts():
   """Print all available fonts by name.
@@ -52,10 +321,10 @@ def get_fonts():
   To use a font, use the following sytax, where fontname is one of the
   printed fonts of this function:
 
-  >>> ImageFont.truetype(fonts['fontname'], size = 10)
+  >>> get_font(fonts['fontname'], size = 10)
   """
-  for fonts in available_fonts:
-    print(fonts)
+  for name in available_fonts:
+    print(name)
 
 
 def get_system_tz():
@@ -98,11 +367,51 @@ def auto_fontsize(font, max_height):
         A PIL font object with modified height.
     """
 
-  fontsize = font.getsize('hg')[1]
-  while font.getsize('hg')[1] <= (max_height * 0.80):
-    fontsize += 1
-    font = ImageFont.truetype(font.path, fontsize)
-  return font
+  if font.getsize('hg')[1] > (max_height * 0.80):
+    return font
+  fontsize = _smallest_size(
+    font.getsize('hg')[1] + 1,
+    lambda size: get_font(font.path, size).getsize('hg')[1] <=
+                 (max_height * 0.80))
+  return get_font(font.path, fontsize)
+
+
+def _layout(font, text, box_size, fit, fill_width, fill_height, alignment):
+  """Lays out a text in a box for write.
+
+  Returns:
+    (fontsize, text, x, y) -> the fontsize to use, the (truncated) text and
+    its position in the box. x is None for unknown alignments.
+  """
+  box_width, box_height = box_size
+
+  # Find the fontsize to fit specified height and width of text box
+  if fit:
+    size = fit_fontsize(font.path, text, int(box_width * fill_width),
+                        int(box_height * fill_height))
+    font = get_font(font.path, size)
+
+  text_width, text_height = font.getsize(text)[0], font.getsize('hg')[1]
+
+  # Truncate text if text is too long so it can fit inside the box
+  if (text_width, text_height) > (box_width, box_height):
+    logs.debug(('truncating {}'.format(text)))
+    text = truncate(text, font, box_width, box_height)
+    text_width = font.getsize(text)[0]
+    logs.debug((text))
+
+  # Align text to desired position
+  x = None
+  if alignment == "center" or None:
+    x = int((box_width / 2) - (text_width / 2))
+  elif alignment == 'left':
+    x = 0
+  elif alignment == 'right':
+    x = int(box_width - text_width)
+
+  y = int((box_height / 2) - (text_height / 2))
+
+  return getattr(font, 'size', None), text, x, y
 
 
 def write(image, xy, box_size, text, font=None, **kwargs):
@@ -116,7 +425,7 @@ def write(image, xy, box_size, text, font=None, **kwargs):
     - box_size: tuple -> (width, height) representing the size of the text box.
     - text: string, the actual text to add on the image.
     - font: A PIL Font object e.g.
-      ImageFont.truetype(fonts['fontname'], size = 10).
+      get_font(fonts['fontname'], size = 10).
 
   Args: (optional)
     - alignment: alignment of the text, use 'center', 'left', 'right'.
@@ -148,38 +457,25 @@ def write(image, xy, box_size, text, font=None, **kwargs):
 
   x,y = xy
   box_width, box_height = box_size
-
-  # Increase fontsize to fit specified height and width of text box
-  if (autofit == True) or (fill_width != 1.0) or (fill_height != 0.8):
-    size = 8
-    font = ImageFont.truetype(font.path, size)
-    text_width, text_height = font.getsize(text)[0], font.getsize('hg')[1]
-    while (text_width < int(box_width * fill_width) and
-           text_height < int(box_height * fill_height)):
-      size += 1
-      font = ImageFont.truetype(font.path, size)
-      text_width, text_height = font.getsize(text)[0], font.getsize('hg')[1]
-
-  text_width, text_height = font.getsize(text)[0], font.getsize('hg')[1]
-
-
-  # Truncate text if text is too long so it can fit inside the box
-  if (text_width, text_height) > (box_width, box_height):
-    logs.debug(('truncating {}'.format(text)))
-    while (text_width, text_height) > (box_width, box_height):
-      text=text[0:-1]
-      text_width, text_height = font.getsize(text)[0], font.getsize('hg')[1]
-    logs.debug((text))
-
-  # Align text to desired position
-  if alignment == "center" or None:
-    x = int((box_width / 2) - (text_width / 2))
-  elif alignment == 'left':
-    x = 0
-  elif alignment == 'right':
-    x = int(box_width - text_width)
-
-  y = int((box_height / 2) - (text_height / 2))
+  fit = (autofit == True) or (fill_width != 1.0) or (fill_height != 0.8)
+
+  # Layouts are cached, fonts without a file (e.g. the default bitmap font)
+  # are laid out every time
+  path = getattr(font, 'path', None)
+  key = (path, getattr(font, 'size', None), box_width, box_height, text, fit,
+         fill_width, fill_height, alignment)
+  layout = _layout_cache.get(key) if path else None
+  if layout is None:
+    layout = _layout(font, text, box_size, fit, fill_width, fill_height,
+                     alignment)
+    if path:
+      _layout_cache.put(key, layout)
+
+  size, text, text_x, y = layout
+  if size != getattr(font, 'size', None):
+    font = get_font(path, size)
+  if text_x is not None:
+    x = text_x
 
   # Draw the text in the text-box
   draw  = ImageDraw.Draw(image)
@@ -199,43 +495,153 @@ def write(image, xy, box_size, text, font=None, **kwargs):
   image.paste(space, xy, space)
 
 
-def text_wrap(text, font=None, max_width = None):
+# Metrics of words per font, see _word_metrics
+_word_metrics_cache = _LRUCache(32)
+max_cached_words = 8192
+
+
+def _word_metrics(font, words):
+  """Returns the advance (width of the word followed by a space, as used
+  inside a line) and the width (font.getsize) of each word.
+
+  Each word is measured once per font, the tables of the last 32 fonts are
+  kept across calls.
+  """
+  path = getattr(font, 'path', None)
+  table = _word_metrics_cache.get((path, font.size)) if path else None
+  if table is None:
+    table = {}
+    if path:
+      _word_metrics_cache.put((path, font.size), table)
+  elif len(table) > max_cached_words:
+    table.clear()
+
+  advances, widths = [], []
+  for word in words:
+    metrics = table.get(word)
+    if metrics is None:
+      metrics = table[word] = (font.getlength(word + ' '),
+                               font.getsize(word)[0])
+    advances.append(metrics[0])
+    widths.append(metrics[1])
+  return advances, widths
+
+
+def text_wrap(text, font=None, max_width = None, mode = 'greedy'):
   """Splits a very long text into smaller parts
 
   Splits a long text to smaller lines which can fit in a line with max_width.
   Uses a Font object for more accurate calculations.
 
+  Words are measured once (see _word_metrics) and the width of a line is
+  the sum of the advances of its words, so breaking a text takes linear
+  time. Widths within 2 pixels of max_width are measured exactly, which
+  keeps the lines the same as when measuring every line with getsize.
+
   Args:
     - font: A PIL font object which is used to calculate the size.
     - max_width: int-> a width in pixels defining the maximum width before
       splitting the text into the next chunk.
+    - mode: 'greedy' (default) fills each line with as many words as fit.
+      'optimal' breaks the text into the same number of lines, but with line
+      lengths as even as possible (Knuth-Plass style, minimizes the sum of
+      the squared free space of all lines but the last).
 
   Returns:
     A list containing chunked strings of the full text.
   """
-  lines = []
-  if font.getsize(text)[0] < max_width:
-    lines.append(text)
+  words = text.split(' ')
+  advances, widths = _word_metrics(font, words)
+
+  # offsets[i] -> advance of all words before word i
+  offsets = [0.0]
+  for advance in advances:
+    offsets.append(offsets[-1] + advance)
+
+  def width(first, last):
+    """Estimated width of the line with the words first...last"""
+    return offsets[last] - offsets[first] + widths[last]
+
+  def fits(first, last, limit=max_width):
+    estimate = width(first, last)
+    if estimate <= limit - 2:
+      return True
+    if estimate > limit + 2:
+      return False
+    line = ''.join(word + ' ' for word in words[first:last]) + words[last]
+    return font.getsize(line)[0] <= limit
+
+  # texts narrower than max_width are not split at all
+  if fits(0, len(words) - 1, max_width - 1):
+    return [text]
+
+  if mode == 'optimal':
+    breaks = _optimal_breaks(len(words), max_width, width, fits)
+  elif mode == 'greedy':
+    breaks = _greedy_breaks(len(words), fits)
   else:
-    words = text.split(' ')
-    i = 0
-    while i < len(words):
-      line = ''
-      while i < len(words) and font.getsize(line + words[i])[0] <= max_width:
-        line = line + words[i] + " "
-        i += 1
-      if not line:
-        line = words[i]
-        i += 1
-      lines.append(line)
+    raise ValueError(f"mode must be 'greedy' or 'optimal', not '{mode}'")
+
+  lines, first = [], 0
+  for last in breaks:
+    if last - first == 1 and not fits(first, first):
+      # a word longer than the line gets a line of its own
+      lines.append(words[first])
+    else:
+      lines.append(''.join(word + ' ' for word in words[first:last]))
+    first = last
   return lines
 
 
+def _greedy_breaks(count, fits):
+  """Returns the index after the last word of each line, filling each line
+  with as many words as fit"""
+  breaks, first = [], 0
+  while first < count:
+    last = first
+    while last < count and fits(first, last):
+      last += 1
+    first = max(last, first + 1)
+    breaks.append(first)
+  return breaks
+
+
+def _optimal_breaks(count, max_width, width, fits):
+  """Returns the index after the last word of each line, with the least
+  lines and, among those, the least sum of squared free space (the last
+  line is free)"""
+  # cost[i] -> (lines, raggedness) of the best layout of words i...count
+  cost = [(0, 0.0)] * (count + 1)
+  following = [count] * count
+  for first in range(count - 1, -1, -1):
+    best = None
+    last = first
+    while last < count and fits(first, last):
+      lines, raggedness = cost[last + 1]
+      if last < count - 1:
+        raggedness += (max_width - width(first, last)) ** 2
+      if best is None or (lines + 1, raggedness) < best:
+        best, following[first] = (lines + 1, raggedness), last + 1
+      last += 1
+    if best is None:
+      # the word is longer than a line
+      lines, raggedness = cost[first + 1]
+      best, following[first] = (lines + 1, raggedness), first + 1
+    cost[first] = best
+
+  breaks, first = [], 0
+  while first < count:
+    first = following[first]
+    breaks.append(first)
+  return breaks
+
+
 def internet_available():
   """checks if the internet is available.
 
-  Attempts to connect to google.com with a timeout of 5 seconds to check
-  if the network can be reached.
+  Asks the connectivity monitor shared by all modules, which checks if
+  google.com (or INKYCAL_PROBE_URL) can be reached at most once a minute,
+  see inkycal.custom.connectivity.
 
   Returns:
     - True if connection could be established.
@@ -247,11 +653,7 @@ def internet_available():
   >>> #...do something that requires internet connectivity
   """
 
-  try:
-    urlopen('https://google.com',timeout=5)
-    return True
-  except URLError as err:
-    return False
+  return connectivity.monitor.available()
 
 
 def draw_border(image, xy, size, radius=5, thickness=1, shrinkage=(0.1,0.1)):
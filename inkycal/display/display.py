@@ -5,9 +5,12 @@ Inky-Calendar epaper functions
 Copyright by aceisace
 """
 from importlib import import_module
+import hashlib
+import sys
 from PIL import Image
 
 from inkycal.custom import top_level
+from inkycal.display.drivers import epdbuffer
 import glob
 
 class Display:
@@ -19,10 +22,18 @@ class Display:
   args:
     - epaper_model: The name of your E-Paper model.
 
+    - partial_refresh: Only update the areas which changed since the last
+      render, if the driver supports it (7.5" v2 and v3 black-white).
 
+    - full_refresh_every: The number of partial refreshes after which a full
+      refresh is done to remove ghosting.
+
+    - max_partial_ratio: If more than this fraction of the display changed,
+      a full refresh is done instead of a partial one.
   """
 
-  def __init__(self, epaper_model):
+  def __init__(self, epaper_model, partial_refresh=False, full_refresh_every=10,
+               max_partial_ratio=0.5):
     """Load the drivers for this epaper model"""
 
     if 'colour' in epaper_model:
@@ -30,23 +41,46 @@ class Display:
     else:
       self.supports_colour = False
 
+    self.full_refresh_every = full_refresh_every
+    self.max_partial_ratio = max_partial_ratio
+
+    # The last frame sent to the display and partial refreshes since then
+    self._last_frame = None
+    self._partial_count = 0
+
+    # Hash of the last frame sent to the display, identical frames are skipped
+    self._last_hash = None
+    self.skipped_refreshes = 0
+
     try:
       driver_path = f'inkycal.display.drivers.{epaper_model}'
       driver = import_module(driver_path)
       self._epaper = driver.EPD()
       self.model_name = epaper_model
 
+      # Tell an emulated backend which controller it should emulate
+      epdconfig = sys.modules.get('inkycal.display.drivers.epdconfig')
+      if epdconfig and hasattr(epdconfig.implementation, 'set_model'):
+        epdconfig.implementation.set_model(epaper_model)
+
     except ImportError:
       raise Exception('This module is not supported. Check your spellings?')
 
     except FileNotFoundError:
       raise Exception('SPI could not be found. Please check if SPI is enabled')
 
+    if partial_refresh and not hasattr(self._epaper, 'display_partial'):
+      print(f'{epaper_model} does not support partial refresh, using full '
+            'refreshes instead')
+      partial_refresh = False
+    self.partial_refresh = partial_refresh
+
   def render(self, im_black, im_colour = None):
     """Renders an image on the selected E-Paper display.
 
     Initlializes the E-Paper display, sends image data and executes command
-    to update the display.
+    to update the display. If the image is identical to the one shown on the
+    display, nothing is sent and skipped_refreshes is increased instead.
 
     Args:
       - im_black: The image for the black-pixels. Anything in this image that is
@@ -81,26 +115,94 @@ class Display:
 
     epaper = self._epaper
 
+    if self.supports_colour == True and not im_colour:
+      raise Exception('im_colour is required for coloured epaper displays')
+
     if self.supports_colour == False:
-      print('Initialising..', end = '')
-      epaper.init()
-      print('Updating display......', end = '')
-      epaper.display(epaper.getbuffer(im_black))
-      print('Done')
+      buffers = [epaper.getbuffer(im_black)]
+    else:
+      buffers = [epaper.getbuffer(im_black), epaper.getbuffer(im_colour)]
+
+    frame_hash = self._frame_hash(buffers, [im_black, im_colour])
+    if frame_hash == self._last_hash:
+      self.skipped_refreshes += 1
+      print('Image did not change, skipping refresh '
+            f'({self.skipped_refreshes} skipped so far)')
+      return
+
+    if self.supports_colour == False:
+      buffer = buffers[0]
+      regions = self._partial_regions(buffer)
+
+      if regions:
+        print('Initialising..', end = '')
+        epaper.init_part()
+        print(f'Updating {len(regions)} area(s)......', end = '')
+        epaper.display_partial(buffer, self._last_frame, regions)
+        self._partial_count += 1
+        print('Done')
+
+      else:
+        print('Initialising..', end = '')
+        epaper.init()
+        print('Updating display......', end = '')
+        epaper.display(buffer)
+        self._partial_count = 0
+        print('Done')
+
+      if self.partial_refresh:
+        self._last_frame = buffer
 
     elif self.supports_colour == True:
-      if not im_colour:
-        raise Exception('im_colour is required for coloured epaper displays')
       print('Initialising..', end = '')
       epaper.init()
       print('Updating display......', end = '')
-      epaper.display(epaper.getbuffer(im_black), epaper.getbuffer(im_colour))
+      epaper.display(*buffers)
       print('Done')
 
+    self._last_hash = frame_hash
+
     print('Sending E-Paper to deep sleep...', end = '')
     epaper.sleep()
     print('Done')
 
+  @staticmethod
+  def _frame_hash(buffers, images):
+    """Returns a digest of the frame buffers sent to the display.
+
+    Drivers which do not return the packed frame as buffer (e.g. 9.7") are
+    compared by the pixels of the image instead.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for buffer, image in zip(buffers, images):
+      if isinstance(buffer, (bytes, bytearray)):
+        digest.update(buffer)
+      else:
+        digest.update(image.tobytes())
+    return digest.digest()
+
+  def _partial_regions(self, buffer):
+    """Returns the changed areas for a partial refresh of the given buffer.
+
+    Returns None if a full refresh should be done instead, i.e. partial
+    refresh is off, nothing was rendered yet, full_refresh_every was reached
+    or too much of the display changed.
+    """
+    if not self.partial_refresh or self._last_frame is None:
+      return None
+
+    if self._partial_count >= self.full_refresh_every:
+      return None
+
+    width, height = self._epaper.width, self._epaper.height
+    regions = epdbuffer.dirty_regions(self._last_frame, buffer, width, height)
+
+    changed = sum((x1 - x0) * (y1 - y0) for x0, y0, x1, y1 in regions)
+    if changed > self.max_partial_ratio * width * height:
+      return None
+
+    return regions
+
   def calibrate(self, cycles=3):
     """Calibrates the display to retain crisp colours
 
@@ -123,6 +225,10 @@ class Display:
     epaper = self._epaper
     epaper.init()
 
+    # the display no longer shows the last frame, next render is a full one
+    self._last_frame = None
+    self._last_hash = None
+
     display_size = self.get_display_size(self.model_name)
 
     white = Image.new('1', display_size, 'white')
@@ -179,6 +285,7 @@ class Display:
       drivers = [i.split('/')[-1].split('.')[0] for i in drivers]
       drivers.remove('__init__')
       drivers.remove('epdconfig')
+      drivers.remove('epdbuffer')
       if model_name not in drivers:
         print('This model name was not found. Please double check your spellings')
         return
@@ -212,6 +319,7 @@ class Display:
     drivers = [i.split('/')[-1].split('.')[0] for i in drivers]
     drivers.remove('__init__')
     drivers.remove('epdconfig')
+    drivers.remove('epdbuffer')
     print(*drivers, sep='\n')
 
 if __name__ == '__main__':
@@ -29,9 +29,8 @@
 
 
 import logging
-from inkycal.display.drivers import epdconfig
+from inkycal.display.drivers import epdconfig, epdbuffer
 from PIL import Image
-import RPi.GPIO as GPIO
 
 # Display resolution
 EPD_WIDTH       = 400
@@ -173,6 +172,10 @@ class EPD:
         epdconfig.digital_write(self.cs_pin, 0)
         epdconfig.spi_writebyte([data])
         epdconfig.digital_write(self.cs_pin, 1)
+
+    def send_data_bulk(self, data):
+        epdconfig.digital_write(self.dc_pin, 1)
+        epdconfig.spi_writebytes2(data)
         
     def ReadBusy(self):
         self.send_command(0x71)
@@ -182,49 +185,38 @@ class EPD:
 
     def set_lut(self):
         self.send_command(0x20)               # vcom
-        for count in range(0, 44):
-            self.send_data(self.lut_vcom0[count])
+        self.send_data_bulk(self.lut_vcom0)
             
         self.send_command(0x21)         # ww --
-        for count in range(0, 42):
-            self.send_data(self.lut_ww[count])
+        self.send_data_bulk(self.lut_ww)
             
         self.send_command(0x22)         # bw r
-        for count in range(0, 42):
-            self.send_data(self.lut_bw[count])
+        self.send_data_bulk(self.lut_bw)
             
         self.send_command(0x23)         # wb w
-        for count in range(0, 42):
-            self.send_data(self.lut_bb[count])
+        self.send_data_bulk(self.lut_bb)
             
         self.send_command(0x24)         # bb b
-        for count in range(0, 42):
-            self.send_data(self.lut_wb[count])
+        self.send_data_bulk(self.lut_wb)
         
     def Gray_SetLut(self):
         self.send_command(0x20)						#vcom
-        for count in range(0, 42):
-            self.send_data(self.EPD_4IN2_4Gray_lut_vcom[count]) 
+        self.send_data_bulk(self.EPD_4IN2_4Gray_lut_vcom)
 
         self.send_command(0x21)						#red not use
-        for count in range(0, 42):
-            self.send_data(self.EPD_4IN2_4Gray_lut_ww[count]) 
+        self.send_data_bulk(self.EPD_4IN2_4Gray_lut_ww)
 
         self.send_command(0x22)							#bw r
-        for count in range(0, 42):
-            self.send_data(self.EPD_4IN2_4Gray_lut_bw[count]) 
+        self.send_data_bulk(self.EPD_4IN2_4Gray_lut_bw)
 
         self.send_command(0x23)							#wb w
-        for count in range(0, 42):
-            self.send_data(self.EPD_4IN2_4Gray_lut_wb[count]) 
+        self.send_data_bulk(self.EPD_4IN2_4Gray_lut_wb)
 
         self.send_command(0x24)                          #bb b
-        for count in range(0, 42):
-            self.send_data(self.EPD_4IN2_4Gray_lut_bb[count]) 
+        self.send_data_bulk(self.EPD_4IN2_4Gray_lut_bb)
 
         self.send_command(0x25)						#vcom
-        for count in range(0, 42):
-            self.send_data(self.EPD_4IN2_4Gray_lut_ww[count])
+        self.send_data_bulk(self.EPD_4IN2_4Gray_lut_ww)
       
     
     def init(self):
@@ -310,28 +302,7 @@ class EPD:
         self.send_data(0x97)
 
     def getbuffer(self, image):
-        # logging.debug("bufsiz = ",int(self.width/8) * self.height)
-        buf = [0xFF] * (int(self.width/8) * self.height)
-        image_monocolor = image.convert('1')
-        imwidth, imheight = image_monocolor.size
-        pixels = image_monocolor.load()
-        # logging.debug("imwidth = %d, imheight = %d",imwidth,imheight)
-        if(imwidth == self.width and imheight == self.height):
-            logging.debug("Horizontal")
-            for y in range(imheight):
-                for x in range(imwidth):
-                    # Set the bits for the column of pixels at the current position.
-                    if pixels[x, y] == 0:
-                        buf[int((x + y * self.width) / 8)] &= ~(0x80 >> (x % 8))
-        elif(imwidth == self.height and imheight == self.width):
-            logging.debug("Vertical")
-            for y in range(imheight):
-                for x in range(imwidth):
-                    newx = y
-                    newy = self.height - x - 1
-                    if pixels[x, y] == 0:
-                        buf[int((newx + newy*self.width) / 8)] &= ~(0x80 >> (y % 8))
-        return buf
+        return epdbuffer.pack_1bpp(image, self.width, self.height)
         
     def getbuffer_4Gray(self, image):
         # logging.debug("bufsiz = ",int(self.width/8) * self.height)
@@ -372,12 +343,10 @@ class EPD:
 
     def display(self, image):
         self.send_command(0x10)
-        for i in range(0, int(self.width * self.height / 8)):
-            self.send_data(0xFF)
+        self.send_data_bulk(bytearray([0xFF]) * int(self.width * self.height / 8))
             
         self.send_command(0x13)
-        for i in range(0, int(self.width * self.height / 8)):
-            self.send_data(image[i])
+        self.send_data_bulk(image)
             
         self.send_command(0x12) 
         self.ReadBusy()
@@ -456,12 +425,10 @@ class EPD:
     
     def Clear(self):
         self.send_command(0x10)
-        for i in range(0, int(self.width * self.height / 8)):
-            self.send_data(0xFF)
+        self.send_data_bulk(bytearray([0xFF]) * int(self.width * self.height / 8))
             
         self.send_command(0x13)
-        for i in range(0, int(self.width * self.height / 8)):
-            self.send_data(0xFF)
+        self.send_data_bulk(bytearray([0xFF]) * int(self.width * self.height / 8))
             
         self.send_command(0x12) 
         self.ReadBusy()
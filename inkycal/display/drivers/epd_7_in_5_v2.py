@@ -29,7 +29,7 @@
 
 
 import logging
-from inkycal.display.drivers import epdconfig
+from inkycal.display.drivers import epdconfig, epdbuffer
 
 # Display resolution
 EPD_WIDTH       = 800
@@ -64,6 +64,10 @@ class EPD:
         epdconfig.digital_write(self.cs_pin, 0)
         epdconfig.spi_writebyte([data])
         epdconfig.digital_write(self.cs_pin, 1)
+
+    def send_data_bulk(self, data):
+        epdconfig.digital_write(self.dc_pin, 1)
+        epdconfig.spi_writebytes2(data)
         
     def ReadBusy(self):
         logging.debug("e-Paper busy")
@@ -112,47 +116,82 @@ class EPD:
         # EPD hardware init end
         return 0
 
+    def init_part(self):
+        if (epdconfig.module_init() != 0):
+            return -1
+        # EPD hardware init start
+        self.reset()
+
+        self.send_command(0X00)			#PANNEL SETTING
+        self.send_data(0x1F)   #KW-3f   KWR-2F	BWROTP 0f	BWOTP 1f
+
+        self.send_command(0x04) #POWER ON
+        epdconfig.delay_ms(100)
+        self.ReadBusy()
+
+        self.send_command(0xE0)			#CASCADE SETTING
+        self.send_data(0x02)
+        self.send_command(0xE5)			#FORCE TEMPERATURE
+        self.send_data(0x6E)
+        # EPD hardware init end
+        return 0
+
     def getbuffer(self, image):
-        # logging.debug("bufsiz = ",int(self.width/8) * self.height)
-        buf = [0xFF] * (int(self.width/8) * self.height)
-        image_monocolor = image.convert('1')
-        imwidth, imheight = image_monocolor.size
-        pixels = image_monocolor.load()
-        # logging.debug("imwidth = %d, imheight = %d",imwidth,imheight)
-        if(imwidth == self.width and imheight == self.height):
-            logging.debug("Vertical")
-            for y in range(imheight):
-                for x in range(imwidth):
-                    # Set the bits for the column of pixels at the current position.
-                    if pixels[x, y] == 0:
-                        buf[int((x + y * self.width) / 8)] &= ~(0x80 >> (x % 8))
-        elif(imwidth == self.height and imheight == self.width):
-            logging.debug("Horizontal")
-            for y in range(imheight):
-                for x in range(imwidth):
-                    newx = y
-                    newy = self.height - x - 1
-                    if pixels[x, y] == 0:
-                        buf[int((newx + newy*self.width) / 8)] &= ~(0x80 >> (y % 8))
-        return buf
+        return epdbuffer.pack_1bpp(image, self.width, self.height)
         
     def display(self, image):
         self.send_command(0x13)
-        for i in range(0, int(self.width * self.height / 8)):
-            self.send_data(~image[i]);
+        self.send_data_bulk(epdbuffer.invert(image))
                 
         self.send_command(0x12)
         epdconfig.delay_ms(100)
         self.ReadBusy()
-        
+
+    # regions: boxes (x0, y0, x1, y1), x0 and x1 multiples of 8, see
+    # epdbuffer.dirty_regions. image and old_image are full frame buffers.
+    # The controller only refreshes its current partial window, so one
+    # window covering all regions is sent and refreshed once.
+    def display_partial(self, image, old_image, regions):
+        x0 = min(box[0] for box in regions)
+        y0 = min(box[1] for box in regions)
+        x1 = max(box[2] for box in regions)
+        y1 = max(box[3] for box in regions)
+
+        self.send_command(0x50)			#VCOM AND DATA INTERVAL SETTING
+        self.send_data(0xA9)
+        self.send_data(0x07)
+
+        self.send_command(0x91)			#PARTIAL IN
+        self.send_command(0x90)			#PARTIAL WINDOW
+        self.send_data(x0 // 256)
+        self.send_data(x0 % 256)
+        self.send_data((x1 - 1) // 256)
+        self.send_data((x1 - 1) % 256)
+        self.send_data(y0 // 256)
+        self.send_data(y0 % 256)
+        self.send_data((y1 - 1) // 256)
+        self.send_data((y1 - 1) % 256)
+        self.send_data(0x01)			#scan inside and outside the window
+
+        box = (x0, y0, x1, y1)
+        self.send_command(0x10)			#OLD DATA
+        self.send_data_bulk(epdbuffer.invert(
+            epdbuffer.crop(old_image, self.width, box)))
+        self.send_command(0x13)			#NEW DATA
+        self.send_data_bulk(epdbuffer.invert(
+            epdbuffer.crop(image, self.width, box)))
+
+        self.send_command(0x12)
+        epdconfig.delay_ms(100)
+        self.ReadBusy()
+        self.send_command(0x92)			#PARTIAL OUT
+
     def Clear(self):
         self.send_command(0x10)
-        for i in range(0, int(self.width * self.height / 8)):
-            self.send_data(0x00)
+        self.send_data_bulk(bytearray([0x00]) * int(self.width * self.height / 8))
             
         self.send_command(0x13)
-        for i in range(0, int(self.width * self.height / 8)):
-            self.send_data(0x00)
+        self.send_data_bulk(bytearray([0x00]) * int(self.width * self.height / 8))
                 
         self.send_command(0x12)
         epdconfig.delay_ms(100)
@@ -29,11 +29,13 @@
 
 
 import logging
-from . import epdconfig
+from . import epdconfig, epdbuffer
 
 # Display resolution
 EPD_WIDTH       = 880
 EPD_HEIGHT      = 528
+# First RAM y address of the window set by init, see EPD.ram_y
+RAM_Y_START     = 0x2AF
 
 class EPD:
     def __init__(self):
@@ -64,6 +66,10 @@ class EPD:
         epdconfig.digital_write(self.cs_pin, 0)
         epdconfig.spi_writebyte([data])
         epdconfig.digital_write(self.cs_pin, 1)
+
+    def send_data_bulk(self, data):
+        epdconfig.digital_write(self.dc_pin, 1)
+        epdconfig.spi_writebytes2(data)
         
     def ReadBusy(self):
         logging.debug("e-Paper busy")
@@ -111,8 +117,8 @@ class EPD:
         self.send_data(0x6F); 
         self.send_data(0x03); 
         self.send_command(0x45); 
-        self.send_data(0xAF); 
-        self.send_data(0x02);
+        self.send_data(RAM_Y_START % 256); 
+        self.send_data(RAM_Y_START // 256);
         self.send_data(0x00); 
         self.send_data(0x00);
 
@@ -137,55 +143,83 @@ class EPD:
         # EPD hardware init end
         return 0
 
+    def init_part(self):
+        if (self.init() != 0):
+            return -1
+        self.send_command(0x3C); # VBD
+        self.send_data(0x80); # keep the border as it is
+        return 0
+
+    # RAM y address of an image row. init sets data entry mode 0x01 (x
+    # increment, y decrement) with the y window RAM_Y_START..0 and display
+    # writes a frame from y = 0, so the rows wrap around the window: row 0
+    # is at RAM y 0, row 1 at RAM_Y_START, row 2 at RAM_Y_START - 1, ...
+    def ram_y(self, row):
+        return -row % (RAM_Y_START + 1)
+
+    # Limits RAM writes to the columns x0..x1 and starts them at row y0. The
+    # y window stays the one of init, so the rows wrap just like in display.
+    def set_window(self, x0, y0, x1, y1):
+        ram_y0 = self.ram_y(y0)
+        self.send_command(0x44); # RAM x start/end
+        self.send_data(x0 % 256);
+        self.send_data(x0 // 256);
+        self.send_data((x1 - 1) % 256);
+        self.send_data((x1 - 1) // 256);
+        self.send_command(0x45); # RAM y start/end
+        self.send_data(RAM_Y_START % 256);
+        self.send_data(RAM_Y_START // 256);
+        self.send_data(0x00);
+        self.send_data(0x00);
+        self.send_command(0x4E); # RAM x address counter
+        self.send_data(x0 % 256);
+        self.send_data(x0 // 256);
+        self.send_command(0x4F); # RAM y address counter
+        self.send_data(ram_y0 % 256);
+        self.send_data(ram_y0 // 256);
+
     def getbuffer(self, image):
-        # logging.debug("bufsiz = ",int(self.width/8) * self.height)
-        buf = [0xFF] * (int(self.width/8) * self.height)
-        image_monocolor = image.convert('1')
-        imwidth, imheight = image_monocolor.size
-        pixels = image_monocolor.load()
-        # logging.debug("imwidth = %d, imheight = %d",imwidth,imheight)
-        if(imwidth == self.width and imheight == self.height):
-            logging.debug("Vertical")
-            for y in range(imheight):
-                for x in range(imwidth):
-                    # Set the bits for the column of pixels at the current position.
-                    if pixels[x, y] == 0:
-                        buf[int((x + y * self.width) / 8)] &= ~(0x80 >> (x % 8))
-        elif(imwidth == self.height and imheight == self.width):
-            logging.debug("Horizontal")
-            for y in range(imheight):
-                for x in range(imwidth):
-                    newx = y
-                    newy = self.height - x - 1
-                    if pixels[x, y] == 0:
-                        buf[int((newx + newy*self.width) / 8)] &= ~(0x80 >> (y % 8))
-        return buf
+        return epdbuffer.pack_1bpp(image, self.width, self.height)
         
     def display(self, image):
-        self.send_command(0x4F); 
-        self.send_data(0x00);
-        self.send_data(0x00);
+        self.send_command(0x4F); # RAM y address of row 0, see ram_y
+        self.send_data(self.ram_y(0) % 256);
+        self.send_data(self.ram_y(0) // 256);
         self.send_command(0x24);
-        for i in range(0, int(self.width * self.height / 8)):
-            self.send_data(image[i]);
+        self.send_data_bulk(image)
                 
         self.send_command(0x22);
         self.send_data(0xF7);#Load LUT from MCU(0x32)
         self.send_command(0x20);
         epdconfig.delay_ms(10);
         self.ReadBusy();
-        
+
+    # regions: boxes (x0, y0, x1, y1), x0 and x1 multiples of 8, see
+    # epdbuffer.dirty_regions. image and old_image are full frame buffers.
+    def display_partial(self, image, old_image, regions):
+        for box in regions:
+            self.set_window(*box)
+            self.send_command(0x26); # previous frame
+            self.send_data_bulk(epdbuffer.crop(old_image, self.width, box))
+            self.set_window(*box)
+            self.send_command(0x24); # new frame
+            self.send_data_bulk(epdbuffer.crop(image, self.width, box))
+
+        self.send_command(0x22);
+        self.send_data(0xFF);# Display mode 2 (partial)
+        self.send_command(0x20);
+        epdconfig.delay_ms(10);
+        self.ReadBusy();
+
     def Clear(self):
         self.send_command(0x4F); 
         self.send_data(0x00);
         self.send_data(0x00);
         self.send_command(0x24)
-        for i in range(0, int(self.width * self.height / 8)):
-            self.send_data(0xff)
+        self.send_data_bulk(bytearray([0xff]) * int(self.width * self.height / 8))
             
         self.send_command(0x26)
-        for i in range(0, int(self.width * self.height / 8)):
-            self.send_data(0xff)
+        self.send_data_bulk(bytearray([0xff]) * int(self.width * self.height / 8))
                 
         self.send_command(0x22);
         self.send_data(0xF7);#Load LUT from MCU(0x32)
@@ -0,0 +1,192 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Frame buffer packing for E-Paper drivers
+Copyright by aceisace
+"""
+import logging
+import os
+
+from PIL import Image
+import numpy
+
+filename = os.path.basename(__file__).split('.py')[0]
+logger = logging.getLogger(filename)
+
+
+def _to_panel(image, width, height):
+  """Converts an image to a mode '1' image in panel orientation.
+
+  Images with the size of the panel are used as they are. Images with width
+  and height swapped (vertical layout) are rotated by 90° anti-clockwise,
+  which is the same mapping the drivers used (newx = y, newy = height-x-1).
+
+  Returns None if the image matches neither orientation.
+  """
+  image_monocolor = image.convert('1')
+  imwidth, imheight = image_monocolor.size
+
+  if (imwidth == width and imheight == height):
+    logger.debug("Horizontal")
+    return image_monocolor
+
+  elif (imwidth == height and imheight == width):
+    logger.debug("Vertical")
+    return image_monocolor.transpose(Image.ROTATE_90)
+
+  logger.error(f'image size {imwidth}x{imheight} does not match the '
+               f'display size {width}x{height}')
+  return None
+
+
+def pack_1bpp(image, width, height):
+  """Packs an image into a buffer with 1 bit per pixel.
+
+  Each byte holds 8 pixels, the leftmost pixel in the most significant bit.
+  A set bit is white, a cleared bit is black. This is the format used by
+  most black-white and all black-white-colour drivers.
+
+  Args:
+    - image: A PIL Image object, either in panel orientation (width x height)
+      or rotated (height x width).
+    - width: The width of the panel in pixels (multiple of 8).
+    - height: The height of the panel in pixels.
+
+  Returns:
+    A bytearray of size width/8 * height. If the image size does not match
+    the panel, a blank (white) buffer is returned.
+  """
+  panel_image = _to_panel(image, width, height)
+
+  if panel_image is None:
+    return bytearray([0xFF]) * (width // 8 * height)
+
+  # PIL stores mode '1' images row by row, 8 pixels per byte, MSB first
+  return bytearray(panel_image.tobytes())
+
+
+def pack_2bpp(image, width, height):
+  """Packs an image into a buffer with 2 bits per pixel.
+
+  Each byte holds 4 pixels, the leftmost pixel in the two most significant
+  bits. Black pixels are 0b00, white pixels are 0b11. This is the format used
+  by the 5.83" and the 7.5" (v1) black-white drivers.
+
+  Args:
+    - image: A PIL Image object, either in panel orientation (width x height)
+      or rotated (height x width).
+    - width: The width of the panel in pixels (multiple of 4).
+    - height: The height of the panel in pixels.
+
+  Returns:
+    A bytearray of size width/4 * height. If the image size does not match
+    the panel, a blank (black) buffer is returned.
+  """
+  panel_image = _to_panel(image, width, height)
+
+  if panel_image is None:
+    return bytearray(width // 4 * height)
+
+  # duplicate every pixel horizontally, then pack 8 bits into one byte
+  pixels = numpy.asarray(panel_image, dtype=bool)
+  packed = numpy.packbits(numpy.repeat(pixels, 2, axis=1), axis=1)
+  return bytearray(packed.tobytes())
+
+
+def invert(buffer):
+  """Returns a copy of the buffer with all bits flipped (~byte & 0xFF)"""
+  return bytearray(numpy.invert(numpy.frombuffer(bytes(buffer),
+                                                 dtype=numpy.uint8)).tobytes())
+
+
+def _join_nibbles(values):
+  """Combines pairs of 4-bit pixel values into bytes (first pixel high)"""
+  values = values.reshape(-1, 2)
+  return bytearray(((values[:, 0] << 4) | values[:, 1]).astype(
+    numpy.uint8).tobytes())
+
+
+def expand_2bpp(buffer):
+  """Converts a 2bpp buffer (see pack_2bpp) to the 4 bits per pixel stream
+  expected by the RAM of the 5.83" and 7.5" (v1) black-white controllers.
+
+  0b11 (white) becomes 0x3, 0b00 (black) becomes 0x0, anything else 0x4.
+  """
+  data = numpy.frombuffer(bytes(buffer), dtype=numpy.uint8)
+  pixels = (data[:, None] >> numpy.array([6, 4, 2, 0], dtype=numpy.uint8)) & 3
+  lut = numpy.array([0x00, 0x04, 0x04, 0x03], dtype=numpy.uint8)
+  return _join_nibbles(lut[pixels])
+
+
+def merge_colour_4bpp(buffer_black, buffer_colour):
+  """Converts two 1bpp buffers (see pack_1bpp) to the 4 bits per pixel stream
+  expected by the RAM of the 5.83" and 7.5" (v1) colour controllers.
+
+  A cleared bit in the colour buffer becomes 0x4 (colour), a cleared bit in
+  the black buffer 0x0 (black), everything else 0x3 (white).
+  """
+  black = numpy.unpackbits(numpy.frombuffer(bytes(buffer_black),
+                                            dtype=numpy.uint8))
+  colour = numpy.unpackbits(numpy.frombuffer(bytes(buffer_colour),
+                                             dtype=numpy.uint8))
+  values = numpy.where(colour == 0, 0x04, numpy.where(black == 0, 0x00, 0x03))
+  return _join_nibbles(values.astype(numpy.uint8))
+
+
+def _as_rows(buffer, width, height):
+  """Returns a 1bpp buffer as numpy array of shape (height, width/8)"""
+  return numpy.frombuffer(bytes(buffer), dtype=numpy.uint8).reshape(
+    height, width // 8)
+
+
+def dirty_regions(old, new, width, height, max_gap=16):
+  """Finds the areas which differ between two 1bpp buffers (see pack_1bpp).
+
+  Changed rows are grouped into horizontal bands, rows with less than
+  `max_gap` unchanged rows between them end up in the same band. Each band
+  is narrowed down to the columns which actually changed.
+
+  Args:
+    - old: The buffer currently shown on the display.
+    - new: The buffer which should be shown next.
+    - width: The width of the panel in pixels (multiple of 8).
+    - height: The height of the panel in pixels.
+    - max_gap: Bands closer than this (in rows) are merged.
+
+  Returns:
+    A list of boxes (x0, y0, x1, y1) in panel coordinates with x1, y1
+    exclusive. x0 and x1 are multiples of 8. An empty list means that both
+    buffers are identical.
+  """
+  changed = _as_rows(old, width, height) != _as_rows(new, width, height)
+  rows = numpy.flatnonzero(changed.any(axis=1))
+
+  if not rows.size:
+    return []
+
+  breaks = numpy.flatnonzero(numpy.diff(rows) > max_gap)
+  starts = rows[numpy.concatenate(([0], breaks + 1))]
+  ends = rows[numpy.concatenate((breaks, [rows.size - 1]))]
+
+  regions = []
+  for start, end in zip(starts, ends):
+    columns = numpy.flatnonzero(changed[start:end + 1].any(axis=0))
+    regions.append((int(columns[0]) * 8, int(start),
+                    (int(columns[-1]) + 1) * 8, int(end) + 1))
+  return regions
+
+
+def crop(buffer, width, box):
+  """Returns the part of a 1bpp buffer covered by box (x0, y0, x1, y1).
+
+  x0 and x1 must be multiples of 8. The returned buffer is packed row by row
+  with (x1 - x0) / 8 bytes per row, the layout used for partial windows.
+  """
+  x0, y0, x1, y1 = box
+  rows = numpy.frombuffer(bytes(buffer), dtype=numpy.uint8).reshape(
+    -1, width // 8)
+  return bytearray(rows[y0:y1, x0 // 8:x1 // 8].tobytes())
+
+
+if __name__ == '__main__':
+  print(f'running {filename} in standalone mode')
@@ -35,6 +35,23 @@ import time
 filename = os.path.basename(__file__).split('.py')[0]
 logger = logging.getLogger(filename)
 
+# Largest transfer the spidev kernel driver accepts in one go (in bytes)
+SPIDEV_BUFSIZ_PATH = '/sys/module/spidev/parameters/bufsiz'
+DEFAULT_BUFSIZ = 4096
+
+def spi_chunk_size():
+    """Returns the spidev buffer limit, falling back to the kernel default"""
+    try:
+        with open(SPIDEV_BUFSIZ_PATH) as file:
+            return int(file.read().strip())
+    except (OSError, ValueError):
+        return DEFAULT_BUFSIZ
+
+def chunks(data, size):
+    """Splits data into consecutive slices of at most size bytes"""
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
 class RaspberryPi:
     # Pin definition
     RST_PIN         = 17
@@ -50,6 +67,7 @@ class RaspberryPi:
 
         # SPI device, bus = 0, device = 0
         self.SPI = spidev.SpiDev(0, 0)
+        self.chunk_size = spi_chunk_size()
 
     def digital_write(self, pin, value):
         self.GPIO.output(pin, value)
@@ -63,6 +81,18 @@ class RaspberryPi:
     def spi_writebyte(self, data):
         self.SPI.writebytes(data)
 
+    def spi_writebytes2(self, data):
+        # Stream a whole frame, one CS assertion per spidev sized chunk
+        # writebytes2 (spidev >= 3.4) accepts buffers without list conversion
+        write = getattr(self.SPI, 'writebytes2', None)
+        for chunk in chunks(data, self.chunk_size):
+            self.GPIO.output(self.CS_PIN, 0)
+            if write:
+                write(chunk)
+            else:
+                self.SPI.writebytes(list(chunk))
+            self.GPIO.output(self.CS_PIN, 1)
+
     def module_init(self):
         self.GPIO.setmode(self.GPIO.BCM)
         self.GPIO.setwarnings(False)
@@ -123,6 +153,15 @@ class JetsonNano:
     def spi_writebyte(self, data):
         self.SPI.SYSFS_software_spi_transfer(data[0])
 
+    def spi_writebytes2(self, data):
+        # Software SPI transfers byte by byte, but CS is only toggled per chunk
+        transfer = self.SPI.SYSFS_software_spi_transfer
+        for chunk in chunks(data, DEFAULT_BUFSIZ):
+            self.GPIO.output(self.CS_PIN, 0)
+            for byte in chunk:
+                transfer(byte)
+            self.GPIO.output(self.CS_PIN, 1)
+
     def module_init(self):
         self.GPIO.setmode(self.GPIO.BCM)
         self.GPIO.setwarnings(False)
@@ -144,13 +183,447 @@ class JetsonNano:
         self.GPIO.cleanup()
 
 
-if os.path.exists('/sys/bus/platform/drivers/gpiomem-bcm2835'):
-    implementation = RaspberryPi()
-else:
-    implementation = JetsonNano()
+class Mock:
+    """Hardware-free backend which records everything sent over SPI.
+
+    Selected by setting the environment variable INKYCAL_EPD_BACKEND=mock
+    before the drivers are imported. Every SPI transfer is stored in
+    `transfers` as a tuple (dc, bytes), where dc is 0 for commands and 1 for
+    data. The BUSY pin toggles on every read, so the busy loops of all drivers
+    exit immediately, regardless of their polarity.
+    """
+    # Pin definition
+    RST_PIN         = 17
+    DC_PIN          = 25
+    CS_PIN          = 8
+    BUSY_PIN        = 24
+
+    def __init__(self):
+        self.chunk_size = DEFAULT_BUFSIZ
+        self.pins = {}
+        self.reset_stats()
+
+    def reset_stats(self):
+        """Forget all recorded transfers and counters"""
+        self.transfers = []
+        self.gpio_writes = 0
+        self.cs_assertions = 0
+
+    def digital_write(self, pin, value):
+        self.gpio_writes += 1
+        if pin == self.CS_PIN and value == 0:
+            self.cs_assertions += 1
+        self.pins[pin] = value
+
+    def digital_read(self, pin):
+        self.pins[pin] = 0 if self.pins.get(pin, 0) else 1
+        return self.pins[pin]
+
+    def delay_ms(self, delaytime):
+        pass
+
+    def spi_writebyte(self, data):
+        self.transfers.append((self.pins.get(self.DC_PIN, 0),
+                               bytes(value & 0xFF for value in data)))
+
+    def spi_writebytes2(self, data):
+        for chunk in chunks(data, self.chunk_size):
+            self.digital_write(self.CS_PIN, 0)
+            self.spi_writebyte(chunk)
+            self.digital_write(self.CS_PIN, 1)
+
+    def commands(self):
+        """Returns the recorded stream as a list of (command, data) tuples"""
+        stream = []
+        for dc, data in self.transfers:
+            if dc == 0:
+                stream.extend((command, bytearray()) for command in data)
+            elif stream:
+                stream[-1][1].extend(data)
+        return stream
+
+    def module_init(self):
+        return 0
+
+    def module_exit(self):
+        logger.debug("mock module exit")
+
+# Timing model used by the Emulator, per E-Paper model:
+# - size: (width, height) of the panel
+# - busy_idle: level of the BUSY pin when the controller is idle
+# - ram: commands writing the frame RAM -> (plane, inverted). 4bpp panels use
+#   one RAM holding 4 bits per pixel (0x0 black, 0x3 white, 0x4 colour)
+# - refresh: command starting a refresh, refresh_ms: duration of a refresh
+# - display_bit: (SSD1677 only) bit of the last 0x22 value that tells a
+#   refresh apart from other actions started by the same command
+# - partial: controller family whose partial window commands are decoded
+#   ('uc8179' or 'ssd1677'), partial_ms: duration of a partial refresh
+# - ram_y: (SSD1677 only) the RAM is addressed like by the controller, with
+#   the address counters (0x4E/0x4F), data entry mode (0x11) and windows
+#   (0x44/0x45). (first, step, rows): row r of the panel shows RAM y
+#   (first + step * r) % rows, the layout of the full frames of the driver
+EMULATOR_MODELS = {
+    'epd_4_in_2': {'size': (400, 300), 'busy_idle': 1,
+        'ram': {0x13: ('black', False)}, 'refresh': 0x12, 'refresh_ms': 4000},
+    'epd_4_in_2_colour': {'size': (400, 300), 'busy_idle': 1,
+        'ram': {0x10: ('black', False), 0x13: ('colour', False)},
+        'refresh': 0x12, 'refresh_ms': 15000},
+    'epd_5_in_83': {'size': (600, 448), 'busy_idle': 1,
+        'ram': {0x10: ('4bpp', False)}, 'refresh': 0x12, 'refresh_ms': 6000},
+    'epd_5_in_83_colour': {'size': (600, 448), 'busy_idle': 1,
+        'ram': {0x10: ('4bpp', False)}, 'refresh': 0x12, 'refresh_ms': 16000},
+    'epd_7_in_5': {'size': (640, 384), 'busy_idle': 1,
+        'ram': {0x10: ('4bpp', False)}, 'refresh': 0x12, 'refresh_ms': 6000},
+    'epd_7_in_5_colour': {'size': (640, 384), 'busy_idle': 1,
+        'ram': {0x10: ('4bpp', False)}, 'refresh': 0x12, 'refresh_ms': 31000},
+    'epd_7_in_5_v2': {'size': (800, 480), 'busy_idle': 1,
+        'ram': {0x13: ('black', True)}, 'refresh': 0x12, 'refresh_ms': 5000,
+        'partial': 'uc8179', 'partial_ms': 1600},
+    'epd_7_in_5_v2_colour': {'size': (800, 480), 'busy_idle': 1,
+        'ram': {0x10: ('black', False), 0x13: ('colour', True)},
+        'refresh': 0x12, 'refresh_ms': 16000},
+    'epd_7_in_5_v3': {'size': (880, 528), 'busy_idle': 0,
+        'ram': {0x24: ('black', False)}, 'refresh': 0x20, 'refresh_ms': 5000,
+        'display_bit': 0x04, 'partial': 'ssd1677', 'partial_ms': 1000,
+        'ram_y': (0, -1, 0x2B0)},
+    'epd_7_in_5_v3_colour': {'size': (880, 528), 'busy_idle': 0,
+        'ram': {0x24: ('black', False), 0x26: ('colour', True)},
+        'refresh': 0x20, 'refresh_ms': 22000, 'display_bit': 0x04},
+    }
+
+# Size of the SSD1677 RAM (10 bit addresses), x in pixels
+SSD1677_RAM_SIZE = (1024, 1024)
+
+# Cost of the host side of a transfer, measured roughly on a Pi Zero
+EMULATOR_SPI_HZ = 4000000        # SPI clock set by RaspberryPi.module_init
+EMULATOR_GPIO_WRITE_US = 10      # one digital_write
+EMULATOR_SPI_CALL_US = 50        # overhead of one spidev write call
+
+
+class Emulator(Mock):
+    """Hardware-free backend emulating the E-Paper controller.
+
+    Selected by setting the environment variable INKYCAL_EPD_BACKEND=emulator
+    (or "epd_backend": "emulator" in the settings file). On top of recording
+    the SPI stream like Mock, the Emulator decodes the frame RAM writes back
+    into images and models the time a refresh would take on real hardware.
+    Nothing is slept, delays and BUSY latencies are only accounted for.
+    Partial windows of the 7.5" v2 and v3 controllers are decoded as well.
+
+    After each refresh, a report is appended to `refreshes` containing
+    whether it was a partial refresh, the transferred bytes, GPIO toggles,
+    SPI calls and the modelled wall time in ms. The decoded planes of the
+    last refresh are kept in `frames` as mode '1' images (black pixels are
+    the ones rendered in that plane).
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.model = None
+        self.refreshes = []
+        self.frames = {}
+        self._ram = {}
+        self._command = None
+        self._writing = None
+        self._params = bytearray()
+        self._window = None
+        self._reset_addressing()
+        self._partial_mode = False
+        self._update_control = 0
+        self._refresh_pending = None
+        self._reset_counters()
+
+    def set_model(self, model_name):
+        """Select the E-Paper model to emulate (see EMULATOR_MODELS)"""
+        if model_name not in EMULATOR_MODELS:
+            raise ValueError(f'no emulator timing model for {model_name}')
+        self.model = model_name
+        self._spec = EMULATOR_MODELS[model_name]
+
+    def _reset_addressing(self):
+        """SSD1677 registers after a reset: data entry mode 0x03 (x and y
+        increment, x first), windows over the whole RAM"""
+        width, height = SSD1677_RAM_SIZE
+        self._entry_mode = 0x03
+        self._ram_window = [(0, width - 1), (0, height - 1)]
+        self._address = [0, 0]
+
+    def _reset_counters(self):
+        self._stats = {'bytes': 0, 'spi_calls': 0, 'gpio_toggles': 0,
+                       'delay_ms': 0.0, 'busy_ms': 0.0}
+
+    def digital_write(self, pin, value):
+        super().digital_write(pin, value)
+        self._stats['gpio_toggles'] += 1
 
-for func in [x for x in dir(implementation) if not x.startswith('_')]:
-    setattr(sys.modules[__name__], func, getattr(implementation, func))
+    def digital_read(self, pin):
+        if self.model is None or pin != self.BUSY_PIN:
+            return super().digital_read(pin)
+
+        if self._refresh_pending:
+            partial = self._refresh_pending == 'partial'
+            self._refresh_pending = None
+            self._stats['busy_ms'] += self._spec[
+                'partial_ms' if partial else 'refresh_ms']
+            self._finish_refresh(partial)
+        return self._spec['busy_idle']
+
+    def delay_ms(self, delaytime):
+        self._stats['delay_ms'] += delaytime
+
+    def spi_writebyte(self, data):
+        super().spi_writebyte(data)
+        dc, data = self.transfers[-1]
+        self._stats['bytes'] += len(data)
+        self._stats['spi_calls'] += 1
+
+        if dc == 0:
+            for command in data:
+                self._handle_command(command)
+        elif self._writing is not None:
+            self._writing.extend(data)
+        else:
+            self._params.extend(data)
+
+    def _handle_command(self, command):
+        self._end_command()
+        self._command = command
+        if self.model is None:
+            return
+        if command in self._spec['ram']:
+            self._writing = bytearray()
+        elif command == self._spec['refresh']:
+            display_bit = self._spec.get('display_bit')
+            if not display_bit or self._update_control & display_bit:
+                self._refresh_pending = ('partial' if self._is_partial()
+                                         else 'full')
+
+    def _end_command(self):
+        """Apply the data sent after the previous command"""
+        if self._writing is not None:
+            self._store(self._command, self._writing)
+        elif self.model is not None:
+            self._apply_params(self._command, self._params)
+        self._writing = None
+        self._params = bytearray()
+
+    def _apply_params(self, command, params):
+        """Track the controller registers needed to decode the frame RAM"""
+        partial = self._spec.get('partial')
+        width, height = self._spec['size']
+
+        if command == 0x22 and params:
+            self._update_control = params[-1]
+
+        elif partial == 'uc8179':
+            if command == 0x91:
+                self._partial_mode = True
+            elif command == 0x92:
+                self._partial_mode = False
+                self._window = None
+            elif command == 0x90 and len(params) >= 8:
+                x0, x1, y0, y1 = [params[i] << 8 | params[i + 1]
+                                  for i in range(0, 8, 2)]
+                self._window = (x0, y0, x1 + 1, y1 + 1)
+
+        elif 'ram_y' in self._spec:
+            address = lambda i: (params[i] | params[i + 1] << 8) & 0x3FF
+            if command == 0x12:                 # software reset
+                self._reset_addressing()
+            elif command == 0x11 and params:
+                self._entry_mode = params[0]
+            elif command in (0x44, 0x45) and len(params) >= 4:
+                self._ram_window[command - 0x44] = (address(0), address(2))
+            elif command in (0x4E, 0x4F) and len(params) >= 2:
+                self._address[command - 0x4E] = address(0)
+
+    def _is_partial(self):
+        partial = self._spec.get('partial')
+        if partial == 'uc8179':
+            return self._partial_mode
+        if partial == 'ssd1677':
+            return self._update_control == 0xFF
+        return False
+
+    def _plane(self, command):
+        """Returns the RAM written by a command, padded to a full frame"""
+        width, height = self._spec['size']
+        plane, inverted = self._spec['ram'][command]
+        if 'ram_y' in self._spec:
+            first, step, rows = self._spec['ram_y']
+            ram = self._ssd1677_ram(command)
+            panel_rows = [(first + step * row) % rows for row in range(height)]
+            return ram[panel_rows, :width // 8].tobytes()
+        data = bytes(self._ram.get(command, b''))
+        if plane == '4bpp':
+            return data[:width * height // 2].ljust(width * height // 2,
+                                                    b'\x33')
+        return data[:width * height // 8].ljust(
+            width * height // 8, b'\x00' if inverted else b'\xff')
+
+    def _store(self, command, data):
+        """Writes data to the RAM of a command, into the window if one is set
+
+        Writes covering a whole frame always start at the top left corner.
+        """
+        import numpy
+
+        width, height = self._spec['size']
+        plane, inverted = self._spec['ram'][command]
+        full = width * height // (2 if plane == '4bpp' else 8)
+
+        if 'ram_y' in self._spec:
+            self._store_ssd1677(command, data)
+            return
+
+        if plane == '4bpp' or self._window is None or len(data) >= full:
+            self._ram[command] = data
+            return
+
+        x0, y0, x1, y1 = self._window
+        if not (0 <= x0 < x1 <= width and 0 <= y0 < y1 <= height):
+            logger.error(f'emulator: invalid RAM window {self._window}')
+            return
+        rows = numpy.frombuffer(self._plane(command), dtype=numpy.uint8)
+        rows = rows.reshape(height, width // 8).copy()
+        window = rows[y0:y1, x0 // 8:x1 // 8]
+        data = bytes(data[:window.size]).ljust(window.size, b'\x00')
+        window[:] = numpy.frombuffer(data, dtype=numpy.uint8).reshape(
+            window.shape)
+        self._ram[command] = bytearray(rows.tobytes())
+
+    def _ssd1677_ram(self, command):
+        """Returns the whole RAM of a command as array of rows of bytes"""
+        import numpy
+
+        if command not in self._ram:
+            width, height = SSD1677_RAM_SIZE
+            inverted = self._spec['ram'][command][1]
+            self._ram[command] = numpy.full(
+                (height, width // 8), 0x00 if inverted else 0xFF,
+                dtype=numpy.uint8)
+        return self._ram[command]
+
+    def _store_ssd1677(self, command, data):
+        """Writes data from the address counters on, like the SSD1677.
+
+        Each byte holds 8 pixels. The counters move as set by the data entry
+        mode: bit 0 / 1 increment x / y (else decrement), bit 2 moves y
+        first. A counter passing the end of its window jumps back to the
+        start of the window and moves the other counter by one.
+        """
+        import numpy
+
+        if not data:
+            return
+        steps = [8 if self._entry_mode & 0x01 else -8,
+                 1 if self._entry_mode & 0x02 else -1]
+        positions = []
+        for (start, end), step in zip(self._ram_window, steps):
+            if (end - start) * step < 0:
+                logger.error(f'emulator: RAM window {start}..{end} does not '
+                             'match the data entry mode')
+                return
+            positions.append(numpy.arange(start, end + step // abs(step),
+                                          step))
+
+        # the counter which moves first, the other one moves on its wrap
+        inner = 1 if self._entry_mode & 0x04 else 0
+        outer = 1 - inner
+        try:
+            first = [int(numpy.flatnonzero(axis == address)[0])
+                     for axis, address in zip(positions, self._address)]
+        except IndexError:
+            logger.error(f'emulator: RAM address {self._address} is outside '
+                         f'of the window {self._ram_window}')
+            return
+
+        count = numpy.arange(len(data)) + first[inner]
+        indices = [None, None]
+        indices[inner] = count % len(positions[inner])
+        indices[outer] = ((first[outer] + count // len(positions[inner])) %
+                          len(positions[outer]))
+        xs = positions[0][indices[0]]
+        ys = positions[1][indices[1]]
+
+        ram = self._ssd1677_ram(command)
+        ram[ys, xs // 8] = numpy.frombuffer(bytes(data), dtype=numpy.uint8)
+
+        # the counters point at the address after the last byte
+        following = [None, None]
+        following[inner] = (count[-1] + 1) % len(positions[inner])
+        following[outer] = ((first[outer] + (count[-1] + 1) //
+                             len(positions[inner])) % len(positions[outer]))
+        self._address = [int(positions[axis][following[axis]])
+                         for axis in (0, 1)]
+
+    def _finish_refresh(self, partial=False):
+        """Decode the frame RAM and store the report of this refresh"""
+        self.frames = self.decode()
+        stats = dict(self._stats, model=self.model, partial=partial)
+        spi_ms = stats['bytes'] * 8 / EMULATOR_SPI_HZ * 1000
+        host_ms = (stats['gpio_toggles'] * EMULATOR_GPIO_WRITE_US +
+                   stats['spi_calls'] * EMULATOR_SPI_CALL_US) / 1000
+        stats['spi_ms'] = spi_ms
+        stats['wall_ms'] = (spi_ms + host_ms + stats['delay_ms'] +
+                            stats['busy_ms'])
+        self.refreshes.append(stats)
+        logger.debug(f'emulated refresh: {stats}')
+        self._reset_counters()
+
+    def decode(self):
+        """Returns the current frame RAM as {plane: mode '1' image}"""
+        from PIL import Image
+        import numpy
+
+        width, height = self._spec['size']
+        frames = {}
+        for command, (plane, inverted) in self._spec['ram'].items():
+            data = self._plane(command)
+
+            if plane == '4bpp':
+                raw = numpy.frombuffer(data, dtype=numpy.uint8)
+                pixels = numpy.stack([raw >> 4, raw & 0x0F], axis=1)
+                pixels = pixels.reshape(height, width)
+                frames['black'] = Image.fromarray(pixels != 0x00)
+                frames['colour'] = Image.fromarray(pixels != 0x04)
+            else:
+                if inverted:
+                    data = bytes(byte ^ 0xFF for byte in data)
+                frames[plane] = Image.frombytes('1', (width, height), data)
+        return frames
+
+    def report(self):
+        """Returns totals over all emulated refreshes"""
+        keys = ['bytes', 'spi_calls', 'gpio_toggles', 'spi_ms', 'wall_ms']
+        totals = {key: sum(r[key] for r in self.refreshes) for key in keys}
+        totals['refreshes'] = len(self.refreshes)
+        return totals
+
+    def module_init(self):
+        # keep only the stream of the current refresh cycle in memory
+        self.transfers = []
+        return 0
+
+
+def use_implementation(backend_instance):
+    """Makes the given backend the one used by the drivers"""
+    global implementation
+    implementation = backend_instance
+    for func in [x for x in dir(implementation) if not x.startswith('_')]:
+        setattr(sys.modules[__name__], func, getattr(implementation, func))
+
+
+backend = os.environ.get('INKYCAL_EPD_BACKEND', '').lower()
+
+if backend == 'mock':
+    use_implementation(Mock())
+elif backend == 'emulator':
+    use_implementation(Emulator())
+elif os.path.exists('/sys/bus/platform/drivers/gpiomem-bcm2835'):
+    use_implementation(RaspberryPi())
+else:
+    use_implementation(JetsonNano())
 
 
 ### END OF FILE ###
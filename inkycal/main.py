@@ -11,11 +11,15 @@ import traceback
 import arrow
 import time
 import json
+import hashlib
 import logging
 from logging.handlers import RotatingFileHandler
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
 
 from inkycal.display import Display
 from inkycal.custom import *
+from inkycal.custom.cache import ModuleCache
+from inkycal.custom import connectivity
 from inkycal.modules.inky_image import Inkyimage as Images
 
 try:
@@ -88,6 +92,16 @@ class Inkycal:
   Attributes:
     - optimize = True/False. Reduce number of colours on the generated image
       to improve rendering on E-Papers. Set this to False for 9.7" E-Paper.
+    - save_images = True/False. Save the generated images in the /images
+      folder (in the background) for previews and debugging. Can be set with
+      "save_images" in the settings file, off by default.
+    - module_timeout = int. Seconds a module may take to generate its images
+      ("module_timeout" in the settings file, 60 by default). Can be set for
+      each module with "timeout" next to its "name" and "config".
+    - module_times = dict. The wall time in seconds each module took to
+      generate its images the last time -> {number: seconds}
+    - module_cache = ModuleCache. The last good images of each module, kept
+      in /cache. Used when a module fails, times out or after a restart.
   """
 
   def __init__(self, settings_path=None, render=True):
@@ -123,15 +137,24 @@ class Inkycal:
         return
 
 
+    # Load the fonts named in the settings while everything else starts up
+    prewarm_fonts(fonts_in_settings(settings))
+
     # Option to use epaper image optimisation, reduces colours
     self.optimize = True
 
     # Load drivers if image should be rendered
     if self.render == True:
 
+      # Use a hardware-free E-Paper backend if specified, e.g. "emulator"
+      if 'epd_backend' in settings:
+        os.environ['INKYCAL_EPD_BACKEND'] = settings['epd_backend']
+
       # Init Display class with model in settings file
       from inkycal.display import Display
-      self.Display = Display(settings["model"])
+      self.Display = Display(settings["model"],
+        partial_refresh = settings.get('partial_refresh', False),
+        full_refresh_every = settings.get('full_refresh_every', 10))
 
       # check if colours can be rendered
       self.supports_colour = True if 'colour' in settings['model'] else False
@@ -143,6 +166,9 @@ class Inkycal:
       self._calibration_state = False
 
     # Load and intialize modules specified in the settings file
+    self.module_timeout = settings.get('module_timeout', 60)
+    self._module_timeouts = {}
+    self._module_settings = {}
     self._module_number = 1
     for module in settings['modules']:
       module_name = module['name']
@@ -158,6 +184,9 @@ class Inkycal:
           width = module['config']['size'][0],
           height = module['config']['size'][1])))
 
+        self._module_timeouts[self._module_number] = module.get(
+          'timeout', self.module_timeout)
+        self._module_settings[self._module_number] = module
         self._module_number += 1
 
       # If a module was not found, print an error message
@@ -171,6 +200,37 @@ class Inkycal:
     # Path to store images
     self.image_folder = top_level+'/images'
 
+    # Images generated by each module -> {number: (black, colour)}
+    self._module_images = {}
+
+    # Optionally save images as PNG in the background
+    self.save_images = settings.get('save_images', False)
+    self._image_writer = None
+    self._pending_saves = []
+
+    # Modules generate their images in parallel, one thread each
+    self._module_pool = ThreadPoolExecutor(
+      max_workers=max(1, self._module_number-1),
+      thread_name_prefix='inkycal-module')
+    self._module_jobs = {}
+    self.module_times = {}
+
+    # When each module wants to be updated next and how its last update went
+    self._next_updates = {}
+    self._module_status = {}
+
+    # (hash of the modules' images and status, info text) of the last
+    # assembled image
+    self._shown_info = None
+
+    # Start with the last good images of each module from a previous run
+    self.module_cache = ModuleCache(top_level+'/cache')
+    for number in range(1, self._module_number):
+      cached = self.module_cache.get(number, self._module_settings[number])
+      if cached:
+        self._module_images[number] = cached[:2]
+    self._cached_modules = len(self._module_images)
+
     # Give an OK message
     print('loaded inkycal')
 
@@ -218,26 +278,26 @@ class Inkycal:
     # short info for info-section
     self.info = f"{arrow.now().format('D MMM @ HH:mm')}  "
 
-    for number in range(1, self._module_number):
+    for number, status in self._generate_images().items():
       name = eval(f"self.module_{number}.name")
-      module = eval(f'self.module_{number}')
       print(f'generating image(s) for {name}...', end="")
-      try:
-        black,colour=module.generate_image()
-        black.save(f"{self.image_folder}/module{number}_black.png", "PNG")
-        colour.save(f"{self.image_folder}/module{number}_colour.png", "PNG")
-        print('OK!')
-      except Exception as Error:
+      if status == 'OK':
+        black, colour = self._module_images[number]
+        self._save_images({f'module{number}_black': black,
+                           f'module{number}_colour': colour})
+        print(f'OK! ({self.module_times[number]:.1f}s)')
+      else:
         errors.append(number)
-        self.info += f"module {number}: Error!  "
-        print('Error!')
-        print(traceback.format_exc())
+        self.info += f"module {number}: {status}!  "
+        print(f'{status}!')
 
     if errors:
       print('Error/s in modules:',*errors)
     del errors
 
-    self._assemble()
+    im_black, im_colour = self._assemble()
+    self._save_images({'canvas': im_black, 'canvas_colour': im_colour})
+    self._wait_for_images()
 
   def run(self):
     """Runs main program in nonstop mode.
@@ -250,115 +310,310 @@ class Inkycal:
     # Get the time of initial run
     runtime = arrow.now()
 
-    # Function to flip images upside down
-    upside_down = lambda image: image.rotate(180, expand=True)
-
     # Count the number of times without any errors
     counter = 0
 
     print(f'Inkycal version: v{self._release}')
     print(f'Selected E-paper display: {self.settings["model"]}')
 
+    # Show the last good images of a previous run while the modules update
+    if self.render == True and self._cached_modules == self._module_number-1:
+      print('Showing cached images from the last run')
+      self.info = f"{arrow.now().format('D MMM @ HH:mm')}  cached images  "
+      self._render(*self._assemble())
+
+    # Has the display shown the current images of the modules yet?
+    rendered = False
+
     while True:
       current_time = arrow.now(tz=get_system_tz())
       print(f"Date: {current_time.format('D MMM YY')} | "
             f"Time: {current_time.format('HH:mm')}")
-      print('Generating images for all modules...', end='')
+
+      # Only modules whose data is due are generated again
+      due = self._due_modules(current_time)
+      previous = dict(self._module_images)
+      previous_status = dict(self._module_status)
+
+      if due:
+        # check the network once per cycle, shared by all modules
+        connectivity.monitor.invalidate()
+        print(f'Generating images for module(s) {due}...', end='')
+        self._module_status.update(self._generate_images(due))
+      else:
+        print('No module is due for an update')
 
       errors = [] # store module numbers in here
 
       # short info for info-section
       self.info = f"{current_time.format('D MMM @ HH:mm')}  "
 
-      for number in range(1, self._module_number):
-
-        name = eval(f"self.module_{number}.name")
-        module = eval(f'self.module_{number}')
+      for number, status in sorted(self._module_status.items()):
 
-        try:
-          black,colour=module.generate_image()
-          black.save(f"{self.image_folder}/module{number}_black.png", "PNG")
-          colour.save(f"{self.image_folder}/module{number}_colour.png", "PNG")
+        if status == 'OK':
+          if self.save_images and number in due:
+            black, colour = self._module_images[number]
+            self._save_images({f'module{number}_black': black,
+                               f'module{number}_colour': colour})
           self.info += f"module {number}: OK  "
-        except Exception as Error:
+        else:
           errors.append(number)
-          print('error!')
-          print(traceback.format_exc())
-          self.info += f"module {number}: error!  "
-          logger.exception(f'Exception in module {number}')
+          self.info += f"module {number}: {status}!  "
 
       if errors:
         print('error/s in modules:',*errors)
         counter = 0
-      else:
+      elif due:
         counter += 1
         print('successful')
       del errors
 
-      # Assemble image from each module - add info section if specified
-      self._assemble()
-
-      # Check if image should be rendered
-      if self.render == True:
-        Display = self.Display
-
-        self._calibration_check()
+      changed = [number for number in due if not self._same_images(
+        previous.get(number), self._module_images.get(number))]
 
-        if self.supports_colour == True:
-          im_black = Image.open(f"{self.image_folder}/canvas.png")
-          im_colour = Image.open(f"{self.image_folder}/canvas_colour.png")
+      # Check if the display has to be calibrated
+      calibrated = self.render == True and self._calibration_check()
 
-          # Flip the image by 180° if required
-          if self.settings['orientation'] == 180:
-            im_black = upside_down(im_black)
-            im_colour = upside_down(im_colour)
+      # Only assemble and show a new image if something changed, including
+      # the status of a module shown in the info-section
+      status_changed = self._module_status != previous_status
+      if changed or status_changed or calibrated or not rendered:
 
-          # render the image on the display
-          Display.render(im_black, im_colour)
+        # Assemble image from each module - add info section if specified
+        im_black, im_colour = self._assemble()
 
-        # Part for black-white ePapers
-        elif self.supports_colour == False:
+        if self.save_images:
+          self._save_images({'canvas': im_black, 'canvas_colour': im_colour})
 
-          im_black = self._merge_bands()
+        # Check if image should be rendered
+        if self.render == True:
+          self._render(im_black, im_colour)
+        rendered = True
 
-          # Flip the image by 180° if required
-          if self.settings['orientation'] == 180:
-            im_black = upside_down(im_black)
-
-          Display.render(im_black)
+      else:
+        print('Images of the modules did not change, not updating the display')
 
       print(f'\nNo errors since {counter} display updates \n'
             f'program started {runtime.humanize()}')
 
-      sleep_time = self.countdown()
+      if self.render == True and self.Display.skipped_refreshes:
+        print(f'{self.Display.skipped_refreshes} refreshes were skipped as '
+              'the image did not change')
+
+      logger.debug(f'font cache: {font_cache_statistics()}')
+
+      sleep_time = self._sleep_time()
       time.sleep(sleep_time)
 
-  def _merge_bands(self):
+  def _due_modules(self, now):
+    """Returns the numbers of the modules which should be updated now.
+
+    Modules are due if they have no image yet, their last update failed or
+    the time returned by their next_update has come.
+    """
+    return [number for number in range(1, self._module_number)
+            if self._module_status.get(number) != 'OK' or
+            self._next_updates.get(number) is None or
+            self._next_updates[number] <= now]
+
+  def _sleep_time(self):
+    """Returns the seconds to sleep until the next update.
+
+    Inkycal wakes up every update_interval minutes, or earlier if a module
+    wants to be updated before that (e.g. the calendar at midnight).
+    """
+    sleep_time = self.countdown()
+    wakeups = [wakeup for wakeup in self._next_updates.values() if wakeup]
+    if wakeups:
+      until_due = (min(wakeups) - arrow.now()).total_seconds()
+      if until_due < sleep_time:
+        sleep_time = max(0, int(until_due) + 1)
+        print(f'waking up in {sleep_time}s for the next module update')
+    return sleep_time
+
+  @staticmethod
+  def _same_images(images1, images2):
+    """Checks if two (black, colour) tuples contain the same pixels"""
+    if images1 is None or images2 is None:
+      return images1 is images2
+    return all(im1.size == im2.size and im1.mode == im2.mode and
+               im1.tobytes() == im2.tobytes()
+               for im1, im2 in zip(images1, images2))
+
+  def _render(self, im_black, im_colour):
+    """Shows the assembled images on the E-Paper display"""
+
+    # Function to flip images upside down
+    upside_down = lambda image: image.rotate(180, expand=True)
+
+    if self.supports_colour == True:
+
+      # Flip the image by 180° if required
+      if self.settings['orientation'] == 180:
+        im_black = upside_down(im_black)
+        im_colour = upside_down(im_colour)
+
+      # render the image on the display
+      self.Display.render(im_black, im_colour)
+
+    # Part for black-white ePapers
+    elif self.supports_colour == False:
+
+      im_black = self._merge_bands(im_black, im_colour)
+
+      # Flip the image by 180° if required
+      if self.settings['orientation'] == 180:
+        im_black = upside_down(im_black)
+
+      self.Display.render(im_black)
+
+  def _generate_images(self, numbers=None):
+    """Generates the images of the given modules in parallel.
+
+    Every module runs generate_image in its own thread and has to finish
+    within its timeout (counted from the start of this function). Images of
+    modules which finished in time are stored in self._module_images. Modules
+    which failed or timed out keep their previous images (if any), so a
+    stalled module does not hold back the others. Good images are also
+    stored in the module cache, to be used after a restart.
+
+    A module which is still busy from an earlier call is not started again
+    until it has finished, it counts as timed out in the meantime. Once such
+    a late call has finished, its images are used and stored like the ones
+    of a call that finished in time, then the module is started again.
+
+    After a successful update, the next_update of the module is asked when
+    it should be updated again (see _due_modules).
+
+    Args:
+      - numbers: The numbers of the modules to update, default all modules.
+
+    Returns:
+      dict -> {number: status}, status is one of 'OK', 'error' or 'timeout'
+    """
+    if numbers is None:
+      numbers = range(1, self._module_number)
+
+    start = time.monotonic()
+    now = arrow.now(tz=get_system_tz())
+
+    for number in numbers:
+      job = self._module_jobs.get(number)
+      if job is not None and job.done():
+        # a call which timed out earlier has finished in the meantime
+        del self._module_jobs[number]
+        if not job.exception():
+          logger.info(f'using the late images of module {number}')
+          self._store_images(number, *job.result(), now)
+      if number not in self._module_jobs:
+        module = eval(f'self.module_{number}')
+        self._module_jobs[number] = self._module_pool.submit(
+          self._timed_generate, number, module)
+
+    results = {}
+    for number in numbers:
+      job = self._module_jobs[number]
+      remaining = start + self._module_timeouts[number] - time.monotonic()
+      try:
+        black, colour = job.result(timeout=max(0, remaining))
+        del self._module_jobs[number]
+        self._store_images(number, black, colour, now)
+        results[number] = 'OK'
+      except TimeoutError:
+        results[number] = 'timeout'
+        print(f'module {number} did not finish within '
+              f'{self._module_timeouts[number]}s')
+        logger.error(f'Timeout in module {number}')
+      except Exception:
+        del self._module_jobs[number]
+        results[number] = 'error'
+        print(traceback.format_exc())
+        logger.exception(f'Exception in module {number}')
+
+      if results[number] != 'OK':
+        cached = self.module_cache.get(number, self._module_settings[number])
+        if cached:
+          age = arrow.get(cached[2]).humanize()
+          logger.info(f'using cached images of module {number} from {age}')
+
+    return results
+
+  def _store_images(self, number, black, colour, now):
+    """Keeps the new images of a module, in memory and in the module cache"""
+    self._module_images[number] = (black, colour)
+    self.module_cache.put(number, self._module_settings[number],
+                          black, colour)
+    self._next_updates[number] = self._next_update(number, now)
+
+  def _next_update(self, number, last_update):
+    """Returns when a module wants to be updated again, None for always"""
+    module = eval(f'self.module_{number}')
+    if not hasattr(module, 'next_update'):
+      return None
+    try:
+      return module.next_update(last_update)
+    except Exception:
+      logger.exception(f'Could not get the next update of module {number}')
+      return None
+
+  def _timed_generate(self, number, module):
+    """Runs generate_image of a module and records its wall time"""
+    started = time.perf_counter()
+    try:
+      return module.generate_image()
+    finally:
+      self.module_times[number] = time.perf_counter() - started
+      logger.info(f'module {number} took {self.module_times[number]:.2f}s')
+
+  def _merge_bands(self, im_black, im_colour):
     """Merges black and coloured bands for black-white ePapers
     returns the merged image
     """
 
-    im_path = images
+    im1 = im_black.convert('RGBA')
+    im2 = im_colour.convert('RGBA')
 
-    im1_path, im2_path = images+'canvas.png', images+'canvas_colour.png'
+    return Images.merge(im1, im2)
 
-    # If there is an image for black and colour, merge them
-    if os.path.exists(im1_path) and os.path.exists(im2_path):
+  def _save_images(self, images):
+    """Saves images as PNG in the image folder without blocking.
 
-      im1 = Image.open(im1_path).convert('RGBA')
-      im2 = Image.open(im2_path).convert('RGBA')
+    The images are copied and written by a single background thread, so the
+    caller can carry on (and modify the images) right away.
 
-      im1 = Images.merge(im1, im2)
-
-    # If there is no image for the coloured-band, return the bw-image
-    elif os.path.exists(im1_path) and not os.path.exists(im2_path):
-      im1 = Image.open(im1_name).convert('RGBA')
+    Args:
+      - images: dict -> {filename without .png: PIL Image}
+    """
+    if self._image_writer is None:
+      self._image_writer = ThreadPoolExecutor(
+        max_workers=1, thread_name_prefix='inkycal-images')
+
+    images = {name: image.copy() for name, image in images.items()}
+    self._pending_saves = [i for i in self._pending_saves if not i.done()]
+    self._pending_saves.append(
+      self._image_writer.submit(self._write_images, images))
+
+  def _write_images(self, images):
+    """Writes images to the image folder, runs in the background"""
+    for name, image in images.items():
+      try:
+        image.save(f"{self.image_folder}/{name}.png", "PNG")
+      except Exception:
+        logger.exception(f'Could not save {name}.png')
 
-    return im1
+  def _wait_for_images(self):
+    """Blocks until all images passed to _save_images were written"""
+    for future in self._pending_saves:
+      future.result()
+    self._pending_saves = []
 
 
   def _assemble(self):
-    """Assembles all sub-images to a single image"""
+    """Assembles all sub-images to a single image
+
+    Uses the images generated by the modules, kept in memory.
+    Returns a tuple (im_black, im_colour) with the size of the display.
+    """
 
     # Create 2 blank images with the same resolution as the display
     width, height = Display.get_display_size(self.settings["model"])
@@ -375,15 +630,14 @@ class Inkycal:
 
     for number in range(1, self._module_number):
 
-      # get the path of the current module's generated images
-      im1_path = f"{self.image_folder}/module{number}_black.png"
-      im2_path = f"{self.image_folder}/module{number}_colour.png"
+      # get the current module's generated images, if there are any
+      im1, im2 = self._module_images.get(number, (None, None))
 
       # Check if there is an image for the black band
-      if os.path.exists(im1_path):
+      if im1 is not None:
 
         # Get actual size of image
-        im1 = Image.open(im1_path).convert('RGBA')
+        im1 = im1.convert('RGBA')
         im1_size = im1.size
 
         # Get the size of the section
@@ -406,10 +660,10 @@ class Inkycal:
         im1_cursor += section_size[1]
 
       # Check if there is an image for the coloured band
-      if os.path.exists(im2_path):
+      if im2 is not None:
 
         # Get actual size of image
-        im2 = Image.open(im2_path).convert('RGBA')
+        im2 = im2.convert('RGBA')
         im2_size = im2.size
 
         # Get the size of the section
@@ -438,20 +692,31 @@ class Inkycal:
     if self.settings['info_section'] == True:
       info_height = self.settings["info_section_height"]
       info_width = width
-      font = self.font = ImageFont.truetype(
+      font = self.font = get_font(
         fonts['NotoSansUI-Regular'], size = 14)
 
+      # Keep the info of the last change while the modules show the same
+      # with the same status, else the time in the info-section would make
+      # every frame different
+      status = repr(sorted(self._module_status.items())).encode()
+      content = hashlib.blake2b(im_black.tobytes() + im_colour.tobytes() +
+                                status, digest_size=16).digest()
+      if self._shown_info and self._shown_info[0] == content:
+        info = self._shown_info[1]
+      else:
+        info = self.info
+        self._shown_info = (content, info)
+
       info_x = im_black.size[1] - info_height
       write(im_black, (0, info_x), (info_width, info_height),
-            self.info, font = font)
+            info, font = font)
 
     # optimize the image by mapping colours to pure black and white
     if self.optimize == True:
       im_black = self._optimize_im(im_black)
       im_colour = self._optimize_im(im_colour)
 
-    im_black.save(self.image_folder+'/canvas.png', 'PNG')
-    im_colour.save(self.image_folder+'/canvas_colour.png', 'PNG')
+    return im_black, im_colour
 
   def _optimize_im(self, image, threshold=220):
     """Optimize the image for rendering on ePaper displays"""
@@ -482,8 +747,10 @@ class Inkycal:
     if now.hour in self._calibration_hours and self._calibration_state == False:
       self.calibrate()
       self._calibration_state = True
+      return True
     else:
       self._calibration_state = False
+      return False
 
 
   @classmethod
@@ -14,10 +14,19 @@ Copyright by aceisace
 """
 
 import arrow
+from bisect import bisect_left
 from urllib.request import urlopen
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+import hashlib
+import sys
+import threading
 import logging
 import time
 import os
+import requests
+from datetime import datetime, timedelta
+from dateutil import rrule, tz
 
 try:
   import recurring_ical_events
@@ -35,6 +44,591 @@ except ModuleNotFoundError:
 filename = os.path.basename(__file__).split('.py')[0]
 logger = logging.getLogger(filename)
 
+
+class Fetcher:
+  """Downloads iCalendars for all modules over one pool of connections.
+
+  Connections are kept alive between requests (requests.Session), several
+  URLs are downloaded in parallel and the ETag / Last-Modified headers sent
+  by the server are used for conditional requests. If a calendar did not
+  change, the server answers with 304 and the last download is used.
+
+  Statistics are kept in `stats`:
+    - requests: number of requests sent
+    - hits: calendars which did not change (304)
+    - misses: calendars which were downloaded (200)
+    - errors: failed requests (the last download is used, if there is one)
+    - bytes: downloaded bytes
+
+  Args:
+    - max_workers: The max. number of parallel downloads.
+    - timeout: Timeout in seconds for each request.
+  """
+
+  def __init__(self, max_workers=4, timeout=30):
+    self.timeout = timeout
+    self.max_workers = max_workers
+    self.session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=max_workers,
+                                            pool_maxsize=max_workers)
+    self.session.mount('http://', adapter)
+    self.session.mount('https://', adapter)
+
+    # url -> {'etag', 'last_modified', 'text'} of the last download
+    self._downloads = {}
+    # url -> size in bytes (None if unknown), see size
+    self._sizes = {}
+    self._lock = threading.Lock()
+    self.reset_stats()
+
+  def reset_stats(self):
+    """Resets all counters in stats"""
+    self.stats = {'requests': 0, 'hits': 0, 'misses': 0, 'errors': 0,
+                  'bytes': 0}
+
+  def _count(self, key, value=1):
+    with self._lock:
+      self.stats[key] += value
+
+  def fetch(self, url, username=None, password=None):
+    """Downloads an iCalendar and returns it as text.
+
+    Returns:
+      (text, changed) -> changed is False if the server reported that the
+      calendar did not change since the last download.
+    """
+    if not url.startswith(('http://', 'https://')):
+      # e.g. file:// URLs, not handled by requests
+      self._count('requests')
+      self._count('misses')
+      return str(urlopen(url).read().decode()), True
+
+    last = self._downloads.get(url)
+    headers = {}
+    if last and last['etag']:
+      headers['If-None-Match'] = last['etag']
+    if last and last['last_modified']:
+      headers['If-Modified-Since'] = last['last_modified']
+
+    auth = (username, password) if username or password else None
+
+    self._count('requests')
+    try:
+      response = self.session.get(url, headers=headers, auth=auth,
+                                  timeout=self.timeout)
+      if response.status_code == 304 and last:
+        self._count('hits')
+        logger.debug(f'{url} did not change')
+        return last['text'], False
+      response.raise_for_status()
+
+    except requests.RequestException as error:
+      self._count('errors')
+      if not last:
+        raise
+      logger.warning(f'Could not download {url}, using last download: {error}')
+      return last['text'], False
+
+    self._count('misses')
+    self._count('bytes', len(response.content))
+    self._sizes[url] = len(response.content)
+    text = response.content.decode('utf-8')
+    self._downloads[url] = {
+      'etag': response.headers.get('ETag'),
+      'last_modified': response.headers.get('Last-Modified'),
+      'text': text}
+    return text, True
+
+  def stream(self, url, username=None, password=None):
+    """Downloads an iCalendar and yields it line by line (as text).
+
+    The calendar is never kept in memory as a whole, so conditional
+    requests are not possible and every call downloads it again.
+    """
+    self._count('requests')
+    received = 0
+    try:
+      if not url.startswith(('http://', 'https://')):
+        with urlopen(url) as response:
+          for line in response:
+            received += len(line)
+            yield line.decode('utf-8')
+      else:
+        auth = (username, password) if username or password else None
+        with self.session.get(url, auth=auth, timeout=self.timeout,
+                              stream=True) as response:
+          response.raise_for_status()
+          for line in response.iter_lines(chunk_size=64 * 1024):
+            received += len(line)
+            yield line.decode('utf-8')
+    except requests.RequestException:
+      self._count('errors')
+      raise
+
+    self._count('misses')
+    self._count('bytes', received)
+    self._sizes[url] = received
+
+  def size(self, url, username=None, password=None):
+    """Returns the size of an iCalendar in bytes, None if it is not known.
+
+    This is the size of the last download, or (only if the URL was never
+    downloaded) the Content-Length sent for a HEAD request. HEAD requests
+    are not counted in stats.
+    """
+    if url in self._sizes:
+      return self._sizes[url]
+    size = None
+    if url.startswith(('http://', 'https://')):
+      auth = (username, password) if username or password else None
+      try:
+        response = self.session.head(url, auth=auth, timeout=self.timeout,
+                                     allow_redirects=True)
+        if response.ok and response.headers.get('Content-Length'):
+          size = int(response.headers['Content-Length'])
+      except (requests.RequestException, ValueError) as error:
+        logger.debug(f'Could not get the size of {url}: {error}')
+    self._sizes[url] = size
+    return size
+  def fetch_all(self, urls, username=None, password=None):
+    """Downloads several iCalendars in parallel, see fetch.
+
+    Returns a list of (text, changed) in the same order as urls.
+    """
+    if len(urls) == 1:
+      return [self.fetch(urls[0], username, password)]
+
+    with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+      return list(pool.map(lambda url: self.fetch(url, username, password),
+                           urls))
+
+
+# Shared by all iCalendar instances (and therefore all modules)
+fetcher = Fetcher()
+
+
+class ParsedCalendar:
+  """A parsed iCalendar and the recurrences expanded from it so far.
+
+  Recurrences are expanded in blocks of one month. Each block is expanded
+  only once, so overlapping time windows (e.g. this month and the next four
+  weeks) reuse the occurrences of the blocks they share.
+  """
+
+  # max. number of expanded months kept per calendar
+  max_blocks = 24
+
+  def __init__(self, calendar):
+    self.calendar = calendar
+    self._blocks = OrderedDict()
+    self._lock = threading.Lock()
+
+  def _block(self, year, month):
+    """Returns the occurrences overlapping the given month"""
+    with self._lock:
+      if (year, month) in self._blocks:
+        self._blocks.move_to_end((year, month))
+        cache_stats['expand_hits'] += 1
+        return self._blocks[(year, month)]
+
+    following = (year + 1, 1) if month == 12 else (year, month + 1)
+    events = recurring_ical_events.of(self.calendar).between(
+      (year, month, 1), following + (1,))
+
+    with self._lock:
+      cache_stats['expand_misses'] += 1
+      self._blocks[(year, month)] = events
+      while len(self._blocks) > self.max_blocks:
+        self._blocks.popitem(last=False)
+    return events
+
+  def between(self, t_start, t_end):
+    """Returns the occurrences of all months touched by t_start...t_end.
+
+    This is a superset of the events in the time window, the caller has to
+    filter them. Events spanning several months are only returned once:
+    an occurrence is dropped if the same (serialized) occurrence was
+    returned by an earlier month. Equal events within one month are kept.
+    """
+    months = []
+    year, month = t_start.year, t_start.month
+    while (year, month) <= (t_end.year, t_end.month):
+      months.append((year, month))
+      year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+    if len(months) == 1:
+      return list(self._block(*months[0]))
+
+    events, seen = [], set()
+    for block in months:
+      keys = set()
+      for event in self._block(*block):
+        key = event.to_ical()
+        keys.add(key)
+        if key not in seen:
+          events.append(event)
+      seen |= keys
+    return events
+
+
+# Parsed iCalendars by sha1 of their text, the most recently used last
+_parsed_calendars = OrderedDict()
+# id of a parsed icalendar -> its ParsedCalendar
+_parsed_by_id = {}
+_parsed_lock = threading.Lock()
+max_parsed_calendars = 16
+
+cache_stats = {'parse_hits': 0, 'parse_misses': 0,
+               'expand_hits': 0, 'expand_misses': 0}
+
+
+def parse_ical(text):
+  """Parses an iCalendar, returns the same object for the same text.
+
+  Calendars are cached by the hash of their content, so calendars which did
+  not change are neither parsed nor their recurrences expanded again.
+  """
+  key = hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+  with _parsed_lock:
+    parsed = _parsed_calendars.get(key)
+    if parsed:
+      _parsed_calendars.move_to_end(key)
+      cache_stats['parse_hits'] += 1
+      return parsed.calendar
+
+  parsed = ParsedCalendar(Calendar.from_ical(text))
+
+  with _parsed_lock:
+    cache_stats['parse_misses'] += 1
+    _parsed_calendars[key] = parsed
+    _parsed_by_id[id(parsed.calendar)] = parsed
+    while len(_parsed_calendars) > max_parsed_calendars:
+      _, old = _parsed_calendars.popitem(last=False)
+      del _parsed_by_id[id(old.calendar)]
+  return parsed.calendar
+
+
+def _unfold(lines):
+  """Joins folded content lines (RFC 5545, 3.1), yields logical lines"""
+  pending = None
+  for line in lines:
+    line = line.rstrip('\r\n')
+    if line[:1] in (' ', '\t'):
+      if pending is not None:
+        pending += line[1:]
+      continue
+    if pending:
+      yield pending
+    pending = line
+  if pending:
+    yield pending
+
+
+def _as_utc(value):
+  """Converts a date or (naive) datetime to an aware datetime in UTC"""
+  if not isinstance(value, datetime):
+    value = datetime(value.year, value.month, value.day)
+  if value.tzinfo is None:
+    return value.replace(tzinfo=tz.UTC)
+  return value.astimezone(tz.UTC)
+
+
+def _may_intersect(event, t_start, t_end):
+  """Checks if an event can have an occurrence between t_start and t_end.
+
+  All times are compared in UTC with a margin of one day, as all-day and
+  floating events are later placed in the local timezone. The check is
+  conservative: events are only rejected if they certainly end before or
+  begin after the window.
+  """
+  if 'DTSTART' not in event:
+    return True
+
+  dtstart = event['DTSTART'].dt
+  begin = _as_utc(dtstart)
+  if 'DTEND' in event:
+    end = _as_utc(event['DTEND'].dt)
+  elif 'DURATION' in event:
+    end = begin + event['DURATION'].dt
+  elif not isinstance(dtstart, datetime):
+    end = begin + timedelta(days=1)
+  else:
+    end = begin
+  duration = max(end - begin, timedelta(0))
+
+  margin = timedelta(days=1)
+  t_start, t_end = t_start - margin, t_end + margin
+
+  if begin >= t_end:
+    return False
+
+  if 'RECURRENCE-ID' in event:
+    # a moved occurrence also replaces the one at its original time
+    original = _as_utc(event['RECURRENCE-ID'].dt)
+    return end > t_start or t_start <= original < t_end
+
+  if 'RRULE' not in event or 'RDATE' in event:
+    return end > t_start or 'RDATE' in event
+
+  # a series ends before the window if UNTIL/COUNT leave no occurrence after
+  # t_start - duration
+  rule_text = event['RRULE'].to_ical().decode()
+  after = t_start - duration
+  # dateutil wants UNTIL and DTSTART both aware or both naive
+  for start, after in ((begin, after),
+                       (begin.replace(tzinfo=None), after.replace(tzinfo=None))):
+    try:
+      rule = rrule.rrulestr(rule_text, dtstart=start)
+      return rule.after(after) is not None
+    except (ValueError, TypeError):
+      continue
+  return True
+
+
+def stream_ical(lines, timeline_start, timeline_end):
+  """Parses an iCalendar one event at a time, keeping only the events which
+  can occur between timeline_start and timeline_end.
+
+  Meant for very large calendars: each VEVENT is parsed and checked on its
+  own and dropped right away if it ends before or starts after the window,
+  including recurring events whose UNTIL/COUNT ends before the window.
+  Memory use therefore depends on the events in the window, not on the size
+  of the calendar.
+
+  Args:
+    - lines: An iterable of the lines of the calendar, e.g. an open file
+      or Fetcher.stream.
+    - timeline_start, timeline_end: arrow objects of the window.
+
+  Returns:
+    An icalendar Calendar with the remaining events.
+  """
+  t_start = timeline_start.to('UTC').datetime
+  t_end = timeline_end.to('UTC').datetime
+
+  header, events = [], []
+  block, skip, dropped = None, None, 0
+
+  for line in _unfold(lines):
+    name = line.upper()
+    if skip:
+      # VTODO and VJOURNAL are not shown by Inkycal
+      if name == f'END:{skip}':
+        skip = None
+    elif block is not None:
+      block.append(line)
+      if name == 'END:VEVENT':
+        event = Event.from_ical('\r\n'.join(block))
+        block = None
+        if _may_intersect(event, t_start, t_end):
+          events.append(event)
+        else:
+          dropped += 1
+    elif name == 'BEGIN:VEVENT':
+      block = [line]
+    elif name in ('BEGIN:VTODO', 'BEGIN:VJOURNAL'):
+      skip = name[6:]
+    elif name != 'END:VCALENDAR':
+      # calendar properties and (small) VTIMEZONE components
+      header.append(line)
+
+  calendar = Calendar.from_ical('\r\n'.join(header + ['END:VCALENDAR']))
+  for event in events:
+    calendar.add_component(event)
+
+  logger.debug(f'streamed iCalendar: kept {len(events)} events, '
+               f'dropped {dropped}')
+  return calendar
+
+
+class EventRecord:
+  """A compact parsed event.
+
+  Begin and end are kept as unix timestamps, the all-day flag is computed
+  once when the event is parsed and titles are interned. The arrow objects
+  of begin and end are only created (in the timezone of the event) when
+  they are used, usually when the event is drawn.
+
+  Events can be used like the dicts returned before, i.e. event['title'],
+  event['begin'] and event['end'] work as well.
+  """
+
+  __slots__ = ('title', 'begin_ts', 'end_ts', 'all_day', 'tzinfo',
+               '_begin', '_end')
+
+  _keys = ('title', 'begin', 'end')
+
+  def __init__(self, title, begin_ts, end_ts, all_day=False, tzinfo=None):
+    self.title = sys.intern(title)
+    self.begin_ts = begin_ts
+    self.end_ts = end_ts
+    self.all_day = all_day
+    self.tzinfo = tzinfo if tzinfo is not None else tz.UTC
+    self._begin = self._end = None
+
+  @property
+  def begin(self):
+    if self._begin is None:
+      self._begin = arrow.Arrow.fromtimestamp(self.begin_ts, self.tzinfo)
+    return self._begin
+
+  @property
+  def end(self):
+    if self._end is None:
+      self._end = arrow.Arrow.fromtimestamp(self.end_ts, self.tzinfo)
+    return self._end
+
+  def __getitem__(self, key):
+    if key not in self._keys:
+      raise KeyError(key)
+    return getattr(self, key)
+
+  def __contains__(self, key):
+    return key in self._keys
+
+  def get(self, key, default=None):
+    return getattr(self, key) if key in self._keys else default
+
+  def __repr__(self):
+    return (f'EventRecord({self.title!r}, {self.begin_ts}, {self.end_ts}, '
+            f'all_day={self.all_day})')
+
+
+_epoch = datetime(1970, 1, 1)
+
+
+def _wall_clock(value):
+  """Returns a date or datetime as naive datetime (its wall clock)"""
+  if not isinstance(value, datetime):
+    return datetime(value.year, value.month, value.day)
+  return value.replace(tzinfo=None)
+
+
+def _instant(value):
+  """Returns the timestamp of a date or datetime, naive ones are UTC"""
+  if isinstance(value, datetime) and value.tzinfo is not None:
+    return value.timestamp()
+  return (_wall_clock(value) - _epoch).total_seconds()
+
+
+def _local(wall, tzinfo):
+  """Returns the timestamp of a wall clock time in the timezone tzinfo"""
+  return (wall - _epoch - tzinfo.utcoffset(wall)).total_seconds()
+
+
+def make_record(event, tzinfo):
+  """Creates an EventRecord from an icalendar VEVENT (or an occurrence
+  expanded by recurring_ical_events) for the timezone tzinfo.
+
+  Events starting at midnight (e.g. all-day events) keep their wall clock
+  in tzinfo, all others are converted to tzinfo.
+  """
+  dtstart, dtend = event.get('DTSTART').dt, event.get('DTEND').dt
+  begin_wall = _wall_clock(dtstart)
+
+  if begin_wall.hour == begin_wall.minute == 0:
+    end_wall = _wall_clock(dtend)
+    begin_ts, end_ts = _local(begin_wall, tzinfo), _local(end_wall, tzinfo)
+    all_day = (end_wall.hour == end_wall.minute == 0 and
+               (end_wall - begin_wall).days >= 1)
+  else:
+    begin_ts, end_ts = _instant(dtstart), _instant(dtend)
+    all_day = False
+
+  return EventRecord(str(event.get('SUMMARY', '')).lstrip(), begin_ts, end_ts,
+                     all_day, tzinfo)
+
+
+def _timestamps(event):
+  """Returns begin and end of an EventRecord or event dict as timestamps"""
+  if isinstance(event, EventRecord):
+    return event.begin_ts, event.end_ts
+  return event['begin'].float_timestamp, event['end'].float_timestamp
+
+
+class EventIndex:
+  """Interval index of parsed events for range queries.
+
+  Events are kept sorted by their beginning. An implicit balanced binary
+  tree over this list stores the latest end within each subtree (augmented
+  interval tree), so finding the k events overlapping a time window takes
+  O(log n + k) instead of scanning all events.
+
+  Args:
+    - events: EventRecords (or dicts with 'begin' and 'end' arrow objects).
+  """
+
+  def __init__(self, events=()):
+    events = list(events)
+    spans = [_timestamps(event) for event in events]
+    order = sorted(range(len(events)), key=lambda number: spans[number][0])
+    self.events = [events[number] for number in order]
+    self._begins = [spans[number][0] for number in order]
+    self._ends = [spans[number][1] for number in order]
+    # latest end of the subtree whose root is at this position
+    self._max_ends = list(self._ends)
+    self._build(0, len(self.events))
+
+  def __len__(self):
+    return len(self.events)
+
+  def _build(self, lo, hi):
+    if lo >= hi:
+      return None
+    mid = (lo + hi) // 2
+    for latest in (self._build(lo, mid), self._build(mid + 1, hi)):
+      if latest is not None and latest > self._max_ends[mid]:
+        self._max_ends[mid] = latest
+    return self._max_ends[mid]
+
+  def _search(self, lo, hi, start, end, found):
+    if lo >= hi:
+      return
+    mid = (lo + hi) // 2
+    if self._max_ends[mid] <= start:
+      # everything in this subtree ended before the window
+      return
+    self._search(lo, mid, start, end, found)
+    if self._begins[mid] < end:
+      if self._ends[mid] > start:
+        found.append(self.events[mid])
+      self._search(mid + 1, hi, start, end, found)
+
+  def overlapping(self, t_start, t_end):
+    """Returns the events which end after t_start and begin before t_end,
+    sorted by their beginning"""
+    found = []
+    self._search(0, len(self.events), t_start.float_timestamp,
+                 t_end.float_timestamp, found)
+    return found
+
+  def starting(self, t_start, t_end):
+    """Returns the events beginning between t_start (incl.) and t_end"""
+    return self.events[bisect_left(self._begins, t_start.float_timestamp):
+                       bisect_left(self._begins, t_end.float_timestamp)]
+
+  def upcoming(self, t, count=None):
+    """Returns the next `count` events which did not end at time t, events
+    which are already running at t first"""
+    running = self.overlapping(t, t)
+    first = bisect_left(self._begins, t.float_timestamp)
+    last = None if count is None else first + max(count - len(running), 0)
+    return (running + self.events[first:last])[:count]
+
+  def days_with_events(self, month_start, month_end):
+    """Returns the sorted day numbers between month_start and month_end
+    (arrow objects, in the timezone to use) on which any event takes place"""
+    days = set()
+    for event in self.overlapping(month_start, month_end):
+      day = max(event['begin'], month_start).to(month_start.tzinfo).floor('day')
+      last = min(event['end'], month_end)
+      while day < last:
+        days.add(day.day)
+        day = day.shift(days=1)
+    return sorted(days)
+
+
 class iCalendar:
   """iCalendar parsing moudule for inkycal.
   Parses events from given iCalendar URLs / paths"""
@@ -42,52 +636,64 @@ class iCalendar:
   def __init__(self):
     self.icalendars = []
     self.parsed_events = []
+    self.index = EventIndex()
 
-  def load_url(self, url, username=None, password=None):
+  def load_url(self, url, username=None, password=None, timeline_start=None,
+               timeline_end=None):
     """Input a string or list of strings containing valid iCalendar URLs
     example: 'URL1' (single url) OR ['URL1', 'URL2'] (multiple URLs)
     add username and password to access protected files
+
+    URLs are downloaded in parallel by the shared fetcher, which skips the
+    download and parsing of calendars that did not change (see Fetcher).
+
+    For very large calendars, pass the arrow objects timeline_start and
+    timeline_end: the calendars are then streamed and only events which can
+    occur in this window are kept (see stream_ical).
     """
 
     if type(url) == list:
-      if (username == None) and (password == None):
-        ical = [Calendar.from_ical(str(urlopen(_).read().decode()))
-                                   for _ in url]
-      else:
-        ical = [auth_ical(each_url, username, password) for each_url in url]
+      urls = url
     elif type(url) == str:
-      if (username == None) and (password == None):
-        ical = [Calendar.from_ical(str(urlopen(url).read().decode()))]
-      else:
-        ical = [auth_ical(url, username, password)]
+      urls = [url]
     else:
       raise Exception (f"Input: '{url}' is not a string or list!")
 
+    if timeline_start and timeline_end:
+      self.icalendars += [
+        stream_ical(fetcher.stream(url, username, password), timeline_start,
+                    timeline_end) for url in urls]
+      logger.info('streamed iCalendars from URLs')
+      return
 
-    def auth_ical(url, uname, passwd):
-      """Authorisation helper for protected ical files"""
-
-      # Credit to Joshka
-      password_mgr = urllib.request.HTTPPasswordMgrWithDefaultRealm()
-      password_mgr.add_password(None, url, username, password)
-      handler = urllib.request.HTTPBasicAuthHandler(password_mgr)
-      opener = urllib.request.build_opener(handler)
-      ical = Calendar.from_ical(str(opener.open(url).read().decode()))
-      return ical
+    # Download with the shared fetcher, parsing is cached by content
+    ical = [parse_ical(text) for text, changed in
+            fetcher.fetch_all(urls, username, password)]
 
     # Add the parsed icalendar/s to the self.icalendars list
     if ical: self.icalendars += ical
     logger.info('loaded iCalendars from URLs')
 
-  def load_from_file(self, filepath):
+  def load_from_file(self, filepath, timeline_start=None, timeline_end=None):
     """Input a string or list of strings containing valid iCalendar filepaths
     example: 'path1' (single file) OR ['path1', 'path2'] (multiple files)
     returns a list of iCalendars as string (raw)
+
+    Pass timeline_start and timeline_end to stream large files, see load_url.
     """
+    if timeline_start and timeline_end:
+      paths = filepath if type(filepath) == list else [filepath]
+      for path in paths:
+        with open(path, encoding='utf-8') as file:
+          self.icalendars.append(
+            stream_ical(file, timeline_start, timeline_end))
+      logger.info('streamed iCalendars from filepaths')
+      return
+
     if type(filepath) == list:
-      ical = [Calendar.from_ical(str(open(path).read())) for path in filepath]
+      ical = [parse_ical(str(open(path).read())) for path in filepath]
     elif type(filepath) == str:
-      ical = [Calendar.from_ical(str(open(filepath).read()))]
+      ical = [parse_ical(str(open(filepath).read()))]
     else:
       raise Exception (f"Input: '{filepath}' is not a string or list!")
 
@@ -119,31 +725,32 @@ class iCalendar:
     t_start_recurring = fmt(t_start)
     t_end_recurring = fmt(t_end)
 
-    # Fetch recurring events
-    recurring_events = (recurring_ical_events.of(ical).between(
-                        t_start_recurring, t_end_recurring)
-                        for ical in self.icalendars)
+    # Fetch recurring events, reusing earlier expansions of parsed calendars
+    def expand(ical):
+      parsed = _parsed_by_id.get(id(ical))
+      if parsed and parsed.calendar is ical:
+        return parsed.between(t_start, t_end)
+      return recurring_ical_events.of(ical).between(
+        t_start_recurring, t_end_recurring)
 
-    events = (
-      {
-      'title': events.get('SUMMARY').lstrip(),
+    recurring_events = (expand(ical) for ical in self.icalendars)
 
-      'begin': arrow.get(events.get('DTSTART').dt).to(timezone) if (
-        arrow.get(events.get('dtstart').dt).format('HH:mm') != '00:00')
-        else arrow.get(events.get('DTSTART').dt).replace(tzinfo=timezone),
-
-      'end':arrow.get(events.get("DTEND").dt).to(timezone) if (
-        arrow.get(events.get('dtstart').dt).format('HH:mm') != '00:00')
-        else arrow.get(events.get('DTEND').dt).replace(tzinfo=timezone)
-
-      } for ical in recurring_events for events in ical)
+    # Compact records, converted to arrow objects only when they are drawn
+    tzinfo = arrow.now(timezone).tzinfo
+    start_ts, end_ts = t_start.float_timestamp, t_end.float_timestamp
+    events = (make_record(event, tzinfo)
+              for ical in recurring_events for event in ical)
 
+    # only keep events in the timeline (expansions cover whole months)
+    events = [event for event in events
+              if event.end_ts > start_ts and event.begin_ts < end_ts]
 
     # if any recurring events were found, add them to parsed_events
-    if events: self.parsed_events += list(events)
+    if events: self.parsed_events += events
 
     # Sort events by their beginning date
     self.sort()
+    self.index = EventIndex(self.parsed_events)
 
     return self.parsed_events
 
@@ -153,27 +760,40 @@ class iCalendar:
       logger.debug('no events found to be sorted')
     else:
       # sort events by date
-      by_date = lambda event: event['begin']
+      by_date = lambda event: _timestamps(event)[0]
       self.parsed_events.sort(key=by_date)
 
 
+  @staticmethod
+  def fetch_statistics():
+    """Returns the download statistics of the shared fetcher (a copy)"""
+    return dict(fetcher.stats)
+
+  @staticmethod
+  def cache_statistics():
+    """Returns hits/misses of the parsed-calendar and expansion caches"""
+    return dict(cache_stats)
+
   def clear_events(self):
     """clear previously parsed events"""
 
     self.parsed_events = []
+    self.index = EventIndex()
 
   @staticmethod
   def all_day(event):
     """Check if an event is an all day event.
     Returns True if event is all day, else False
     """
+    if isinstance(event, EventRecord):
+      return event.all_day
     if not ('end' and 'begin') in event:
       print('Events must have a starting and ending time')
       raise Exception('This event is not valid!')
     else:
       begin, end = event['begin'], event['end']
       duration = end - begin
-      if (begin.format('HH:mm') == '00:00' and end.format('HH:mm') == '00:00'
+      if (begin.hour == begin.minute == 0 and end.hour == end.minute == 0
           and duration.days >= 1):
         return True
       else:
@@ -209,5 +829,155 @@ class iCalendar:
           title, ' ' * (line_width - len(title)), begin, end))
 
 
+class EventStore:
+  """Process-wide store of iCalendar events, shared by all modules.
+
+  Modules subscribe with their iCalendar URLs and files and then ask their
+  subscription for the events of a time window. Sources used by several
+  modules are only loaded once: each source is downloaded (in parallel) and
+  parsed at most once every `max_age` seconds, i.e. once per update of
+  Inkycal, and the recurrence expansions of a calendar are shared between
+  all windows asking for it (see ParsedCalendar).
+
+  Sources larger than `stream_size` bytes are streamed instead (see
+  stream_ical), keeping only the events of the window a module asks for.
+  If another module asks for a window which is not covered, the source is
+  streamed again for both windows.
+
+  Args:
+    - max_age: Seconds a loaded source is used before it is loaded again.
+    - stream_size: Sources with more bytes are streamed, None to never
+      stream them.
+
+  >>> events = event_store.subscribe(urls, files)
+  >>> events.get(arrow.now(), arrow.now().shift(weeks=4), timezone)
+  """
+
+  def __init__(self, max_age=60, stream_size=4 * 1024 * 1024):
+    self.max_age = max_age
+    self.stream_size = stream_size
+    # source -> (time of loading, parsed icalendar, window), the window is
+    # (timeline_start, timeline_end) for streamed sources, else None
+    self._sources = {}
+    self._lock = threading.Lock()
+
+  def subscribe(self, urls=None, files=None):
+    """Returns a Subscription to the events of the given sources.
+
+    Args:
+      - urls: A list of iCalendar URLs (or None).
+      - files: A list of iCalendar filepaths (or None).
+    """
+    sources = [('url', url) for url in urls or []]
+    sources += [('file', path) for path in files or []]
+    # remove duplicates, keep the order
+    return Subscription(self, list(dict.fromkeys(sources)))
+
+  def calendars(self, sources, timeline_start=None, timeline_end=None):
+    """Returns the parsed icalendars of the given sources.
+
+    Sources which were loaded less than max_age seconds ago are reused, all
+    others are loaded now (URLs in parallel). Calling this from several
+    modules at the same time loads each source only once.
+
+    Large sources are only streamed if timeline_start and timeline_end (arrow
+    objects) are given, the returned calendars then only contain the events
+    which can occur in this window.
+    """
+    window = None
+    if timeline_start and timeline_end:
+      window = (timeline_start, timeline_end)
+
+    with self._lock:
+      now = time.monotonic()
+      stale, streamed = [], {}
+      for source in sources:
+        last = self._sources.get(source)
+        fresh = last is not None and now - last[0] <= self.max_age
+        if fresh and (last[2] is None or _covers(last[2], window)):
+          continue
+        if window and (last and last[2] or self._is_large(source)):
+          if fresh:
+            # keep the events of the other modules using this source
+            streamed[source] = (min(window[0], last[2][0]),
+                                max(window[1], last[2][1]))
+          else:
+            streamed[source] = window
+        else:
+          stale.append(source)
+
+      urls = [name for kind, name in stale if kind == 'url']
+      texts = [text for text, _ in fetcher.fetch_all(urls)] if urls else []
+      loaded = dict(zip(urls, texts))
+
+      for kind, name in stale:
+        if kind == 'url':
+          text = loaded[name]
+        else:
+          with open(name) as file:
+            text = file.read()
+        self._sources[(kind, name)] = (time.monotonic(), parse_ical(text),
+                                       None)
+
+      for (kind, name), (start, end) in streamed.items():
+        if kind == 'url':
+          calendar = stream_ical(fetcher.stream(name), start, end)
+        else:
+          with open(name, encoding='utf-8') as file:
+            calendar = stream_ical(file, start, end)
+        logger.info(f'streamed {name} from {start} to {end}')
+        self._sources[(kind, name)] = (time.monotonic(), calendar,
+                                       (start, end))
+
+      return [self._sources[source][1] for source in sources]
+
+  def _is_large(self, source):
+    """Checks if a source has more than stream_size bytes"""
+    if self.stream_size is None:
+      return False
+    kind, name = source
+    if kind == 'url':
+      size = fetcher.size(name)
+    else:
+      size = os.path.getsize(name)
+    return size is not None and size > self.stream_size
+
+  def clear(self):
+    """Forgets all loaded sources, they are loaded again on next use"""
+    with self._lock:
+      self._sources = {}
+
+
+def _covers(window, other):
+  """Checks if the window (start, end) contains the other window"""
+  return other is not None and window[0] <= other[0] and other[1] <= window[1]
+
+
+class Subscription:
+  """The sources of one module in the EventStore"""
+
+  def __init__(self, store, sources):
+    self.store = store
+    self.sources = sources
+
+  def get(self, timeline_start, timeline_end, timezone=None):
+    """Returns the events between timeline_start and timeline_end sorted
+    by their beginning, see iCalendar.get_events"""
+    return self.index(timeline_start, timeline_end, timezone).events
+
+  def index(self, timeline_start, timeline_end, timezone=None):
+    """Returns the events between timeline_start and timeline_end as an
+    EventIndex, for several queries on one expansion"""
+    parser = iCalendar()
+    parser.icalendars = self.store.calendars(self.sources, timeline_start,
+                                             timeline_end)
+    parser.get_events(timeline_start, timeline_end, timezone)
+    return parser.index
+
+
+# Shared by all modules showing events
+event_store = EventStore()
+
+
 if __name__ == '__main__':
   print(f'running {filename} in standalone mode')
@@ -18,6 +18,213 @@ import logging
 filename = os.path.basename(__file__).split('.py')[0]
 logger = logging.getLogger(filename)
 
+# The colour each palette token adds to black and white
+palette_colours = {
+  'bwr': (255, 0, 0),
+  'bwy': (255, 255, 0),
+  'bw': None,
+  }
+
+# Palettes for quantizing have 256 colours. They repeat white, black, the
+# colour and black again (the padding to a divisor of 256), so the band of
+# each palette index can be told by its last two bits.
+_band_lut = numpy.array([0b11, 0b10, 0b01, 0b10] * 64, dtype=numpy.uint8)
+_palette_images = {}
+
+
+def _palette_image(palette):
+  """Returns a 1x1 'P' image with the palette used to quantize images"""
+  if palette not in _palette_images:
+    colour = list(palette_colours[palette])
+    palette_im = Image.new('P', (1,1))
+    palette_im.putpalette([255,255,255, 0,0,0, *colour, 0,0,0] * 64)
+    _palette_images[palette] = palette_im
+  return _palette_images[palette]
+
+
+# Error diffusion kernels: (dy, dx, weight) of the pixels that receive the
+# quantization error of a pixel, and the sum the weights are divided by
+kernels = {
+  'floyd-steinberg': ([(0, 1, 7), (1, -1, 3), (1, 0, 5), (1, 1, 1)], 16),
+  # only 6/8 of the error is passed on, which keeps more contrast
+  'atkinson': ([(0, 1, 1), (0, 2, 1), (1, -1, 1), (1, 0, 1), (1, 1, 1),
+                (2, 0, 1)], 8),
+  'sierra-lite': ([(0, 1, 2), (1, -1, 1), (1, 0, 1)], 4),
+  }
+
+dither_methods = tuple(kernels) + ('ordered',)
+
+# Frames with more pixels are dithered with the ordered method when
+# `dither='auto'` is used, the others with Floyd-Steinberg
+auto_ordered_pixels = 800 * 480
+
+
+def _bayer_matrix(size):
+  """Returns the size x size Bayer threshold matrix with values 0..size²-1"""
+  matrix = numpy.zeros((1, 1), dtype=numpy.int32)
+  while len(matrix) < size:
+    matrix = numpy.block([[4 * matrix, 4 * matrix + 2],
+                          [4 * matrix + 3, 4 * matrix + 1]])
+  return matrix
+
+# Threshold offsets added to the pixels before they are mapped to the
+# nearest colour, spread evenly between -128 and 127
+_bayer = numpy.rint(255 * ((_bayer_matrix(8) + 0.5) / 64 - 0.5)).astype(
+  numpy.int16)
+
+# Maps quantized palette indices to 0 (white), 1 (black) and 2 (colour)
+_colour_lut = numpy.array([0, 1, 2, 1] * 64, dtype=numpy.uint8)
+
+
+def _palette_matrix(palette):
+  """Returns the image mode and the colours (white, black, colour) of a
+  palette as rows of a matrix"""
+  if palette_colours[palette]:
+    return 'RGB', numpy.array([(255, 255, 255), (0, 0, 0),
+                               palette_colours[palette]], dtype=numpy.float32)
+  return 'L', numpy.array([(255,), (0,)], dtype=numpy.float32)
+
+
+def _nearest(colours):
+  """Returns a function giving the index of the nearest colour of each row
+  of values"""
+  # |v - c|² = |v|² - 2 v·c + |c|², where |v|² is the same for all colours
+  weights = -2 * colours.T
+  norms = (colours ** 2).sum(axis=1)
+
+  def nearest(values):
+    scores = values @ weights
+    scores += norms
+    return scores.argmin(axis=-1).astype(numpy.uint8)
+  return nearest
+
+
+def _ordered(pixels, palette):
+  """Ordered dithering with an 8x8 Bayer matrix.
+
+  The threshold offsets are added to all pixels at once, then PIL maps them
+  to the nearest colour of the palette without diffusing errors.
+  """
+  height, width = pixels.shape[:2]
+  offsets = _bayer[numpy.arange(height)[:, None] % 8, numpy.arange(width) % 8]
+  pixels = pixels.astype(numpy.int16) + offsets[..., None]
+  numpy.clip(pixels, 0, 255, out=pixels)
+
+  if not palette_colours[palette]:
+    # the nearest of white and black
+    return (pixels[..., 0] < 128).astype(numpy.uint8)
+
+  shifted = Image.fromarray(pixels.astype(numpy.uint8))
+  quantized = shifted.quantize(palette=_palette_image(palette), dither=False)
+  return _colour_lut[numpy.asarray(quantized)]
+
+
+def _diffuse(pixels, colours, kernel):
+  """Error diffusion, in the same order as a pixel by pixel scan.
+
+  A pixel only needs the errors of pixels left of it and in rows above,
+  which all come before it on the anti-diagonal x + 2y. Pixels on the same
+  anti-diagonal are independent and processed together, so there are
+  width + 2*height vectorized steps instead of width*height. The pixels are
+  stored by anti-diagonal, so each step and its sources are contiguous.
+  """
+  offsets, divisor = kernel
+  height, width, channels = pixels.shape
+  diagonals = width + 2 * height - 2
+
+  # rows of the first and last pixel on each anti-diagonal and where it
+  # starts in the reordered pixels
+  first = [max(0, (d - width + 2) // 2) for d in range(diagonals)]
+  last = [min(height - 1, d // 2) for d in range(diagonals)]
+  starts = numpy.cumsum([0] + [l - f + 1 for f, l in zip(first, last)])
+  starts = starts.tolist()
+
+  y, x = numpy.indices((height, width)).reshape(2, -1)
+  order = numpy.argsort(x + 2 * y, kind='stable')
+  # Once a pixel is mapped to a colour, its value is replaced by its error
+  buffer = pixels.reshape(-1, channels)[order].astype(numpy.float32)
+  chosen = numpy.empty(height * width, dtype=numpy.uint8)
+  nearest = _nearest(colours)
+
+  sources = [(dy, dx + 2 * dy, weight / divisor)
+             for dy, dx, weight in offsets]
+
+  for d in range(diagonals):
+    start, end, top = starts[d], starts[d + 1], first[d]
+    value = buffer[start:end]
+    for dy, shift, weight in sources:
+      source = d - shift
+      if source < 0:
+        continue
+      # rows in both this anti-diagonal and (shifted by dy) the source one
+      low = max(top, first[source] + dy)
+      high = min(last[d], last[source] + dy)
+      if low > high:
+        continue
+      begin = starts[source] + low - dy - first[source]
+      value[low-top:high-top+1] += (
+        weight * buffer[begin:begin+high-low+1])
+    numpy.minimum(value, 255, out=value)
+    numpy.maximum(value, 0, out=value)
+    indices = nearest(value)
+    chosen[start:end] = indices
+    value -= colours[indices]
+
+  result = numpy.empty(height * width, dtype=numpy.uint8)
+  result[order] = chosen
+  return result.reshape(height, width)
+
+
+def dither_image(image, palette, method='floyd-steinberg'):
+  """Dithers an image to a palette.
+
+  Args:
+    - image: A PIL Image object.
+    - palette: 'bw', 'bwr' or 'bwy'.
+    - method: One of dither_methods. 'ordered' is the fastest, the error
+      diffusion kernels give smoother gradients.
+
+  Returns:
+    - A numpy array (height x width) of palette indices: 0 for white, 1 for
+      black and 2 for the colour.
+
+  Raises:
+    - ValueError if the palette or method is not supported
+  """
+  if palette not in palette_colours:
+    raise ValueError(f'The palette {palette} is not supported.')
+  if method not in dither_methods:
+    raise ValueError(f'The dithering method {method} is not supported.')
+
+  mode, colours = _palette_matrix(palette)
+  pixels = numpy.asarray(image.convert(mode)).reshape(
+    image.height, image.width, -1)
+
+  if method == 'ordered':
+    return _ordered(pixels, palette)
+  return _diffuse(pixels, colours, kernels[method])
+
+
+def _reduce_on_load(image, side):
+  """Reduces an opened image while both its sides stay at least `side` long.
+
+  JPEG images are decoded at 1/2, 1/4 or 1/8 scale (draft mode), which is
+  much faster and needs less memory than decoding the full image. Other
+  images (e.g. PNGs) are reduced by a power of two with a box filter after
+  decoding. Palette images are kept as they are, their indices can not be
+  averaged.
+  """
+  if image.format == 'JPEG':
+    image.draft(image.mode, (side, side))
+
+  factor = 1
+  while min(image.size) // (factor * 2) >= side:
+    factor *= 2
+  if factor > 1 and image.mode in ('L', 'LA', 'RGB', 'RGBA'):
+    image = image.reduce(factor)
+  return image
+
+
 class Inkyimage:
   """Custom Imge class written for commonly used image operations.
   """
@@ -31,12 +238,16 @@ class Inkyimage:
     # give an OK message
     logger.info(f'{filename} loaded')
 
-  def load(self, path):
+  def load(self, path, size=None):
     """loads an image from a URL or filepath.
 
     Args:
       - path:The full path or url of the image file
         e.g. `https://sample.com/logo.png` or `/home/pi/Downloads/nice_pic.png`
+      - size:->(width, height). The size the image will be shown at. Large
+        images are reduced while loading, as long as both sides stay at least
+        as long as the longer side of size. The image can then still be
+        flipped and resized without upscaling.
 
     Raises:
       - FileNotFoundError: This Exception is raised when the file could not be
@@ -63,6 +274,10 @@ class Inkyimage:
 
     logger.info(f'width: {image.width}, height: {image.height}')
 
+    if size:
+      image = _reduce_on_load(image, max(size))
+      logger.info(f'reduced image to {image.width}x{image.height}')
+
     image.convert(mode='RGBA') #convert to a more suitable format
     self.image = image
     logger.info('loaded Image')
@@ -217,20 +432,28 @@ class Inkyimage:
     return image1
 
 
-  def to_palette(self, palette, dither=True):
+  def to_palette(self, palette, dither=True, packed=False):
     """Maps an image to a given colour palette.
 
-    Maps each pixel from the image to a colour from the palette.
+    Maps each pixel from the image to a colour from the palette. The image is
+    quantized once, both bands are then taken from the palette indices in a
+    single pass, without intermediate RGB copies.
 
     Args:
       - palette: A supported token. (see below)
-      - dither:->bool. Use dithering? Set to `False` for solid colour fills.
+      - dither: Use dithering? Set to `False` for solid colour fills. `True`
+        uses Floyd-Steinberg, a name from dither_methods selects the method
+        and 'auto' uses 'ordered' for images larger than auto_ordered_pixels.
+      - packed:->bool. Return packed bit buffers instead of images?
 
     Returns:
-      - two images: one for the coloured band and one for the black band.
+      - two mode '1' images: one for the black band and one for the coloured
+        band. With `packed=True`, two bytes objects instead: 8 pixels per
+        byte, the leftmost in the most significant bit, set bits are white
+        and each row starts at a new byte (like the 1bpp display buffers).
 
     Raises:
-      - ValueError if palette token is not supported
+      - ValueError if palette token or dithering method is not supported
 
     Supported palette tokens:
 
@@ -240,92 +463,49 @@ class Inkyimage:
     """
     # Check if an image is loaded
     if self._image_loaded():
-      image = self.image.convert('RGB')
+      image = self.image
+      if image.mode != 'RGB':
+        image = image.convert('RGB')
     else:
       logger.error('No image loaded')
 
-    if palette == 'bwr':
-      # black-white-red palette
-      pal = [255,255,255, 0,0,0, 255,0,0]
-
-    elif palette == 'bwy':
-      # black-white-yellow palette
-      pal = [255,255,255, 0,0,0, 255,255,0]
-
-    elif palette == 'bw':
-      pal = None
-
-    else:
+    if palette not in palette_colours:
       logger.error('The given palette is unsupported.')
       raise ValueError('The given palette is not supported.')
 
-    if pal:
-      # The palette needs to have 256 colors, for this, the black-colour
-      # is added until the
-      colours = len(pal) // 3
-      #print(f'The palette has {colours} colours')
-
-      if 256 % colours != 0:
-        #print('Filling palette with black')
-        pal += (256 % colours) * [0,0,0]
-
-      #print(pal)
-      colours = len(pal) // 3
-      #print(f'The palette now has {colours} colours')
-
-      # Create a dummy image to be used as a palette
-      palette_im = Image.new('P', (1,1))
-
-      # Attach the created palette. The palette should have 256 colours
-      # equivalent to 768 integers
-      palette_im.putpalette(pal* (256//colours))
-
-      # Quantize the image to given palette
-      quantized_im = image.quantize(palette=palette_im, dither=dither)
-      quantized_im = quantized_im.convert('RGB')
-
-      # get rgb of the non-black-white colour from the palette
-      rgb = [pal[x:x+3] for x in range(0, len(pal),3)]
-      rgb = [col for col in rgb if col != [0,0,0] and col != [255,255,255]][0]
-      r_col, g_col, b_col = rgb
-      #print(f'r:{r_col} g:{g_col} b:{b_col}')
-
-      # Create an image buffer for black pixels
-      buffer1 = numpy.array(quantized_im)
-
-      # Get RGB values of each pixel
-      r,g,b = buffer1[:, :, 0], buffer1[:, :, 1], buffer1[:, :, 2]
-
-      # convert coloured pixels to white
-      buffer1[numpy.logical_and(r==r_col, g==g_col)] = [255,255,255]
-
-      # reconstruct image for black-band
-      im_black = Image.fromarray(buffer1)
-
-      # Create a buffer for coloured pixels
-      buffer2 = numpy.array(quantized_im)
-
-      # Get RGB values of each pixel
-      r,g,b = buffer2[:, :, 0], buffer2[:, :, 1], buffer2[:, :, 2]
-
-      # convert black pixels to white
-      buffer2[numpy.logical_and(r==0, g==0)] = [255,255,255]
-
-      # convert non-white pixels to black
-      buffer2[numpy.logical_and(g==g_col, b==0)] = [0,0,0]
-
-      # reconstruct image for colour-band
-      im_colour = Image.fromarray(buffer2)
-
-      #self.preview(im_black)
-      #self.preview(im_colour)
-
+    if dither == 'auto':
+      large = image.width * image.height > auto_ordered_pixels
+      dither = 'ordered' if large else 'floyd-steinberg'
+
+    # Floyd-Steinberg and no dithering are left to PIL, which is faster
+    if dither == 'floyd-steinberg' or not isinstance(dither, str):
+      dither = bool(dither)
+      if palette_colours[palette]:
+        # Quantize the image to the palette, giving one index per pixel
+        quantized_im = image.quantize(palette=_palette_image(palette),
+                                      dither=dither)
+        indices = numpy.asarray(quantized_im)
+      else:
+        indices = None
+        buffer_black = image.convert('1', dither=dither).tobytes()
+        buffer_colour = b'\xff' * len(buffer_black)
     else:
-      im_black = image.convert('1', dither=dither)
-      im_colour = Image.new(mode='RGB', size=im_black.size, color='white')
+      indices = dither_image(image, palette, dither)
+
+    if indices is not None:
+      # Look up both bands at once: bit 0 is set if the pixel is white in
+      # the black band, bit 1 if it is white in the coloured band
+      bands = _band_lut[indices]
+      buffer_black = numpy.packbits(bands & 1, axis=1).tobytes()
+      buffer_colour = numpy.packbits(bands >> 1, axis=1).tobytes()
 
     logger.info('mapped image to specified palette')
 
+    if packed:
+      return buffer_black, buffer_colour
+
+    im_black = Image.frombytes('1', image.size, buffer_black)
+    im_colour = Image.frombytes('1', image.size, buffer_colour)
     return im_black, im_colour
 
 
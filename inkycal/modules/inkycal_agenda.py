@@ -7,7 +7,7 @@ Copyright by aceisace
 
 from inkycal.modules.template import inkycal_module
 from inkycal.custom import *
-from inkycal.modules.ical_parser import iCalendar
+from inkycal.modules.ical_parser import iCalendar, event_store
 
 import calendar as cal
 import arrow
@@ -82,9 +82,19 @@ class Agenda(inkycal_module):
     # Additional config
     self.timezone = get_system_tz()
 
+    # Get events from the store shared with other modules
+    self.events = event_store.subscribe(self.ical_urls, self.ical_files)
+
     # give an OK message
     print(f'{filename} loaded')
 
+  def next_update(self, last_update):
+    """The agenda shows all events of today onwards, so it changes when the
+    date does, or when the events in the iCalendars change"""
+    midnight = last_update.to(self.timezone).floor('day').shift(days=+1)
+    following = super().next_update(last_update)
+    return min(midnight, following) if following else None
+
   def generate_image(self):
     """Generate image for this module"""
 
@@ -117,23 +127,10 @@ class Agenda(inkycal_module):
          self.date_format,locale=self.language)}
       for _ in range(max_lines)]
 
-    # Load icalendar from config
-    self.ical = iCalendar()
-    parser = self.ical
-
-    if self.ical_urls:
-      parser.load_url(self.ical_urls)
-
-    if self.ical_files:
-      parser.load_from_file(self.ical_files)
-
-    # Load events from all icalendar in timerange
-    upcoming_events = parser.get_events(today, agenda_events[-1]['begin'],
-                                        self.timezone)
-
-    # Sort events by beginning time
-    parser.sort()
-    #parser.show_events()
+    # Load events from all icalendar in timerange, sorted by beginning time
+    index = self.events.index(today, agenda_events[-1]['begin'],
+                              self.timezone)
+    upcoming_events = index.events
 
     # Set the width for date, time and event titles
     date_width = int(max([self.font.getsize(
@@ -167,12 +164,16 @@ class Agenda(inkycal_module):
       x_event = date_width + time_width
       logger.debug(f'x-event: {x_event}')
 
-      # Merge list of dates and list of events
-      agenda_events += upcoming_events
-
-      # Sort the combined list in chronological order of dates
-      by_date = lambda event: event['begin']
-      agenda_events.sort(key = by_date)
+      # Merge list of dates and list of events in chronological order:
+      # events running since before today first, then each date followed
+      # by the events beginning on it
+      dates, agenda_events = agenda_events, index.overlapping(today, today)
+      for date in dates:
+        if len(agenda_events) >= max_lines:
+          break
+        agenda_events.append(date)
+        agenda_events += index.starting(date['begin'],
+                                        date['begin'].shift(days=1))
 
       # Delete more entries than can be displayed (max lines)
       del agenda_events[max_lines:]
@@ -199,7 +200,7 @@ class Agenda(inkycal_module):
           time = _['begin'].format(self.time_format, locale=self.language)
 
           # Check if event is all day, if not, add the time
-          if parser.all_day(_) == False:
+          if iCalendar.all_day(_) == False:
             write(im_black, (x_time, line_pos[cursor][1]),
                 (time_width, line_height), time,
                 font = self.font, alignment='left')
@@ -6,6 +6,7 @@ Copyright by aceisace
 """
 from inkycal.modules.template import inkycal_module
 from inkycal.custom import *
+from inkycal.modules.ical_parser import iCalendar, event_store
 
 import calendar as cal
 import arrow
@@ -82,12 +83,32 @@ class Calendar(inkycal_module):
 
     # additional configuration
     self.timezone = get_system_tz()
-    self.num_font = ImageFont.truetype(
+
+    # Get events from the store shared with other modules
+    if self.show_events == True:
+      self.events = event_store.subscribe(self.ical_urls, self.ical_files)
+    self.num_font = get_font(
       fonts['NotoSans-SemiCondensed'], size = self.fontsize)
 
     # give an OK message
     print(f'{filename} loaded')
 
+  def next_update(self, last_update):
+    """The calendar changes at midnight, the events section (if shown)
+    whenever an event ends. Updates happen at least every refresh_interval
+    minutes, or on every update of Inkycal if none is configured"""
+    midnight = last_update.to(self.timezone).floor('day').shift(days=+1)
+    following = super().next_update(last_update)
+    if not following:
+      return None
+
+    wakeups = [midnight, following]
+    if self.show_events == True:
+      wakeups += [event['end'] for event in
+                  getattr(self, '_upcoming_events', [])
+                  if event['end'] > last_update]
+    return min(wakeups)
+
   def generate_image(self):
     """Generate image for this module"""
 
@@ -218,9 +239,6 @@ class Calendar(inkycal_module):
       elif len(cal.monthcalendar(now.year, now.month)) == 4:
         events_height += icon_height * 2
 
-      # import the ical-parser
-      from inkycal.modules.ical_parser import iCalendar
-
       # find out how many lines can fit at max in the event section
       line_spacing = 0
       max_event_lines = events_height // (self.font.getsize('hg')[1] +
@@ -237,27 +255,18 @@ class Calendar(inkycal_module):
       # timeline for filtering events within this month
       month_start = arrow.get(now.floor('month'))
       month_end = arrow.get(now.ceil('month'))
+      upcoming_end = now.shift(weeks=4)
 
-      # fetch events from given icalendars
-      self.ical = iCalendar()
-      parser = self.ical
-
-      if self.ical_urls:
-        parser.load_url(self.ical_urls)
-      if self.ical_files:
-        parser.load_from_file(self.ical_files)
+      # Expand events once for this month and the next 4 weeks, both are
+      # then queried from the same index
+      index = self.events.index(month_start, max(month_end, upcoming_end),
+                                self.timezone)
 
       # Filter events for full month (even past ones) for drawing event icons
-      month_events = parser.get_events(month_start, month_end, self.timezone)
-      parser.sort()
-      self.month_events = month_events
+      self.month_events = index.overlapping(month_start, month_end)
 
       # find out on which days of this month events are taking place
-      days_with_events = [int(events['begin'].format('D')) for events in
-                          month_events]
-
-      # remove duplicates (more than one event in a single day)
-      list(set(days_with_events)).sort()
+      days_with_events = index.days_with_events(month_start, month_end)
       self._days_with_events = days_with_events
 
       # Draw a border with specified parameters around days with events
@@ -272,15 +281,12 @@ class Calendar(inkycal_module):
             shrinkage = (0.4, 0.2)
             )
 
-      # Filter upcoming events until 4 weeks in the future
-      parser.clear_events()
-      upcoming_events = parser.get_events(now, now.shift(weeks=4),
-                                          self.timezone)
+      # Upcoming events until 4 weeks in the future, only as many as fit
+      upcoming_events = [event for event in
+                         index.upcoming(now, max_event_lines)
+                         if event['begin'] < upcoming_end]
       self._upcoming_events = upcoming_events
 
-      # delete events which won't be able to fit (more events than lines)
-      upcoming_events[:max_event_lines]
-
 
       # Check if any events were found in the given timerange
       if upcoming_events:
@@ -318,7 +324,7 @@ class Calendar(inkycal_module):
                     date, font=self.font, alignment = 'left')
 
               # Check if event is all day
-              if parser.all_day(event) == True:
+              if iCalendar.all_day(event) == True:
                 write(im_black, (date_width, event_lines[cursor][1]),
                     (event_width_l, line_height), name, font=self.font,
                     alignment = 'left')
@@ -44,6 +44,13 @@ class Inkyimage(inkycal_module):
     "orientation":{
       "label": "Please select the desired orientation",
       "options": ["vertical", "horizontal"]
+      },
+
+    "dither":{
+      "label": "How should images be dithered? 'auto' uses ordered "
+               "dithering for large images. Default is floyd-steinberg",
+      "options": ["floyd-steinberg", "auto", "atkinson", "sierra-lite",
+                  "ordered", False]
       }
     }
 
@@ -64,6 +71,7 @@ class Inkyimage(inkycal_module):
     self.palette = config['palette']
     self.autoflip = config['autoflip']
     self.orientation = config['orientation']
+    self.dither = config.get('dither', 'floyd-steinberg')
 
     # give an OK message
     print(f'{filename} loaded')
@@ -83,7 +91,7 @@ class Inkyimage(inkycal_module):
     im = Images()
 
     # use the image at the first index
-    im.load(self.path)
+    im.load(self.path, size=im_size)
 
     # Remove background if present
     im.remove_alpha()
@@ -96,7 +104,7 @@ class Inkyimage(inkycal_module):
     im.resize( width=im_width, height=im_height )
 
     # convert images according to specified palette
-    im_black, im_colour = im.to_palette(self.palette)
+    im_black, im_colour = im.to_palette(self.palette, dither=self.dither)
 
     # with the images now send, clear the current image
     im.clear()
@@ -5,10 +5,16 @@
 Image module for Inkycal Project
 Copyright by aceisace
 """
-import glob
+import atexit
+import bisect
+import hashlib
+import json
+import random
+from concurrent.futures import ThreadPoolExecutor
 
 from inkycal.modules.template import inkycal_module
 from inkycal.custom import *
+from inkycal.custom.cache import ImageCache
 
 # PIL has a class named Image, use alias for Inkyimage -> Images
 from inkycal.modules.inky_image import Inkyimage as Images
@@ -16,6 +22,220 @@ from inkycal.modules.inky_image import Inkyimage as Images
 filename = os.path.basename(__file__).split('.py')[0]
 logger = logging.getLogger(filename)
 
+
+class FolderIndex:
+  """The images within a folder and its subfolders, with a cursor.
+
+  The folder is scanned incrementally: each refresh only stats the known
+  directories and lists the ones whose modification time changed, so new
+  and removed images are noticed without walking all files. Images are
+  shown in the order of their paths, or in a random order if shuffle is
+  set, which is shuffled again for every round. Moving the cursor is O(1),
+  the order is only updated when images were added or removed.
+
+  The index and the cursor are stored in state_file, so a restart neither
+  walks the folder again nor starts over. The index is stored whenever it
+  changes, the cursor every store_every moves and on exit.
+
+  Args:
+    - folder: The folder with the images.
+    - state_file: Where to store the index and cursor, None to not store it.
+    - shuffle: Show the images in a random order?
+    - extensions: The file extensions of the images to show.
+    - store_every: Store the cursor after this many moves.
+  """
+
+  def __init__(self, folder, state_file=None, shuffle=False,
+               extensions=('jpg', 'jpeg', 'png'), store_every=10):
+    self.folder = folder
+    self.state_file = state_file
+    self.shuffle = shuffle
+    self.extensions = extensions
+    self.store_every = store_every
+
+    # per directory: [mtime, image file names, subdirectory names]
+    self._directories = {}
+    self._order = []
+    # position of the image shown last, -1 before the first one
+    self._cursor = -1
+    # moves of the cursor which were not stored yet
+    self._moves = 0
+    # the order of the next round in shuffle mode, once it was needed
+    self._next_order = None
+    self._load()
+    if state_file:
+      atexit.register(self._store_on_exit)
+
+  def __len__(self):
+    return len(self._order)
+
+  def __iter__(self):
+    return iter(self._order)
+
+  @property
+  def current(self):
+    """The path of the image shown last, or None"""
+    if self._cursor < 0 or not self._order:
+      return None
+    return self._order[self._cursor]
+
+  def peek(self):
+    """Returns the path of the next image without moving the cursor"""
+    if not self._order:
+      return None
+    if self._reshuffles():
+      return self._next_round()[0]
+    return self._order[(self._cursor + 1) % len(self._order)]
+
+  def next(self):
+    """Moves the cursor to the next image and returns its path"""
+    if not self._order:
+      return None
+    if self._reshuffles():
+      # a new round in a new order
+      self._order, self._next_order = self._next_round(), None
+      self._cursor = 0
+      self._store()
+    else:
+      self._cursor = (self._cursor + 1) % len(self._order)
+      self._moves += 1
+      if self._moves >= self.store_every:
+        self._store_cursor()
+    return self._order[self._cursor]
+
+  def _reshuffles(self):
+    """Checks if the next move starts a new round in a new order"""
+    return (self.shuffle and len(self._order) > 1 and
+            self._cursor == len(self._order) - 1)
+
+  def _next_round(self):
+    """Returns the order of the next round, which does not start with the
+    last image of this round"""
+    if self._next_order is None:
+      order = list(self._order)
+      random.shuffle(order)
+      if order[0] == self._order[-1]:
+        order[0], order[-1] = order[-1], order[0]
+      self._next_order = order
+    return self._next_order
+
+  def _scan(self, directory):
+    """Lists the images and subdirectories of a directory"""
+    files, folders = [], []
+    with os.scandir(directory) as entries:
+      for entry in entries:
+        if entry.is_dir(follow_symlinks=False):
+          folders.append(entry.name)
+        elif entry.name.split('.')[-1].lower() in self.extensions:
+          files.append(entry.name)
+    return files, folders
+
+  def refresh(self):
+    """Picks up added and removed images.
+
+    Returns:
+      True if images were added or removed
+    """
+    changed = False
+    seen = set()
+    pending = [self.folder]
+    while pending:
+      directory = pending.pop()
+      seen.add(directory)
+      try:
+        mtime = os.stat(directory).st_mtime
+        known = self._directories.get(directory)
+        if known is None or known[0] != mtime:
+          self._directories[directory] = [mtime, *self._scan(directory)]
+          changed = True
+      except OSError as error:
+        logger.warning(f'could not scan {directory}: {error}')
+        continue
+      pending.extend(os.path.join(directory, name)
+                     for name in self._directories[directory][2])
+
+    for directory in set(self._directories) - seen:
+      del self._directories[directory]
+      changed = True
+
+    if changed:
+      self._update_order()
+      self._store()
+    return changed
+
+  def _update_order(self):
+    """Updates the order to the images found, keeping the cursor on the
+    image shown last (or, if it was removed, where it was)"""
+    found = {os.path.join(directory, name)
+             for directory, (_, files, _) in self._directories.items()
+             for name in files}
+    current = self.current
+    self._next_order = None
+
+    if not self.shuffle:
+      self._order = sorted(found)
+      self._cursor = (bisect.bisect_right(self._order, current) - 1
+                      if current is not None else -1)
+      return
+
+    shown = [path for path in self._order[:self._cursor + 1]
+             if path in found]
+    upcoming = [path for path in self._order[self._cursor + 1:]
+                if path in found]
+    # new images are mixed into the ones not shown yet in this round
+    upcoming += found.difference(shown, upcoming)
+    random.shuffle(upcoming)
+    self._order, self._cursor = shown + upcoming, len(shown) - 1
+
+  def _load(self):
+    """Restores the stored index and cursor, if they are for this folder"""
+    if not self.state_file:
+      return
+    try:
+      with open(self.state_file) as file:
+        stored = json.load(file)
+      if stored['folder'] == self.folder and stored['shuffle'] == self.shuffle:
+        self._directories = stored['directories']
+        self._order = stored['order']
+      with open(self.state_file + '.cursor') as file:
+        cursor, path = file.read().split('\n', 1)
+      cursor = int(cursor)
+      if 0 <= cursor < len(self._order) and self._order[cursor] == path:
+        self._cursor = cursor
+    except (OSError, TypeError, ValueError, KeyError):
+      pass
+
+  def _write(self, path, text):
+    """Replaces a state file atomically"""
+    try:
+      os.makedirs(os.path.dirname(path), exist_ok=True)
+      with open(path + '.tmp', 'w') as file:
+        file.write(text)
+      os.replace(path + '.tmp', path)
+    except OSError as error:
+      logger.debug(f'could not store the slideshow state: {error}')
+
+  def _store(self):
+    """Stores the index, after it changed"""
+    if self.state_file:
+      self._write(self.state_file, json.dumps({
+        'folder': self.folder, 'shuffle': self.shuffle,
+        'directories': self._directories, 'order': self._order}))
+      self._store_cursor()
+
+  def _store_cursor(self):
+    """Stores the cursor, see store_every"""
+    self._moves = 0
+    if self.state_file:
+      self._write(self.state_file + '.cursor',
+                  f'{self._cursor}\n{self.current or ""}')
+
+  def _store_on_exit(self):
+    """Stores the moves of the cursor since it was stored last"""
+    if self._moves and os.path.isdir(os.path.dirname(self.state_file)):
+      self._store_cursor()
+
+
 class Slideshow(inkycal_module):
   """Cycles through images in a local image folder
   """
@@ -45,6 +265,18 @@ class Slideshow(inkycal_module):
     "orientation":{
       "label": "Please select the desired orientation",
       "options": ["vertical", "horizontal"]
+      },
+
+    "dither":{
+      "label": "How should images be dithered? 'auto' uses ordered "
+               "dithering for large images. Default is floyd-steinberg",
+      "options": ["floyd-steinberg", "auto", "atkinson", "sierra-lite",
+                  "ordered", False]
+      },
+
+    "shuffle":{
+      "label": "Show the images in a random order? Default is False",
+      "options": [False, True]
       }
     }
 
@@ -65,19 +297,25 @@ class Slideshow(inkycal_module):
     self.palette = config['palette']
     self.autoflip = config['autoflip']
     self.orientation = config['orientation']
-
-    # Get the full path of all png/jpg/jpeg images in the given folder
-    all_files = glob.glob(f'{self.path}/*')
-    self.images = [i for i in all_files
-                  if i.split('.')[-1].lower() in ('jpg', 'jpeg', 'png')]
-
-    if not self.images:
-      logger.error('No images found in the given folder, please '
-                   'double check your path!')
-      raise Exception('No images found in the given folder path :/')
-
-    # set a 'first run' signal
-    self._first_run = True
+    self.dither = config.get('dither', 'floyd-steinberg')
+
+    self.shuffle = config.get('shuffle', False)
+
+    # Index all png/jpg/jpeg images in the given folder and its subfolders.
+    # The index and the position in it are kept across restarts.
+    folder_hash = hashlib.sha1(
+      os.path.abspath(self.path).encode('utf-8')).hexdigest()[:12]
+    self.images = FolderIndex(
+      self.path, shuffle=self.shuffle, state_file=os.path.join(
+        top_level, 'cache', 'slideshow', f'folder_{folder_hash}.json'))
+    self._check_images()
+
+    # Finished slides are kept on disk. The next slide is prepared in the
+    # background while the current one is shown.
+    self._cache = ImageCache(os.path.join(top_level, 'cache', 'slideshow'))
+    self._worker = ThreadPoolExecutor(max_workers=1,
+                                      thread_name_prefix='inkycal-slideshow')
+    self._pending = {}
 
     # give an OK message
     print(f'{filename} loaded')
@@ -92,24 +330,43 @@ class Slideshow(inkycal_module):
 
     logger.info(f'Image size: {im_size}')
 
-    # rotates list items by 1 index
-    def rotate(somelist):
-      return somelist[1:] + somelist[:1]
+    # Pick up added or removed images, then switch to the next image
+    self._check_images()
+    path = self.images.next()
 
-    # Switch to the next image if this is not the first run
-    if self._first_run == True:
-      self._first_run = False
-    else:
-      self.images = rotate(self.images)
+    # temporary print method, prints current filename
+    print(f'slideshow - current image name: {path.split("/")[-1]}')
+
+    im_black, im_colour = self._slide(path, im_size)
+
+    # prepare the next slide while this one is shown
+    if len(self.images) > 1:
+      self._prepare(self.images.peek(), im_size)
+
+    # return images
+    return im_black, im_colour
+
+  def _check_images(self):
+    """Updates the image index, raises an Exception if there are no images"""
+    self.images.refresh()
+    if not len(self.images):
+      logger.error('No images found in the given folder, please '
+                   'double check your path!')
+      raise Exception('No images found in the given folder path :/')
+
+  def _key(self, path, size):
+    """Returns what a slide is made from, used as key of the cache"""
+    return (path, os.path.getmtime(path), list(size), self.palette,
+            self.autoflip, self.orientation, self.dither)
+
+  def _render(self, path, im_size):
+    """Loads an image and converts it to a slide of the given size"""
 
     # initialize custom image class
     im = Images()
 
-    # temporary print method, prints current filename
-    print(f'slideshow - current image name: {self.images[0].split("/")[-1]}')
-
-    # use the image at the first index
-    im.load(self.images[0])
+    # use the image at the given path
+    im.load(path, size=im_size)
 
     # Remove background if present
     im.remove_alpha()
@@ -119,15 +376,49 @@ class Slideshow(inkycal_module):
       im.autoflip(self.orientation)
 
     # resize the image so it can fit on the epaper
-    im.resize( width=im_width, height=im_height )
+    im.resize( width=im_size[0], height=im_size[1] )
 
     # convert images according to specified palette
-    im_black, im_colour = im.to_palette(self.palette)
+    im_black, im_colour = im.to_palette(self.palette, dither=self.dither)
 
     # with the images now send, clear the current image
     im.clear()
 
-    # return images
+    return im_black, im_colour
+
+  def _prepare(self, path, im_size):
+    """Renders a slide into the cache in the background"""
+
+    def prepare():
+      key = self._key(path, im_size)
+      if key not in self._cache:
+        self._cache.put(key, self._render(path, im_size))
+
+    # forget slides which are no longer next, e.g. as their image was removed
+    for stale in [pending for pending in self._pending if pending != path]:
+      self._pending.pop(stale).cancel()
+
+    if path not in self._pending:
+      self._pending[path] = self._worker.submit(prepare)
+
+  def _slide(self, path, im_size):
+    """Returns the black and colour band of a slide, from the cache if
+    possible"""
+    pending = self._pending.pop(path, None)
+    if pending:
+      try:
+        pending.result()
+      except Exception:
+        logger.exception(f'Could not prepare {path} in the background')
+
+    key = self._key(path, im_size)
+    cached = self._cache.get(key)
+    if cached:
+      logger.info(f'using the prepared slide of {path}')
+      return tuple(cached)
+
+    im_black, im_colour = self._render(path, im_size)
+    self._cache.put(key, [im_black, im_colour])
     return im_black, im_colour
 
 if __name__ == '__main__':
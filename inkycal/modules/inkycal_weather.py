@@ -102,7 +102,7 @@ class Weather(inkycal_module):
     self.owm = OWM(self.api_key).weather_manager()
     self.timezone = get_system_tz()
     self.locale = config['language']
-    self.weatherfont = ImageFont.truetype(
+    self.weatherfont = get_font(
       fonts['weathericons-regular-webfont'], size = self.fontsize)
 
     # give an OK message
@@ -176,16 +176,10 @@ class Weather(inkycal_module):
       text = icon
       font = self.weatherfont
 
-      # Increase fontsize to fit specified height and width of text box
-      size = 8
-      font = ImageFont.truetype(font.path, size)
-      text_width, text_height = font.getsize(text)
-
-      while (text_width < int(box_width * 0.9) and
-             text_height < int(box_height * 0.9)):
-        size += 1
-        font = ImageFont.truetype(font.path, size)
-        text_width, text_height = font.getsize(text)
+      # Find the fontsize to fit specified height and width of text box
+      size = fit_fontsize(font.path, text, int(box_width * 0.9),
+                          int(box_height * 0.9), height_text = text)
+      font = get_font(font.path, size)
 
       text_width, text_height = font.getsize(text)
 
@@ -22,7 +22,7 @@ class inkycal_module(metaclass=abc.ABCMeta):
     self.padding_top = self.padding_bottom = conf['padding_y']
 
     self.fontsize = conf["fontsize"]
-    self.font = ImageFont.truetype(
+    self.font = get_font(
       fonts['NotoSansUI-Regular'], size = self.fontsize)
 
   def set(self, help=False, **kwargs):
@@ -40,7 +40,7 @@ class inkycal_module(metaclass=abc.ABCMeta):
     for key, value in kwargs.items():
       if key in options:
         if key == 'fontsize':
-          self.font  = ImageFont.truetype(self.font.path, value)
+          self.font  = get_font(self.font.path, value)
           self.fontsize = value
         else:
           setattr(self, key, value)
@@ -55,6 +55,31 @@ class inkycal_module(metaclass=abc.ABCMeta):
     except AttributeError:
       print('no validation implemented')
 
+  # Minutes between two updates of this module. None updates the module
+  # every time Inkycal updates (update_interval). Can be changed with
+  # "refresh_interval" in the config of the module.
+  refresh_interval = None
+
+  def next_update(self, last_update):
+    """Returns when the image of this module should be generated again.
+
+    Called after each successful generate_image. By default, the module is
+    updated every refresh_interval minutes, counted from the full minute of
+    the last update as Inkycal wakes up at full minutes. Modules whose
+    content changes at known times (e.g. at midnight) can override this to
+    wake up just then.
+
+    Args:
+      - last_update: arrow object -> when generate_image was last called.
+
+    Returns:
+      An arrow object, or None to update on every update of Inkycal.
+    """
+    interval = self.config.get('refresh_interval', self.refresh_interval)
+    if not interval:
+      return None
+    return last_update.floor('minute').shift(minutes=+int(interval))
+
   @abc.abstractmethod
   def generate_image(self):
     # Generate image for this module with specified parameters
@@ -0,0 +1,369 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Benchmarks for performance critical parts of Inkycal
+Copyright by aceisace
+
+Not part of the test-suite, running this file without arguments only lists
+the benchmarks. Run selected ones by passing their names, e.g.:
+
+  $ python3 benchmarks.py getbuffer
+
+or all of them with:
+
+  $ python3 benchmarks.py all
+"""
+
+import os
+import sys
+import time
+import numpy
+from PIL import Image
+
+from helper_functions import *
+
+
+def timeit(function, *args, repeat=3, **kwargs):
+  """Returns the best wall time in seconds of `repeat` calls"""
+  best = None
+  for _ in range(repeat):
+    start = time.perf_counter()
+    function(*args, **kwargs)
+    duration = time.perf_counter() - start
+    best = duration if best is None else min(best, duration)
+  return best
+
+
+def _status(key):
+  """Returns a memory value of /proc/self/status in MB"""
+  with open('/proc/self/status') as file:
+    for line in file:
+      if line.startswith(f'{key}:'):
+        return int(line.split()[1]) / 1024
+
+
+def peak_memory(function, *args, **kwargs):
+  """Returns the peak resident memory in MB a call adds (Linux only).
+
+  The call runs in a forked process whose peak is reset first, so memory
+  allocated by C extensions (PIL, numpy) is counted too. Free memory the
+  process still holds is given back before, so it can not be reused unseen.
+  """
+  import ctypes
+  read, write = os.pipe()
+  pid = os.fork()
+  if pid == 0:
+    os.close(read)
+    try:
+      ctypes.CDLL('libc.so.6').malloc_trim(0)
+      with open('/proc/self/clear_refs', 'w') as file:
+        file.write('5')
+      before = _status('VmRSS')
+      function(*args, **kwargs)
+      peak = _status('VmHWM') - before
+    except OSError:
+      peak = float('nan')
+    os.write(write, str(peak).encode())
+    os._exit(0)
+  os.close(write)
+  result = os.read(read, 64)
+  os.waitpid(pid, 0)
+  return float(result)
+
+
+def bench_getbuffer():
+  """Vectorized buffer packing vs. the previous per-pixel loop"""
+  from inkycal.display.drivers import epdbuffer
+
+  panels = [('4.2"', 400, 300, '1bpp'), ('7.5" v1', 640, 384, '2bpp'),
+            ('7.5" v2', 800, 480, '1bpp'), ('7.5" v3', 880, 528, '1bpp')]
+
+  print(f"{'panel':10} {'format':7} {'layout':11} {'loop':>10} "
+        f"{'packed':>10} {'speedup':>8}")
+
+  for name, width, height, fmt in panels:
+    for layout, size in [('horizontal', (width, height)),
+                         ('vertical', (height, width))]:
+      pixels = numpy.random.randint(0, 2, (size[1], size[0])).astype(bool)
+      image = Image.fromarray(pixels).convert('RGB')
+
+      if fmt == '1bpp':
+        legacy, packed = legacy_getbuffer_1bpp, epdbuffer.pack_1bpp
+      else:
+        legacy, packed = legacy_getbuffer_2bpp, epdbuffer.pack_2bpp
+
+      t_legacy = timeit(legacy, image, width, height, repeat=1)
+      t_packed = timeit(packed, image, width, height)
+      print(f'{name:10} {fmt:7} {layout:11} {t_legacy*1000:8.1f}ms '
+            f'{t_packed*1000:8.2f}ms {t_legacy/t_packed:7.0f}x')
+
+
+def bench_spi_push():
+  """Frame push with bulk SPI transfers vs. one send_data call per byte"""
+  import os
+  os.environ.setdefault('INKYCAL_EPD_BACKEND', 'mock')
+  from importlib import import_module
+  from inkycal.display.drivers import epdconfig
+  epdconfig.use_implementation(epdconfig.Mock())
+
+  def per_byte(epd, buffer):
+    for byte in buffer:
+      epd.send_data(byte)
+
+  print(f"{'driver':22} {'bytes':>7} {'per byte':>10} {'bulk':>10} "
+        f"{'spi calls':>10}")
+
+  for model in ['epd_4_in_2', 'epd_7_in_5_v2', 'epd_7_in_5_v3']:
+    epd = import_module(f'inkycal.display.drivers.{model}').EPD()
+    buffer = bytearray(epd.width * epd.height // 8)
+
+    t_legacy = timeit(per_byte, epd, buffer, repeat=1)
+    epdconfig.implementation.reset_stats()
+    t_bulk = timeit(epd.send_data_bulk, buffer, repeat=1)
+    calls = len(epdconfig.implementation.transfers)
+    print(f'{model:22} {len(buffer):7} {t_legacy*1000:8.1f}ms '
+          f'{t_bulk*1000:8.2f}ms {calls:10}')
+
+
+def bench_emulator():
+  """Modelled time of a full render per display on the emulated backend"""
+  import os
+  os.environ.setdefault('INKYCAL_EPD_BACKEND', 'emulator')
+  from inkycal.display.drivers import epdconfig
+  from inkycal.display import Display
+
+  emulator = epdconfig.Emulator()
+  epdconfig.use_implementation(emulator)
+
+  results = []
+  for model in epdconfig.EMULATOR_MODELS:
+    display = Display(model)
+    width, height = epdconfig.EMULATOR_MODELS[model]['size']
+    image = Image.new('1', (height, width), 'white')
+    start = time.perf_counter()
+    if display.supports_colour:
+      display.render(image, image)
+    else:
+      display.render(image)
+    host = time.perf_counter() - start
+    results.append((model, emulator.refreshes[-1], host))
+
+  print(f"\n{'model':22} {'bytes':>8} {'gpio':>7} {'spi':>9} {'wall':>10} "
+        f"{'host':>9}")
+  for model, refresh, host in results:
+    print(f"{model:22} {refresh['bytes']:8} {refresh['gpio_toggles']:7} "
+          f"{refresh['spi_ms']:7.1f}ms {refresh['wall_ms']:8.0f}ms "
+          f"{host*1000:7.1f}ms")
+
+
+def bench_events():
+  """Event records vs. the previous event dicts on a 10k event calendar"""
+  import arrow
+  import recurring_ical_events
+  from icalendar import Calendar
+  from inkycal.modules.ical_parser import iCalendar, make_record
+
+  lines = ['BEGIN:VCALENDAR', 'VERSION:2.0', 'PRODID:-//inkycal//bench//EN']
+  start = arrow.get('2020-01-01')
+  for number in range(10000):
+    begin = start.shift(hours=number)
+    if number % 5:
+      dtstart = f"DTSTART:{begin.format('YYYYMMDDTHHmmss')}Z"
+      dtend = f"DTEND:{begin.shift(hours=1).format('YYYYMMDDTHHmmss')}Z"
+    else:
+      dtstart = f"DTSTART;VALUE=DATE:{begin.format('YYYYMMDD')}"
+      dtend = f"DTEND;VALUE=DATE:{begin.shift(days=1).format('YYYYMMDD')}"
+    lines += ['BEGIN:VEVENT', f'UID:{number}@inkycal', dtstart, dtend,
+              f'SUMMARY:Room booking {number % 20}', 'END:VEVENT']
+  lines.append('END:VCALENDAR')
+  occurrences = recurring_ical_events.of(
+    Calendar.from_ical('\r\n'.join(lines))).between((2019, 1, 1),
+                                                     (2022, 1, 1))
+
+  def legacy(timezone):
+    events = legacy_event_dicts(occurrences, timezone)
+    events.sort(key=lambda event: event['begin'])
+    return [legacy_all_day(event) for event in events]
+
+  def records(timezone):
+    tzinfo = arrow.now(timezone).tzinfo
+    events = [make_record(event, tzinfo) for event in occurrences]
+    events.sort(key=lambda event: event.begin_ts)
+    return [iCalendar.all_day(event) for event in events]
+
+  print(f"{'timezone':16} {'dicts':>12} {'records':>12} {'speedup':>8}")
+  for timezone in ['UTC', 'Europe/Berlin']:
+    t_legacy = timeit(legacy, timezone, repeat=1)
+    t_records = timeit(records, timezone)
+    n = len(occurrences)
+    print(f'{timezone:16} {n/t_legacy:8.0f} ev/s {n/t_records:8.0f} ev/s '
+          f'{t_legacy/t_records:7.1f}x')
+
+
+def bench_write():
+  """write() with binary-search autofit and cached layouts vs. linear loops"""
+  from PIL import ImageFont
+  from inkycal.custom import functions
+
+  font = ImageFont.truetype(functions.fonts['NotoSans-SemiCondensed'], 14)
+  # the labels of a calendar grid: weekday names and day numbers
+  labels = [(day, (54, 48)) for day in
+            ['Mo', 'Tu', 'We', 'Th', 'Fr', 'Sa', 'Su']]
+  labels += [(str(day), (54, 48)) for day in range(1, 32)]
+  labels += [('Inkycal is an e-Paper calendar with many modules', (180, 24))]
+
+  def frame(write):
+    image = Image.new('RGB', (400, 300), 'white')
+    for text, box in labels:
+      write(image, (0, 0), box, text, font=font, autofit=True)
+
+  t_legacy = timeit(frame, legacy_write, repeat=1)
+  functions.clear_font_cache()
+  t_cold = timeit(frame, functions.write, repeat=1)
+  t_warm = timeit(frame, functions.write)
+  print(f"{'labels':>7} {'linear':>10} {'1st frame':>10} {'next frames':>12}")
+  print(f'{len(labels):7} {t_legacy*1000:8.1f}ms {t_cold*1000:8.1f}ms '
+        f'{t_warm*1000:10.1f}ms')
+  print(f'fonts: {functions.font_cache_statistics()}')
+  print(f'layouts: {functions.layout_cache_statistics()}')
+
+
+def bench_text_wrap():
+  """text_wrap with cached word advances vs. measuring every line prefix"""
+  import random
+  from PIL import ImageFont
+  from inkycal.custom import functions
+
+  font = ImageFont.truetype(functions.fonts['NotoSansUI-Regular'], 14)
+  random.seed(0)
+  vocabulary = ('the of and display weather calendar events news feed '
+                'summary raspberry paper update module temperature '
+                'forecast tomorrow afternoon').split()
+  # like the summaries of a feed: 30 texts of 80 words
+  texts = [' '.join(random.choice(vocabulary) for _ in range(80))
+           for _ in range(30)]
+
+  def wrap_all(wrap, max_width, **kwargs):
+    for text in texts:
+      wrap(text, font, max_width, **kwargs)
+
+  print(f"{'width':>6} {'prefixes':>10} {'1st call':>10} {'cached':>10} "
+        f"{'optimal':>10}")
+  for max_width in [200, 400, 800]:
+    t_legacy = timeit(wrap_all, legacy_text_wrap, max_width, repeat=1)
+    functions.clear_font_cache()
+    functions._word_metrics_cache.clear()
+    t_cold = timeit(wrap_all, functions.text_wrap, max_width, repeat=1)
+    t_warm = timeit(wrap_all, functions.text_wrap, max_width)
+    t_optimal = timeit(wrap_all, functions.text_wrap, max_width,
+                       mode='optimal')
+    print(f'{max_width:6} {t_legacy*1000:8.1f}ms {t_cold*1000:8.1f}ms '
+          f'{t_warm*1000:8.1f}ms {t_optimal*1000:8.1f}ms')
+
+
+def bench_to_palette():
+  """Palette separation from the palette indices vs. masks on RGB copies"""
+  from inkycal.modules.inky_image import Inkyimage
+
+  print(f"{'frame':9} {'palette':7} {'masks':>10} {'indices':>10} "
+        f"{'packed':>10} {'peak masks':>11} {'peak indices':>13}")
+  random = numpy.random.RandomState(0)
+  for width, height in [(800, 480), (1200, 825)]:
+    pixels = random.randint(0, 256, (height, width, 3)).astype(numpy.uint8)
+    image = Image.fromarray(pixels)
+    for palette in ['bwr', 'bwy']:
+      t_legacy = timeit(legacy_to_palette, image, palette)
+      t_images = timeit(Inkyimage(image).to_palette, palette)
+      t_packed = timeit(Inkyimage(image).to_palette, palette, packed=True)
+      m_legacy = peak_memory(legacy_to_palette, image, palette)
+      m_images = peak_memory(Inkyimage(image).to_palette, palette)
+      frame = f'{width}x{height}'
+      print(f'{frame:9} {palette:7} {t_legacy*1000:8.1f}ms '
+            f'{t_images*1000:8.1f}ms {t_packed*1000:8.1f}ms '
+            f'{m_legacy:9.1f}MB {m_images:11.1f}MB')
+
+
+def bench_dither():
+  """Throughput of the dithering methods per frame size (bwr palette)"""
+  from inkycal.modules import inky_image
+
+  sizes = [(400, 300), (800, 480), (1200, 825)]
+  print(f"{'method':16}" + ''.join(f'{f"{w}x{h}":>12}' for w, h in sizes))
+
+  random = numpy.random.RandomState(0)
+  frames = [Image.fromarray(random.randint(0, 256, (h, w, 3)).astype(
+    numpy.uint8)) for w, h in sizes]
+  palette = inky_image._palette_image('bwr')
+
+  def pil(image):
+    image.quantize(palette=palette, dither=True)
+
+  rows = [('PIL quantize', pil)]
+  rows += [(method, lambda image, method=method: inky_image.dither_image(
+    image, 'bwr', method)) for method in inky_image.dither_methods]
+  for name, function in rows:
+    speeds = [image.width * image.height / timeit(function, image) / 1e6
+              for image in frames]
+    print(f'{name:16}' + ''.join(f'{speed:7.1f} Mpx/s' for speed in speeds))
+
+
+def bench_load():
+  """Loading camera photos reduced to the display size vs. fully decoded"""
+  import shutil
+  import tempfile
+  from inkycal.modules.inky_image import Inkyimage
+
+  def show(path, size, reduce):
+    image = Inkyimage()
+    image.load(path, size=size if reduce else None)
+    image.resize(width=size[0], height=size[1])
+
+  folder = tempfile.mkdtemp()
+  random = numpy.random.RandomState(0)
+  print(f"{'photo':11} {'decode':>10} {'reduced':>10} {'peak decode':>12} "
+        f"{'peak reduced':>13}")
+  try:
+    for width, height in [(4000, 3000), (6000, 4000)]:
+      pixels = random.randint(0, 256, (30, 40, 3)).astype(numpy.uint8)
+      path = os.path.join(folder, f'{width}x{height}.jpg')
+      Image.fromarray(pixels).resize((width, height), Image.BICUBIC).save(
+        path, quality=90)
+
+      size = (640, 384)
+      t_full = timeit(show, path, size, False, repeat=1)
+      t_reduced = timeit(show, path, size, True)
+      m_full = peak_memory(show, path, size, False)
+      m_reduced = peak_memory(show, path, size, True)
+      photo = f'{width * height / 1e6:.0f} MP'
+      print(f'{photo:11} {t_full*1000:8.0f}ms {t_reduced*1000:8.0f}ms '
+            f'{m_full:10.1f}MB {m_reduced:11.1f}MB')
+  finally:
+    shutil.rmtree(folder)
+
+
+benchmarks = {
+  'getbuffer': bench_getbuffer,
+  'spi': bench_spi_push,
+  'emulator': bench_emulator,
+  'events': bench_events,
+  'write': bench_write,
+  'text_wrap': bench_text_wrap,
+  'to_palette': bench_to_palette,
+  'dither': bench_dither,
+  'load': bench_load,
+  }
+
+if __name__ == '__main__':
+  selected = sys.argv[1:]
+  if not selected:
+    print('available benchmarks (pass their names, or all):')
+    for name, benchmark in benchmarks.items():
+      print(f'  {name}: {benchmark.__doc__}')
+    sys.exit()
+  if selected == ['all']:
+    selected = list(benchmarks)
+  for name in selected:
+    print(f'--- {name}: {benchmarks[name].__doc__}')
+    benchmarks[name]()
+    print()
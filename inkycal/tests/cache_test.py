@@ -0,0 +1,106 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Image cache test (cache)
+Copyright by aceisace
+"""
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from PIL import Image
+
+from inkycal.custom.cache import pack_images, unpack_images, ModuleCache
+from inkycal.custom.cache import ImageCache
+from helper_functions import *
+
+config = {'position': 1, 'name': 'Jokes', 'config': {'size': [400, 100]}}
+
+def sample_images():
+  """Returns a black and a colour image like the ones of a module"""
+  black = Image.new('RGB', (400, 100), 'white')
+  colour = Image.new('RGB', (400, 100), 'white')
+  black.paste((0, 0, 0), (10, 10, 200, 40))
+  colour.paste((0, 0, 0), (250, 50, 300, 90))
+  return black, colour
+
+class module_test(unittest.TestCase):
+
+  def setUp(self):
+    self.folder = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.folder)
+
+  def test_pack_images(self):
+    print('testing packing and unpacking images...', end="")
+    images = list(sample_images()) + [Image.new('1', (33, 7), 'black')]
+    data = pack_images(images, timestamp=1234.5)
+    unpacked, timestamp = unpack_images(data)
+    self.assertEqual(timestamp, 1234.5)
+    for original, image in zip(images, unpacked):
+      self.assertEqual(image.mode, original.mode)
+      self.assertEqual(image.tobytes(), original.tobytes())
+    # much smaller than the raw pixels
+    self.assertLess(len(data), 400 * 100 * 3 // 20)
+    print('OK')
+
+  def test_corrupted_data(self):
+    print('testing unpacking corrupted data...', end="")
+    data = pack_images(sample_images())
+    for broken in [b'', b'garbage', data[:len(data)//2]]:
+      with self.assertRaises(ValueError):
+        unpack_images(broken)
+    print('OK')
+
+  def test_module_cache(self):
+    print('testing the module cache...', end="")
+    black, colour = sample_images()
+    cache = ModuleCache(self.folder)
+    self.assertIsNone(cache.get(1, config))
+    cache.put(1, config, black, colour)
+    cache.flush()
+
+    # a new cache (after a restart) reads the entry from disk
+    cached = ModuleCache(self.folder).get(1, config)
+    self.assertEqual(cached[0].tobytes(), black.tobytes())
+    self.assertEqual(cached[1].tobytes(), colour.tobytes())
+
+    # changing the config invalidates the entry
+    changed = dict(config, config={'size': [400, 120]})
+    self.assertIsNone(ModuleCache(self.folder).get(1, changed))
+    cache.put(1, changed, black, colour)
+    cache.flush()
+    self.assertEqual(len(os.listdir(self.folder)), 1)
+    print('OK')
+
+  def test_image_cache(self):
+    print('testing the image cache...', end="")
+    black, colour = [image.convert('1') for image in sample_images()]
+    cache = ImageCache(self.folder, max_entries=2)
+    key = ('photo.jpg', 1234.5, [380, 180], 'bwr')
+    self.assertIsNone(cache.get(key))
+    cache.put(key, [black, colour])
+    self.assertIn(key, cache)
+    cached = ImageCache(self.folder).get(key)
+    self.assertEqual([image.tobytes() for image in cached],
+                     [black.tobytes(), colour.tobytes()])
+
+    # the least recently used entries are removed
+    for mtime in [1, 2]:
+      time.sleep(0.01)
+      cache.put(('photo.jpg', mtime), [black])
+    self.assertNotIn(key, cache)
+    self.assertEqual(len(os.listdir(self.folder)), 2)
+    print('OK')
+
+if __name__ == '__main__':
+
+  logger = logging.getLogger()
+  logger.level = logging.DEBUG
+  logger.addHandler(logging.StreamHandler(sys.stdout))
+
+  unittest.main()
@@ -0,0 +1,83 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Connectivity monitor test (inkycal.custom.connectivity)
+Copyright by aceisace
+"""
+import socket
+import threading
+import unittest
+from inkycal.custom import connectivity, internet_available
+from inkycal.custom.connectivity import ConnectivityMonitor, has_default_route
+from helper_functions import *
+
+
+class connectivity_test(unittest.TestCase):
+
+  def setUp(self):
+    # a local stand-in for the probe target
+    self.server = socket.socket()
+    self.server.bind(('127.0.0.1', 0))
+    self.server.listen(16)
+    self.url = f'http://127.0.0.1:{self.server.getsockname()[1]}/'
+
+  def tearDown(self):
+    self.server.close()
+
+  def test_available(self):
+    print('testing the connectivity check...', end="")
+    monitor = ConnectivityMonitor(self.url)
+    for _ in range(5):
+      self.assertTrue(monitor.available())
+    self.assertEqual(monitor.stats, {'checks': 1, 'hits': 4})
+    monitor.invalidate()
+    self.assertTrue(monitor.available())
+    self.assertEqual(monitor.stats['checks'], 2)
+    print('OK')
+
+  def test_unavailable(self):
+    print('testing failed connectivity checks...', end="")
+    self.server.close()
+    monitor = ConnectivityMonitor(self.url, failure_ttl=0)
+    self.assertFalse(monitor.available())
+    self.assertFalse(monitor.available())
+    # failures are checked again after failure_ttl
+    self.assertEqual(monitor.stats['checks'], 2)
+    self.assertFalse(ConnectivityMonitor('https://inkycal.invalid').check())
+    print('OK')
+
+  def test_shared_check(self):
+    print('testing concurrent modules share one check...', end="")
+    monitor = ConnectivityMonitor(self.url)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(
+      monitor.available())) for _ in range(8)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    self.assertEqual(results, [True] * 8)
+    self.assertEqual(monitor.stats['checks'], 1)
+    print('OK')
+
+  def test_internet_available(self):
+    print('testing internet_available uses the shared monitor...', end="")
+    url = connectivity.monitor.probe_url
+    connectivity.monitor.probe_url = self.url
+    connectivity.monitor.invalidate()
+    try:
+      self.assertTrue(internet_available())
+    finally:
+      connectivity.monitor.probe_url = url
+      connectivity.monitor.invalidate()
+    self.assertIn(has_default_route(), [True, False, None])
+    print('OK')
+
+
+if __name__ == '__main__':
+
+  logger = logging.getLogger()
+  logger.level = logging.DEBUG
+  logger.addHandler(logging.StreamHandler(sys.stdout))
+
+  unittest.main()
@@ -0,0 +1,123 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+E-Paper buffer packing test (epdbuffer)
+Copyright by aceisace
+"""
+
+import unittest
+import numpy
+from PIL import Image
+
+from inkycal.display.drivers import epdbuffer
+from helper_functions import *
+
+# small panel size to keep the reference loops fast
+width, height = 64, 24
+
+def random_image(size):
+  """Returns a random black-white image of the given size"""
+  pixels = numpy.random.randint(0, 2, (size[1], size[0])).astype(bool)
+  return Image.fromarray(pixels)
+
+class module_test(unittest.TestCase):
+
+  def test_pack_1bpp_horizontal(self):
+    print('testing 1bpp packing (horizontal)...', end="")
+    image = random_image((width, height))
+    self.assertEqual(list(epdbuffer.pack_1bpp(image, width, height)),
+                     legacy_getbuffer_1bpp(image, width, height))
+    print('OK')
+
+  def test_pack_1bpp_vertical(self):
+    print('testing 1bpp packing (vertical)...', end="")
+    image = random_image((height, width))
+    self.assertEqual(list(epdbuffer.pack_1bpp(image, width, height)),
+                     legacy_getbuffer_1bpp(image, width, height))
+    print('OK')
+
+  def test_pack_2bpp(self):
+    print('testing 2bpp packing...', end="")
+    for size in [(width, height), (height, width)]:
+      image = random_image(size)
+      self.assertEqual(list(epdbuffer.pack_2bpp(image, width, height)),
+                       legacy_getbuffer_2bpp(image, width, height))
+    print('OK')
+
+  def test_pack_rgb_image(self):
+    print('testing packing of RGB images...', end="")
+    image = random_image((width, height)).convert('RGB')
+    self.assertEqual(list(epdbuffer.pack_1bpp(image, width, height)),
+                     legacy_getbuffer_1bpp(image, width, height))
+    print('OK')
+
+  def test_wrong_size(self):
+    print('testing packing of wrongly sized images...', end="")
+    image = random_image((10, 10))
+    self.assertEqual(list(epdbuffer.pack_1bpp(image, width, height)),
+                     legacy_getbuffer_1bpp(image, width, height))
+    self.assertEqual(list(epdbuffer.pack_2bpp(image, width, height)),
+                     legacy_getbuffer_2bpp(image, width, height))
+    print('OK')
+
+  def test_invert(self):
+    print('testing inverting buffers...', end="")
+    buffer = bytearray(numpy.random.randint(0, 256, 64, dtype=numpy.uint8))
+    self.assertEqual(list(epdbuffer.invert(buffer)),
+                     [~byte & 0xFF for byte in buffer])
+    print('OK')
+
+  def test_expand_2bpp(self):
+    print('testing 2bpp to 4bpp conversion...', end="")
+    buffer = bytearray(numpy.random.randint(0, 256, 64, dtype=numpy.uint8))
+    self.assertEqual(list(epdbuffer.expand_2bpp(buffer)),
+                     legacy_expand_2bpp(buffer))
+    print('OK')
+
+  def test_merge_colour_4bpp(self):
+    print('testing merging of black and colour buffers...', end="")
+    black = bytearray(numpy.random.randint(0, 256, 64, dtype=numpy.uint8))
+    colour = bytearray(numpy.random.randint(0, 256, 64, dtype=numpy.uint8))
+    self.assertEqual(list(epdbuffer.merge_colour_4bpp(black, colour)),
+                     legacy_merge_colour_4bpp(black, colour))
+    print('OK')
+
+  def test_dirty_regions(self):
+    print('testing detection of changed regions...', end="")
+    old = Image.new('1', (width, height), 'white')
+    new = old.copy()
+    buffer = epdbuffer.pack_1bpp(old, width, height)
+    self.assertEqual(epdbuffer.dirty_regions(buffer, buffer, width, height), [])
+
+    new.paste(0, (10, 2, 20, 4))
+    new.paste(0, (40, 20, 41, 21))
+    regions = epdbuffer.dirty_regions(
+      buffer, epdbuffer.pack_1bpp(new, width, height), width, height,
+      max_gap=4)
+    self.assertEqual(regions, [(8, 2, 24, 4), (40, 20, 48, 21)])
+
+    # close bands are merged into one region
+    regions = epdbuffer.dirty_regions(
+      buffer, epdbuffer.pack_1bpp(new, width, height), width, height,
+      max_gap=20)
+    self.assertEqual(regions, [(8, 2, 48, 21)])
+    print('OK')
+
+  def test_crop(self):
+    print('testing cropping of buffers...', end="")
+    image = random_image((width, height))
+    buffer = epdbuffer.pack_1bpp(image, width, height)
+    box = (16, 3, 40, 10)
+    cropped = image.crop(box)
+    self.assertEqual(epdbuffer.crop(buffer, width, box),
+                     epdbuffer.pack_1bpp(cropped, 24, 7))
+    print('OK')
+
+if __name__ == '__main__':
+
+  logger = logging.getLogger()
+  logger.level = logging.DEBUG
+  logger.addHandler(logging.StreamHandler(sys.stdout))
+
+  unittest.main()
@@ -0,0 +1,232 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+E-Paper hardware backend test (epdconfig)
+Copyright by aceisace
+"""
+
+import os
+import unittest
+from importlib import import_module
+from PIL import Image
+
+# Use the hardware-free backend, must be set before importing the drivers
+os.environ['INKYCAL_EPD_BACKEND'] = 'mock'
+
+from inkycal.display.drivers import epdconfig, epdbuffer
+from inkycal.display import Display
+from helper_functions import *
+
+backend = epdconfig.implementation
+
+def load_driver(model):
+  """Returns an instance of the driver for the given model"""
+  return import_module(f'inkycal.display.drivers.{model}').EPD()
+
+def frame_writes(command):
+  """Returns the data sent after a command for the last recorded refresh"""
+  return [data for cmd, data in backend.commands() if cmd == command][-1]
+
+class module_test(unittest.TestCase):
+
+  def setUp(self):
+    backend.reset_stats()
+
+  def test_mock_selected(self):
+    print('testing if the mock backend was selected...', end="")
+    self.assertIsInstance(backend, epdconfig.Mock)
+    print('OK')
+
+  def test_chunked_transfer(self):
+    print('testing chunked SPI transfers...', end="")
+    data = bytearray(range(256)) * 40
+    epdconfig.spi_writebytes2(data)
+    self.assertEqual(b''.join(chunk for _, chunk in backend.transfers), data)
+    chunks = -(-len(data) // backend.chunk_size)
+    self.assertEqual(len(backend.transfers), chunks)
+    self.assertEqual(backend.cs_assertions, chunks)
+    print('OK')
+
+  def test_display_bw(self):
+    print('testing frame push of a black-white driver...', end="")
+    epd = load_driver('epd_7_in_5_v2')
+    image = Image.new('1', (epd.width, epd.height), 'white')
+    image.paste(0, (0, 0, 100, 50))
+    buffer = epd.getbuffer(image)
+    epd.init()
+    backend.reset_stats()
+    epd.display(buffer)
+    self.assertEqual(frame_writes(0x13),
+                     epdbuffer.invert(buffer))
+    # only a few transfers for a whole frame instead of one per byte
+    self.assertLess(len(backend.transfers), len(buffer) // 1000)
+    print('OK')
+
+  def test_display_colour(self):
+    print('testing frame push of a colour driver...', end="")
+    epd = load_driver('epd_7_in_5_colour')
+    black = Image.new('1', (epd.width, epd.height), 'white')
+    colour = Image.new('1', (epd.width, epd.height), 'white')
+    black.paste(0, (0, 0, 64, 64))
+    colour.paste(0, (32, 32, 128, 128))
+    black, colour = epd.getbuffer(black), epd.getbuffer(colour)
+    epd.display(black, colour)
+    self.assertEqual(list(frame_writes(0x10)),
+                     legacy_merge_colour_4bpp(black, colour))
+    print('OK')
+
+  def test_clear(self):
+    print('testing clearing the display...', end="")
+    epd = load_driver('epd_7_in_5_v3')
+    epd.Clear()
+    size = epd.width * epd.height // 8
+    self.assertEqual(frame_writes(0x24), b'\xff' * size)
+    self.assertEqual(frame_writes(0x26), b'\xff' * size)
+    print('OK')
+
+class emulator_test(unittest.TestCase):
+
+  def setUp(self):
+    self.emulator = epdconfig.Emulator()
+    epdconfig.use_implementation(self.emulator)
+
+  def tearDown(self):
+    epdconfig.use_implementation(backend)
+
+  def test_decode_bw(self):
+    print('testing decoding of a black-white frame...', end="")
+    display = Display('epd_7_in_5_v2')
+    self.assertEqual(self.emulator.model, 'epd_7_in_5_v2')
+    image = Image.new('1', (480, 800), 'white')
+    image.paste(0, (10, 20, 200, 100))
+    display.render(image)
+    expected = image.transpose(Image.ROTATE_90)
+    self.assertEqual(self.emulator.frames['black'].tobytes(),
+                     expected.tobytes())
+    print('OK')
+
+  def test_decode_colour(self):
+    print('testing decoding of black and colour frames...', end="")
+    for model in ['epd_7_in_5_v2_colour', 'epd_7_in_5_v3_colour',
+                  'epd_7_in_5_colour']:
+      display = Display(model)
+      size = epdconfig.EMULATOR_MODELS[model]['size']
+      black = Image.new('1', size, 'white')
+      colour = Image.new('1', size, 'white')
+      black.paste(0, (0, 0, 80, 40))
+      colour.paste(0, (100, 100, 160, 140))
+      display.render(black, colour)
+      frames = self.emulator.frames
+      self.assertEqual(frames['black'].tobytes(), black.tobytes())
+      self.assertEqual(frames['colour'].tobytes(), colour.tobytes())
+    print('OK')
+
+  def test_report(self):
+    print('testing emulated timings...', end="")
+    display = Display('epd_7_in_5_v3')
+    display.render(Image.new('1', (528, 880), 'white'))
+    refresh = self.emulator.refreshes[-1]
+    self.assertGreaterEqual(refresh['bytes'], 880 * 528 // 8)
+    self.assertEqual(refresh['busy_ms'],
+                     epdconfig.EMULATOR_MODELS['epd_7_in_5_v3']['refresh_ms'])
+    self.assertGreater(refresh['wall_ms'], refresh['busy_ms'])
+    self.assertEqual(self.emulator.report()['refreshes'], 1)
+    print('OK')
+
+  def test_skip_identical_frames(self):
+    print('testing skipping of unchanged frames...', end="")
+    display = Display('epd_7_in_5_v3_colour')
+    black = Image.new('1', (528, 880), 'white')
+    colour = Image.new('1', (528, 880), 'white')
+    black.paste(0, (0, 0, 50, 50))
+    display.render(black, colour)
+    display.render(black.copy(), colour.copy())
+    self.assertEqual(len(self.emulator.refreshes), 1)
+    self.assertEqual(display.skipped_refreshes, 1)
+
+    colour.paste(0, (100, 100, 120, 120))
+    display.render(black, colour)
+    self.assertEqual(len(self.emulator.refreshes), 2)
+    self.assertEqual(display.skipped_refreshes, 1)
+    print('OK')
+
+  def test_partial_refresh(self):
+    print('testing partial refreshes...', end="")
+    for model in ['epd_7_in_5_v2', 'epd_7_in_5_v3']:
+      width, height = epdconfig.EMULATOR_MODELS[model]['size']
+      display = Display(model, partial_refresh=True)
+      image = Image.new('1', (width, height), 'white')
+      image.paste(0, (0, 0, 300, 200))
+      display.render(image)
+      full = self.emulator.refreshes[-1]
+      self.assertFalse(full['partial'])
+
+      image.paste(0, (100, 40, 130, 50))
+      image.paste(255, (0, 0, 20, 20))
+      refreshes = len(self.emulator.refreshes)
+      display.render(image)
+      # all changed areas are shown with a single refresh
+      self.assertEqual(len(self.emulator.refreshes), refreshes + 1)
+      partial = self.emulator.refreshes[-1]
+      self.assertTrue(partial['partial'])
+      self.assertLess(partial['bytes'], full['bytes'] // 10)
+      self.assertLess(partial['wall_ms'], full['wall_ms'])
+      self.assertEqual(self.emulator.frames['black'].tobytes(),
+                       image.tobytes())
+    print('OK')
+
+  def test_partial_matches_full_frame(self):
+    print('testing partial updates land where full frames are drawn...',
+          end="")
+    for model in ['epd_7_in_5_v2', 'epd_7_in_5_v3']:
+      self.emulator.set_model(model)
+      epd = load_driver(model)
+      image = Image.new('1', (epd.width, epd.height), 'white')
+      image.paste(0, (0, 0, 64, 3))
+      image.paste(0, (200, 100, 264, 140))
+      epd.init()
+      epd.display(epd.getbuffer(image))
+      self.assertEqual(self.emulator.frames['black'].tobytes(),
+                       image.tobytes())
+
+      changed = image.copy()
+      changed.paste(255, (8, 1, 40, 2))
+      changed.paste(0, (216, 120, 232, 149))
+      epd.init_part()
+      epd.display_partial(epd.getbuffer(changed), epd.getbuffer(image),
+                          [(0, 0, 272, 150)])
+      self.assertEqual(self.emulator.frames['black'].tobytes(),
+                       changed.tobytes())
+    print('OK')
+
+  def test_partial_fallback(self):
+    print('testing fallback to full refreshes...', end="")
+    display = Display('epd_7_in_5_v3', partial_refresh=True,
+                      full_refresh_every=2)
+    image = Image.new('1', (880, 528), 'white')
+    display.render(image)
+
+    # identical frames are not sent at all
+    display.render(image)
+    self.assertEqual(len(self.emulator.refreshes), 1)
+
+    kinds = []
+    for step in range(3):
+      image.paste(0, (step * 8, 0, step * 8 + 8, 8))
+      display.render(image)
+      kinds.append(self.emulator.refreshes[-1]['partial'])
+    self.assertEqual(kinds, [True, True, False])
+
+    # large changes are sent with a full refresh
+    display.render(Image.new('1', (880, 528), 'black'))
+    self.assertFalse(self.emulator.refreshes[-1]['partial'])
+    print('OK')
+
+if __name__ == '__main__':
+
+  logger = logging.getLogger()
+  logger.level = logging.DEBUG
+  logger.addHandler(logging.StreamHandler(sys.stdout))
+
+  unittest.main()
@@ -0,0 +1,221 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Custom functions test (inkycal.custom.functions)
+Copyright by aceisace
+"""
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from PIL import Image, ImageFont
+from inkycal.custom import functions
+from inkycal.custom import *
+from helper_functions import *
+
+
+class font_cache_test(unittest.TestCase):
+
+  def setUp(self):
+    clear_font_cache()
+    self.path = fonts['NotoSansUI-Regular']
+
+  def tearDown(self):
+    functions._font_cache.maxsize = 128
+
+  def test_get_font(self):
+    print('testing the font cache...', end="")
+    font = get_font(self.path, 12)
+    self.assertIs(get_font(self.path, 12), font)
+    self.assertIsNot(get_font(self.path, 13), font)
+    self.assertEqual(font.size, 12)
+    self.assertEqual(font_cache_statistics(),
+                     {'hits': 1, 'misses': 2, 'size': 2})
+    print('OK')
+
+  def test_lru(self):
+    print('testing the font cache drops the least recently used...', end="")
+    functions._font_cache.maxsize = 3
+    first = get_font(self.path, 10)
+    for size in range(11, 14):
+      get_font(self.path, size)
+    self.assertEqual(font_cache_statistics()['size'], 3)
+    self.assertIsNot(get_font(self.path, 10), first)
+    # 12 and 13 were used more recently than 11
+    get_font(self.path, 12)
+    self.assertEqual(font_cache_statistics()['hits'], 1)
+    print('OK')
+
+  def test_write(self):
+    print('testing write reuses layouts and fonts...', end="")
+    font = ImageFont.truetype(self.path, 12)
+    images = []
+    for _ in range(2):
+      image = Image.new('RGB', (120, 40), 'white')
+      write(image, (0, 0), (120, 40), 'Inkycal', font=font, autofit=True)
+      images.append(image)
+    self.assertEqual(images[0].tobytes(), images[1].tobytes())
+    self.assertEqual(layout_cache_statistics(),
+                     {'hits': 1, 'misses': 1, 'size': 1})
+    print('OK')
+
+
+class layout_test(unittest.TestCase):
+
+  texts = ['Mo', '31', 'September', 'Inkycal is an e-Paper calendar',
+           'W' * 40, '']
+  boxes = [(10, 10), (40, 20), (60, 60), (200, 30), (400, 120), (30, 200)]
+
+  def setUp(self):
+    clear_font_cache()
+    self.font = ImageFont.truetype(fonts['NotoSans-SemiCondensed'], 14)
+
+  def test_same_as_legacy(self):
+    print('testing write draws the same as before...', end="")
+    options = [{}, {'autofit': True}, {'fill_width': 0.9, 'fill_height': 0.9},
+               {'alignment': 'left'}, {'alignment': 'right', 'autofit': True}]
+    for text in self.texts:
+      for box in self.boxes:
+        for kwargs in options:
+          images = [Image.new('RGB', (420, 220), 'white') for _ in range(2)]
+          legacy_write(images[0], (5, 5), box, text, font=self.font, **kwargs)
+          write(images[1], (5, 5), box, text, font=self.font, **kwargs)
+          self.assertEqual(images[0].tobytes(), images[1].tobytes(),
+                           (text, box, kwargs))
+    print('OK')
+
+  def test_fit_fontsize(self):
+    print('testing fit_fontsize...', end="")
+    path = self.font.path
+    for width, height in [(10, 10), (50, 20), (300, 300), (1000, 90)]:
+      size = 8
+      font = ImageFont.truetype(path, size)
+      while (font.getsize('Inkycal')[0] < width and
+             font.getsize('hg')[1] < height):
+        size += 1
+        font = ImageFont.truetype(path, size)
+      self.assertEqual(fit_fontsize(path, 'Inkycal', width, height), size)
+    print('OK')
+
+  def test_truncate(self):
+    print('testing truncate...', end="")
+    text = 'Inkycal is an e-Paper calendar'
+    for width in range(0, 260, 7):
+      expected = text
+      while (self.font.getsize(expected)[0], 19) > (width, 19):
+        expected = expected[:-1]
+      self.assertEqual(truncate(text, self.font, width, 19), expected)
+    print('OK')
+
+
+class font_index_test(unittest.TestCase):
+
+  def setUp(self):
+    self.folder = tempfile.mkdtemp()
+    os.makedirs(os.path.join(self.folder, 'fonts', 'Noto'))
+    for name in ['NotoSansUI-Regular', 'NotoSans-SemiCondensed']:
+      shutil.copy(fonts[name], os.path.join(self.folder, 'fonts', 'Noto'))
+    self.index_file = os.path.join(self.folder, 'cache', 'fonts.json')
+
+  def tearDown(self):
+    shutil.rmtree(self.folder)
+
+  def index(self):
+    return functions.FontIndex(os.path.join(self.folder, 'fonts'),
+                               self.index_file)
+
+  def test_lazy(self):
+    print('testing fonts are searched on first lookup...', end="")
+    index = self.index()
+    self.assertFalse(os.path.exists(self.index_file))
+    self.assertEqual(sorted(index),
+                     ['NotoSans-SemiCondensed', 'NotoSansUI-Regular'])
+    self.assertTrue(index['NotoSansUI-Regular'].endswith(
+      os.path.join('Noto', 'NotoSansUI-Regular.ttf')))
+    self.assertTrue(os.path.exists(self.index_file))
+    print('OK')
+
+  def test_stored_index(self):
+    print('testing the stored font index...', end="")
+    self.index()['NotoSansUI-Regular']
+    walk = os.walk
+    try:
+      os.walk = None
+      # an unchanged folder is not searched again
+      self.assertEqual(len(self.index()), 2)
+    finally:
+      os.walk = walk
+
+    # a new font changes the modification time of its directory
+    time.sleep(0.01)
+    shutil.copy(fonts['weathericons-regular-webfont'],
+                os.path.join(self.folder, 'fonts', 'Noto'))
+    self.assertIn('weathericons-regular-webfont', self.index())
+    print('OK')
+
+  def test_prewarm(self):
+    print('testing prewarming the fonts in the settings...', end="")
+    clear_font_cache()
+    settings = {'info_section': True, 'modules': [
+      {'name': 'Agenda', 'config': {'fontsize': 12}},
+      {'name': 'Feeds', 'config': {'fontsize': 12,
+                                   'font': 'NotoSans-SemiCondensed'}}]}
+    self.assertEqual(fonts_in_settings(settings),
+                     [('NotoSansUI-Regular', 14), ('NotoSansUI-Regular', 12),
+                      ('NotoSans-SemiCondensed', 12)])
+    prewarm_fonts(fonts_in_settings(settings)).join()
+    self.assertEqual(font_cache_statistics()['size'], 3)
+    print('OK')
+
+
+sample_text = (
+  'Inkycal is a software written in python for selected Raspberry Pi '
+  'models and e-Paper displays. It displays events, weather, news, jokes '
+  'and much more on the display, which only needs power while it is being '
+  'updated.  Thanks to e-Paper, the   content stays visible without power. '
+  'Supercalifragilisticexpialidocious-words-are-wrapped-on-their-own too.')
+
+
+class text_wrap_test(unittest.TestCase):
+
+  def setUp(self):
+    clear_font_cache()
+    self.font = ImageFont.truetype(fonts['NotoSansUI-Regular'], 16)
+
+  def test_same_as_legacy(self):
+    print('testing text_wrap breaks lines as before...', end="")
+    for max_width in range(20, 700, 13):
+      self.assertEqual(text_wrap(sample_text, self.font, max_width),
+                       legacy_text_wrap(sample_text, self.font, max_width),
+                       max_width)
+    self.assertEqual(text_wrap('short', self.font, 200), ['short'])
+    print('OK')
+
+  def test_optimal(self):
+    print('testing optimal line breaks...', end="")
+    ragged = lambda lines, width: sum(
+      (width - self.font.getsize(line.rstrip(' '))[0]) ** 2
+      for line in lines[:-1])
+    for max_width in [150, 240, 333]:
+      greedy = text_wrap(sample_text, self.font, max_width)
+      optimal = text_wrap(sample_text, self.font, max_width, mode='optimal')
+      self.assertEqual(' '.join(optimal).split(), sample_text.split())
+      self.assertEqual(len(optimal), len(greedy))
+      self.assertLessEqual(ragged(optimal, max_width),
+                           ragged(greedy, max_width))
+      for line in optimal:
+        if ' ' in line.rstrip(' '):
+          self.assertLessEqual(self.font.getsize(line)[0], max_width)
+    with self.assertRaises(ValueError):
+      text_wrap(sample_text, self.font, 100, mode='justified')
+    print('OK')
+
+
+if __name__ == '__main__':
+
+  logger = logging.getLogger()
+  logger.level = logging.DEBUG
+  logger.addHandler(logging.StreamHandler(sys.stdout))
+
+  unittest.main()
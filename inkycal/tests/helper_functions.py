@@ -22,3 +22,204 @@ def get_environment():
       if 'Raspberry' in file.read():
         environment = 'Raspberry'
   return environment
+
+def legacy_getbuffer_1bpp(image, width, height):
+  """Reference implementation of the pixel loop previously used by the
+  drivers' getbuffer for 1-bit-per-pixel panels"""
+  buf = [0xFF] * (int(width/8) * height)
+  image_monocolor = image.convert('1')
+  imwidth, imheight = image_monocolor.size
+  pixels = image_monocolor.load()
+  if(imwidth == width and imheight == height):
+    for y in range(imheight):
+      for x in range(imwidth):
+        if pixels[x, y] == 0:
+          buf[int((x + y * width) / 8)] &= ~(0x80 >> (x % 8))
+  elif(imwidth == height and imheight == width):
+    for y in range(imheight):
+      for x in range(imwidth):
+        newx = y
+        newy = height - x - 1
+        if pixels[x, y] == 0:
+          buf[int((newx + newy*width) / 8)] &= ~(0x80 >> (y % 8))
+  return buf
+
+def legacy_getbuffer_2bpp(image, width, height):
+  """Reference implementation of the pixel loop previously used by the
+  drivers' getbuffer for 2-bit-per-pixel panels"""
+  buf = [0x00] * int(width * height / 4)
+  image_monocolor = image.convert('1')
+  imwidth, imheight = image_monocolor.size
+  pixels = image_monocolor.load()
+  if(imwidth == width and imheight == height):
+    for y in range(imheight):
+      for x in range(imwidth):
+        if pixels[x, y] < 64:
+          buf[int((x + y * width) / 4)] &= ~(0xC0 >> (x % 4 * 2))
+        else:
+          buf[int((x + y * width) / 4)] |= 0xC0 >> (x % 4 * 2)
+  elif(imwidth == height and imheight == width):
+    for y in range(imheight):
+      for x in range(imwidth):
+        newx = y
+        newy = height - x - 1
+        if pixels[x, y] < 64:
+          buf[int((newx + newy*width) / 4)] &= ~(0xC0 >> (y % 4 * 2))
+        else:
+          buf[int((newx + newy*width) / 4)] |= 0xC0 >> (y % 4 * 2)
+  return buf
+
+def legacy_expand_2bpp(image):
+  """Reference implementation of the 2bpp -> 4bpp conversion previously done
+  byte by byte in the display function of the 5.83" and 7.5" (v1) drivers"""
+  stream = []
+  for temp1 in image:
+    for _ in range(2):
+      nibbles = []
+      for _ in range(2):
+        if (temp1 & 0xC0) == 0xC0:
+          nibbles.append(0x03)
+        elif (temp1 & 0xC0) == 0x00:
+          nibbles.append(0x00)
+        else:
+          nibbles.append(0x04)
+        temp1 = (temp1 << 2) & 0xFF
+      stream.append((nibbles[0] << 4) | nibbles[1])
+  return stream
+
+def legacy_merge_colour_4bpp(imageblack, imagered):
+  """Reference implementation of the 1bpp -> 4bpp conversion previously done
+  byte by byte in the display function of the 5.83" and 7.5" (v1) colour
+  drivers"""
+  stream = []
+  for temp1, temp2 in zip(imageblack, imagered):
+    for _ in range(4):
+      nibbles = []
+      for _ in range(2):
+        if (temp2 & 0x80) == 0x00:
+          nibbles.append(0x04)
+        elif (temp1 & 0x80) == 0x00:
+          nibbles.append(0x00)
+        else:
+          nibbles.append(0x03)
+        temp1 = (temp1 << 1) & 0xFF
+        temp2 = (temp2 << 1) & 0xFF
+      stream.append((nibbles[0] << 4) | nibbles[1])
+  return stream
+
+def legacy_event_dicts(ical_events, timezone):
+  """Reference implementation of the event dicts previously built by
+  iCalendar.get_events from expanded icalendar events"""
+  import arrow
+  return [
+    {
+    'title': events.get('SUMMARY').lstrip(),
+
+    'begin': arrow.get(events.get('DTSTART').dt).to(timezone) if (
+      arrow.get(events.get('dtstart').dt).format('HH:mm') != '00:00')
+      else arrow.get(events.get('DTSTART').dt).replace(tzinfo=timezone),
+
+    'end':arrow.get(events.get("DTEND").dt).to(timezone) if (
+      arrow.get(events.get('dtstart').dt).format('HH:mm') != '00:00')
+      else arrow.get(events.get('DTEND').dt).replace(tzinfo=timezone)
+
+    } for events in ical_events]
+
+def legacy_all_day(event):
+  """Reference implementation of the string based iCalendar.all_day check"""
+  begin, end = event['begin'], event['end']
+  duration = end - begin
+  return (begin.format('HH:mm') == '00:00' and end.format('HH:mm') == '00:00'
+          and duration.days >= 1)
+
+def legacy_write(image, xy, box_size, text, font=None, **kwargs):
+  """Reference implementation of custom.functions.write, which previously
+  increased the fontsize and removed characters one at a time"""
+  from PIL import Image, ImageDraw, ImageFont
+  alignment = kwargs.get('alignment', 'center')
+  autofit = kwargs.get('autofit', False)
+  fill_width = kwargs.get('fill_width', 1.0)
+  fill_height = kwargs.get('fill_height', 0.8)
+  x,y = xy
+  box_width, box_height = box_size
+
+  if (autofit == True) or (fill_width != 1.0) or (fill_height != 0.8):
+    size = 8
+    font = ImageFont.truetype(font.path, size)
+    text_width, text_height = font.getsize(text)[0], font.getsize('hg')[1]
+    while (text_width < int(box_width * fill_width) and
+           text_height < int(box_height * fill_height)):
+      size += 1
+      font = ImageFont.truetype(font.path, size)
+      text_width, text_height = font.getsize(text)[0], font.getsize('hg')[1]
+
+  text_width, text_height = font.getsize(text)[0], font.getsize('hg')[1]
+
+  if (text_width, text_height) > (box_width, box_height):
+    while (text_width, text_height) > (box_width, box_height):
+      text=text[0:-1]
+      text_width, text_height = font.getsize(text)[0], font.getsize('hg')[1]
+
+  if alignment == "center" or None:
+    x = int((box_width / 2) - (text_width / 2))
+  elif alignment == 'left':
+    x = 0
+  elif alignment == 'right':
+    x = int(box_width - text_width)
+
+  y = int((box_height / 2) - (text_height / 2))
+
+  space = Image.new('RGBA', (box_width, box_height))
+  ImageDraw.Draw(space).text((x, y), text, fill='black', font=font)
+  image.paste(space, xy, space)
+
+def legacy_text_wrap(text, font=None, max_width = None):
+  """Reference implementation of custom.functions.text_wrap, which
+  previously measured the growing line for every word"""
+  lines = []
+  if font.getsize(text)[0] < max_width:
+    lines.append(text)
+  else:
+    words = text.split(' ')
+    i = 0
+    while i < len(words):
+      line = ''
+      while i < len(words) and font.getsize(line + words[i])[0] <= max_width:
+        line = line + words[i] + " "
+        i += 1
+      if not line:
+        line = words[i]
+        i += 1
+      lines.append(line)
+  return lines
+
+def legacy_to_palette(image, palette, dither=True):
+  """Reference implementation of Inkyimage.to_palette, which previously
+  split the bands with boolean masks on two RGB copies of the image"""
+  import numpy
+  from PIL import Image
+  image = image.convert('RGB')
+  if palette == 'bw':
+    im_black = image.convert('1', dither=dither)
+    return im_black, Image.new(mode='RGB', size=im_black.size, color='white')
+
+  pal = {'bwr': [255,255,255, 0,0,0, 255,0,0],
+         'bwy': [255,255,255, 0,0,0, 255,255,0]}[palette]
+  pal += (256 % 3) * [0,0,0]
+  palette_im = Image.new('P', (1,1))
+  palette_im.putpalette(pal * (256 // 4))
+  quantized_im = image.quantize(palette=palette_im, dither=dither)
+  quantized_im = quantized_im.convert('RGB')
+  r_col, g_col, b_col = pal[6:9]
+
+  buffer1 = numpy.array(quantized_im)
+  r,g,b = buffer1[:, :, 0], buffer1[:, :, 1], buffer1[:, :, 2]
+  buffer1[numpy.logical_and(r==r_col, g==g_col)] = [255,255,255]
+  im_black = Image.fromarray(buffer1)
+
+  buffer2 = numpy.array(quantized_im)
+  r,g,b = buffer2[:, :, 0], buffer2[:, :, 1], buffer2[:, :, 2]
+  buffer2[numpy.logical_and(r==0, g==0)] = [255,255,255]
+  buffer2[numpy.logical_and(g==g_col, b==0)] = [0,0,0]
+  im_colour = Image.fromarray(buffer2)
+  return im_black, im_colour
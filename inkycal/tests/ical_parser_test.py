@@ -8,10 +8,19 @@ Copyright by aceisace
 
 import os
 import arrow
+import shutil
+import tempfile
+import threading
+import random
 import unittest
+from functools import partial
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
 from urllib.request import urlopen
 
-from inkycal.modules.ical_parser import iCalendar
+from inkycal.modules.ical_parser import iCalendar, Fetcher
+from inkycal.modules import ical_parser
+from icalendar import Calendar
+import recurring_ical_events
 from helper_functions import *
 
 
@@ -49,6 +58,419 @@ class ical_parser_test(unittest.TestCase):
     print('OK')
     os.remove('dummy.ical')
 
+sample_ical = """BEGIN:VCALENDAR
+VERSION:2.0
+PRODID:-//inkycal//test//EN
+BEGIN:VEVENT
+UID:1@inkycal
+DTSTART:20200106T100000Z
+DTEND:20200106T110000Z
+RRULE:FREQ=WEEKLY;BYDAY=MO
+SUMMARY:Weekly meeting
+END:VEVENT
+BEGIN:VEVENT
+UID:2@inkycal
+DTSTART;VALUE=DATE:20200110
+DTEND;VALUE=DATE:20200111
+SUMMARY:Holiday
+END:VEVENT
+END:VCALENDAR
+"""
+
+class parse_cache_test(unittest.TestCase):
+
+  def test_parse_cache(self):
+    print('testing the parsed-calendar cache...', end="")
+    calendar = ical_parser.parse_ical(sample_ical)
+    self.assertIs(ical_parser.parse_ical(str(sample_ical)), calendar)
+    self.assertIsNot(ical_parser.parse_ical(sample_ical.replace(
+      'Holiday', 'Vacation')), calendar)
+    print('OK')
+
+  def test_expansion_cache(self):
+    print('testing memoized recurrence expansion...', end="")
+    text = sample_ical.replace('Weekly meeting', 'Weekly sync')
+    windows = [(arrow.get('2020-01-01'), arrow.get('2020-02-01')),
+               (arrow.get('2020-01-15'), arrow.get('2020-02-12')),
+               (arrow.get('2020-01-20T10:30:00'), arrow.get('2020-03-20'))]
+
+    for start, end in windows:
+      cached, direct = iCalendar(), iCalendar()
+      cached.icalendars = [ical_parser.parse_ical(text)]
+      direct.icalendars = [Calendar.from_ical(text)]
+      self.assertEqual(
+        [(e['title'], e['begin']) for e in cached.get_events(start, end)],
+        [(e['title'], e['begin']) for e in direct.get_events(start, end)])
+
+    # January and February were only expanded once for all windows
+    parsed = ical_parser._parsed_by_id[id(cached.icalendars[0])]
+    self.assertEqual(list(parsed._blocks), [(2020, 1), (2020, 2), (2020, 3)])
+    self.assertGreater(iCalendar.cache_statistics()['expand_hits'], 0)
+    print('OK')
+
+  def test_events_without_uid(self):
+    print('testing events without UID at the same time...', end="")
+    text = '\r\n'.join([
+      'BEGIN:VCALENDAR', 'VERSION:2.0', 'PRODID:-//inkycal//test//EN',
+      'BEGIN:VEVENT', 'DTSTART:20261022T120000Z', 'DTEND:20261022T130000Z',
+      'SUMMARY:NoUID lunch', 'END:VEVENT',
+      'BEGIN:VEVENT', 'DTSTART:20261022T120000Z', 'DTEND:20261022T130000Z',
+      'SUMMARY:NoUID call', 'END:VEVENT',
+      'BEGIN:VEVENT', 'UID:long@inkycal', 'DTSTART:20261028T120000Z',
+      'DTEND:20261104T130000Z', 'SUMMARY:Across months', 'END:VEVENT',
+      'END:VCALENDAR'])
+    parser = iCalendar()
+    parser.icalendars = [ical_parser.parse_ical(text)]
+    # the window covers two month blocks
+    events = parser.get_events(arrow.get('2026-10-01'),
+                               arrow.get('2026-11-28'))
+    self.assertEqual(sorted(event['title'] for event in events),
+                     ['Across months', 'NoUID call', 'NoUID lunch'])
+    print('OK')
+
+large_ical = """BEGIN:VCALENDAR
+VERSION:2.0
+PRODID:-//inkycal//test//EN
+BEGIN:VTODO
+UID:todo@inkycal
+SUMMARY:Not an event
+END:VTODO
+BEGIN:VEVENT
+UID:past@inkycal
+DTSTART:20191201T100000Z
+DTEND:20191201T110000Z
+SUMMARY:Past
+END:VEVENT
+BEGIN:VEVENT
+UID:until@inkycal
+DTSTART:20190107T090000Z
+DTEND:20190107T100000Z
+RRULE:FREQ=WEEKLY;UNTIL=20191230T090000Z
+SUMMARY:Ended series
+END:VEVENT
+BEGIN:VEVENT
+UID:count@inkycal
+DTSTART;VALUE=DATE:20191220
+DTEND;VALUE=DATE:20191221
+RRULE:FREQ=DAILY;COUNT=5
+SUMMARY:Counted series
+END:VEVENT
+BEGIN:VEVENT
+UID:future@inkycal
+DTSTART:20200301T100000Z
+DTEND:20200301T110000Z
+SUMMARY:Future
+END:VEVENT
+BEGIN:VEVENT
+UID:weekly@inkycal
+DTSTART:20150105T100000Z
+DTEND:20150105T110000Z
+RRULE:FREQ=WEEKLY;BYDAY=MO
+SUMMARY:Weekly
+END:VEVENT
+BEGIN:VEVENT
+UID:folded@inkycal
+DTSTART:20200108T120000Z
+DTEND:20200108T130000Z
+SUMMARY:A long title which is folded
+  over two lines
+END:VEVENT
+BEGIN:VEVENT
+UID:holiday@inkycal
+DTSTART;VALUE=DATE:20200110
+DTEND;VALUE=DATE:20200111
+SUMMARY:Holiday
+END:VEVENT
+END:VCALENDAR
+""".replace('\n', '\r\n')
+
+class stream_test(unittest.TestCase):
+
+  start, end = arrow.get('2020-01-06'), arrow.get('2020-01-20')
+
+  def test_stream_ical(self):
+    print('testing streaming iCalendars...', end="")
+    calendar = ical_parser.stream_ical(
+      large_ical.splitlines(True), self.start, self.end)
+    self.assertEqual(
+      [str(event['SUMMARY']) for event in calendar.walk('VEVENT')],
+      ['Weekly', 'A long title which is folded over two lines', 'Holiday'])
+    self.assertEqual(calendar.walk('VTODO'), [])
+    print('OK')
+
+  def test_same_events(self):
+    print('testing streamed events match parsed events...', end="")
+    with tempfile.NamedTemporaryFile('w', suffix='.ics', newline='',
+                                     delete=False) as file:
+      file.write(large_ical)
+    try:
+      streamed, parsed = iCalendar(), iCalendar()
+      streamed.load_from_file(file.name, self.start, self.end)
+      parsed.load_from_file(file.name)
+      fields = lambda events: [(e['title'], e['begin'], e['end'])
+                               for e in events]
+      self.assertEqual(fields(streamed.get_events(self.start, self.end)),
+                       fields(parsed.get_events(self.start, self.end)))
+      self.assertEqual(len(streamed.parsed_events), 4)
+    finally:
+      os.remove(file.name)
+    print('OK')
+
+class event_index_test(unittest.TestCase):
+
+  def setUp(self):
+    random.seed(1)
+    start = arrow.get('2020-01-01', tzinfo='Europe/Berlin')
+    self.events = []
+    for number in range(500):
+      begin = start.shift(minutes=random.randrange(0, 60 * 24 * 90, 15))
+      end = begin.shift(minutes=random.choice([0, 30, 90, 60 * 24 * 3]))
+      self.events.append({'title': str(number), 'begin': begin, 'end': end})
+    self.index = ical_parser.EventIndex(self.events)
+    self.by_date = sorted(self.events, key=lambda event: event['begin'])
+
+  def test_overlapping(self):
+    print('testing overlap queries of the event index...', end="")
+    for _ in range(50):
+      t_start = arrow.get('2020-01-01').shift(hours=random.randrange(24 * 95))
+      t_end = t_start.shift(hours=random.randrange(1, 24 * 10))
+      self.assertEqual(self.index.overlapping(t_start, t_end),
+                       [e for e in self.by_date
+                        if e['end'] > t_start and e['begin'] < t_end])
+      self.assertEqual(self.index.starting(t_start, t_end),
+                       [e for e in self.by_date
+                        if t_start <= e['begin'] < t_end])
+    print('OK')
+
+  def test_upcoming(self):
+    print('testing upcoming events of the event index...', end="")
+    t = arrow.get('2020-02-10T12:00:00+01:00')
+    running = [e for e in self.by_date if e['begin'] < t < e['end']]
+    later = [e for e in self.by_date if e['begin'] >= t]
+    self.assertEqual(self.index.upcoming(t, 10), (running + later)[:10])
+    self.assertEqual(self.index.upcoming(t), running + later)
+    print('OK')
+
+  def test_days_with_events(self):
+    print('testing days with events of the event index...', end="")
+    month_start = arrow.get('2020-02-01', tzinfo='Europe/Berlin')
+    month_end = month_start.ceil('month')
+    days = {day.day for day in arrow.Arrow.range('day', month_start, month_end)
+            if any(e['end'] > day and e['begin'] < day.shift(days=1)
+                   for e in self.events)}
+    self.assertEqual(self.index.days_with_events(month_start, month_end),
+                     sorted(days))
+
+    multi_day = {'title': 'trip', 'begin': month_start.shift(days=-1),
+                 'end': month_start.shift(days=2)}
+    self.assertEqual(ical_parser.EventIndex([multi_day]).days_with_events(
+      month_start, month_end), [1, 2])
+    print('OK')
+
+  def test_get_events(self):
+    print('testing iCalendar keeps its events indexed...', end="")
+    parser = iCalendar()
+    parser.icalendars = [ical_parser.parse_ical(sample_ical)]
+    start = arrow.get('2020-01-01')
+    parser.get_events(start, start.shift(months=1))
+    self.assertEqual(parser.index.events, parser.parsed_events)
+    self.assertEqual([e['title'] for e in parser.index.upcoming(
+      arrow.get('2020-01-10T12:00'), 2)], ['Holiday', 'Weekly meeting'])
+    parser.clear_events()
+    self.assertEqual(len(parser.index), 0)
+    print('OK')
+
+class event_record_test(unittest.TestCase):
+
+  def test_same_as_dicts(self):
+    print('testing event records match the previous event dicts...', end="")
+    occurrences = recurring_ical_events.of(
+      ical_parser.parse_ical(large_ical)).between((2019, 12, 1), (2020, 2, 1))
+    for timezone in ['UTC', 'Europe/Berlin', 'America/New_York']:
+      tzinfo = arrow.now(timezone).tzinfo
+      records = [ical_parser.make_record(event, tzinfo)
+                 for event in occurrences]
+      for record, legacy in zip(records,
+                                legacy_event_dicts(occurrences, timezone)):
+        self.assertEqual(record['title'], legacy['title'])
+        self.assertEqual(record['begin'], legacy['begin'])
+        self.assertEqual(record['end'], legacy['end'])
+        self.assertEqual(record['begin'].utcoffset(),
+                         legacy['begin'].utcoffset())
+        self.assertEqual(iCalendar.all_day(record), legacy_all_day(legacy))
+    print('OK')
+
+  def test_lazy_and_compact(self):
+    print('testing event records are compact...', end="")
+    parser = iCalendar()
+    parser.icalendars = [ical_parser.parse_ical(sample_ical)]
+    events = parser.get_events(arrow.get('2020-01-01'), arrow.get('2020-02-01'),
+                               'Europe/Berlin')
+    meetings = [event for event in events if event.title == 'Weekly meeting']
+    self.assertIs(meetings[0].title, meetings[1].title)
+    self.assertFalse(hasattr(meetings[0], '__dict__'))
+    self.assertIsNone(meetings[0]._begin)
+    self.assertEqual(meetings[0]['begin'].format('HH:mm'), '11:00')
+    self.assertIn('end', meetings[0])
+    self.assertNotIn('foo', meetings[0])
+    print('OK')
+
+class QuietHandler(SimpleHTTPRequestHandler):
+  """Serves files with keep-alive connections, without logging"""
+  protocol_version = 'HTTP/1.1'
+  connections = 0
+
+  def setup(self):
+    QuietHandler.connections += 1
+    super().setup()
+
+  def log_message(self, *args):
+    pass
+
+class fetcher_test(unittest.TestCase):
+
+  def setUp(self):
+    self.folder = tempfile.mkdtemp()
+    for name in ['a.ics', 'b.ics']:
+      with open(os.path.join(self.folder, name), 'w') as file:
+        file.write(sample_ical)
+    QuietHandler.connections = 0
+    handler = partial(QuietHandler, directory=self.folder)
+    self.server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=self.server.serve_forever, daemon=True).start()
+    self.url = f'http://127.0.0.1:{self.server.server_port}/'
+
+  def tearDown(self):
+    self.server.shutdown()
+    self.server.server_close()
+    shutil.rmtree(self.folder)
+
+  def test_conditional_requests(self):
+    print('testing conditional downloads...', end="")
+    fetcher = Fetcher()
+    text, changed = fetcher.fetch(self.url + 'a.ics')
+    self.assertTrue(changed)
+    self.assertEqual(text, sample_ical)
+    for _ in range(3):
+      self.assertEqual(fetcher.fetch(self.url + 'a.ics'), (sample_ical, False))
+    self.assertEqual(fetcher.stats['requests'], 4)
+    self.assertEqual(fetcher.stats['misses'], 1)
+    self.assertEqual(fetcher.stats['hits'], 3)
+    self.assertEqual(fetcher.stats['bytes'], len(sample_ical))
+    # all requests went over one kept-alive connection
+    self.assertEqual(QuietHandler.connections, 1)
+    print('OK')
+
+  def test_fetch_all(self):
+    print('testing parallel downloads...', end="")
+    fetcher = Fetcher()
+    urls = [self.url + 'a.ics', self.url + 'b.ics']
+    self.assertEqual(fetcher.fetch_all(urls), [(sample_ical, True)] * 2)
+    self.assertEqual(fetcher.fetch_all(urls), [(sample_ical, False)] * 2)
+    print('OK')
+
+  def test_server_error(self):
+    print('testing download errors...', end="")
+    fetcher = Fetcher()
+    fetcher.fetch(self.url + 'a.ics')
+    os.remove(os.path.join(self.folder, 'a.ics'))
+    fetcher._downloads[self.url + 'a.ics']['last_modified'] = None
+    # the last download is used if the server fails
+    self.assertEqual(fetcher.fetch(self.url + 'a.ics'), (sample_ical, False))
+    self.assertEqual(fetcher.stats['errors'], 1)
+    with self.assertRaises(Exception):
+      fetcher.fetch(self.url + 'missing.ics')
+    print('OK')
+
+  def test_load_url(self):
+    print('testing loading iCalendars with the shared fetcher...', end="")
+    parser = iCalendar()
+    parser.load_url([self.url + 'a.ics', self.url + 'b.ics'])
+    parsed = parser.icalendars[0]
+    events = parser.get_events(arrow.get('2020-01-01'), arrow.get('2020-01-31'))
+    self.assertEqual(len(events), 2 * 5)
+
+    # unchanged calendars are not parsed again
+    parser = iCalendar()
+    parser.load_url(self.url + 'a.ics')
+    self.assertIs(parser.icalendars[0], parsed)
+    self.assertGreaterEqual(iCalendar.fetch_statistics()['hits'], 1)
+    print('OK')
+
+  def test_stream_url(self):
+    print('testing streaming iCalendars from URLs...', end="")
+    ical_parser.fetcher.reset_stats()
+    parser = iCalendar()
+    start, end = arrow.get('2020-01-08'), arrow.get('2020-01-12')
+    parser.load_url(self.url + 'a.ics', timeline_start=start,
+                    timeline_end=end)
+    self.assertEqual([e['title'] for e in parser.get_events(start, end)],
+                     ['Holiday'])
+    self.assertEqual(ical_parser.fetcher.stats['bytes'],
+                     len(sample_ical.replace('\n', '')))
+    with self.assertRaises(Exception):
+      parser.load_url(self.url + 'missing.ics', timeline_start=start,
+                      timeline_end=end)
+    print('OK')
+
+  def test_event_store(self):
+    print('testing the shared event store...', end="")
+    store = ical_parser.EventStore()
+    ical_parser.fetcher.reset_stats()
+    url = self.url + 'a.ics'
+    with open(os.path.join(self.folder, 'c.ics'), 'w') as file:
+      file.write(sample_ical.replace('Holiday', 'Trip'))
+    path = os.path.join(self.folder, 'c.ics')
+
+    calendar = store.subscribe([url, url], None)
+    agenda = store.subscribe([url], [path])
+    self.assertEqual(calendar.sources, [('url', url)])
+
+    start, end = arrow.get('2020-01-01'), arrow.get('2020-01-15')
+    month = calendar.get(start, end)
+    self.assertEqual([e['title'] for e in month],
+                     ['Weekly meeting', 'Holiday', 'Weekly meeting'])
+    events = agenda.get(start, end)
+    self.assertEqual(len(events), 6)
+    self.assertEqual(events, sorted(events, key=lambda e: e['begin']))
+
+    # the shared url was only downloaded once
+    self.assertEqual(ical_parser.fetcher.stats['requests'], 1)
+    store.max_age = 0
+    calendar.get(start, end)
+    self.assertEqual(ical_parser.fetcher.stats['requests'], 2)
+    print('OK')
+
+  def test_event_store_streaming(self):
+    print('testing large sources in the event store...', end="")
+    store = ical_parser.EventStore(stream_size=0)
+    ical_parser.fetcher.reset_stats()
+    url = self.url + 'a.ics'
+    path = os.path.join(self.folder, 'b.ics')
+    events = store.subscribe([url], [path])
+
+    week = arrow.get('2020-01-08'), arrow.get('2020-01-12')
+    self.assertEqual([e['title'] for e in events.get(*week)],
+                     ['Holiday', 'Holiday'])
+    self.assertEqual(store._sources[('url', url)][2], week)
+    self.assertEqual(store._sources[('file', path)][2], week)
+    # the window is covered, nothing is loaded again
+    events.get(arrow.get('2020-01-09'), arrow.get('2020-01-11'))
+    self.assertEqual(ical_parser.fetcher.stats['requests'], 1)
+
+    # a wider window streams the sources again, for both windows
+    month = arrow.get('2020-01-01'), arrow.get('2020-01-15')
+    self.assertEqual(len(events.get(*month)), 6)
+    self.assertEqual(ical_parser.fetcher.stats['requests'], 2)
+    self.assertEqual(store._sources[('url', url)][2], month)
+
+    # small sources are parsed as a whole
+    store = ical_parser.EventStore()
+    store.subscribe([url], [path]).get(*week)
+    self.assertIsNone(store._sources[('url', url)][2])
+    self.assertIsNone(store._sources[('file', path)][2])
+    print('OK')
+
 if __name__ == '__main__':
 
   logger = logging.getLogger()
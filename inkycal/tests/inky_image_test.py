@@ -0,0 +1,155 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Image class test (inky_image)
+Copyright by aceisace
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy
+from PIL import Image
+
+from inkycal.modules import inky_image
+from inkycal.modules.inky_image import Inkyimage, dither_image
+from helper_functions import *
+
+
+def sample_image(width=203, height=77):
+  """Returns an image with noise and solid red, blue, black and white"""
+  random = numpy.random.RandomState(0)
+  pixels = random.randint(0, 256, (height, width, 3)).astype(numpy.uint8)
+  image = Image.fromarray(pixels)
+  for number, colour in enumerate(['red', 'blue', 'black', 'white']):
+    image.paste(colour, (number * 20, 0, number * 20 + 20, 20))
+  return image
+
+
+def scan_dither(image, palette, method):
+  """Error diffusion one pixel at a time, in the order of a scan"""
+  mode, colours = inky_image._palette_matrix(palette)
+  pixels = numpy.asarray(image.convert(mode), dtype=numpy.float64).reshape(
+    image.height, image.width, -1).copy()
+  offsets, divisor = inky_image.kernels[method]
+  indices = numpy.zeros((image.height, image.width), dtype=numpy.uint8)
+  for y in range(image.height):
+    for x in range(image.width):
+      value = pixels[y, x].clip(0, 255)
+      indices[y, x] = ((colours - value) ** 2).sum(axis=1).argmin()
+      error = value - colours[indices[y, x]]
+      for dy, dx, weight in offsets:
+        if 0 <= y + dy < image.height and 0 <= x + dx < image.width:
+          pixels[y + dy, x + dx] += error * weight / divisor
+  return indices
+
+
+class inky_image_test(unittest.TestCase):
+
+  def test_to_palette(self):
+    print('testing to_palette maps images as before...', end="")
+    image = sample_image()
+    for palette in ['bwr', 'bwy', 'bw']:
+      for dither in [True, False]:
+        expected = legacy_to_palette(image, palette, dither=dither)
+        bands = Inkyimage(image).to_palette(palette, dither=dither)
+        for band, legacy in zip(bands, expected):
+          self.assertEqual(band.mode, '1')
+          self.assertEqual(band.size, image.size)
+          self.assertEqual(band.convert('RGB').tobytes(), legacy.convert('RGB').tobytes(),
+                           (palette, dither))
+    print('OK')
+
+  def test_packed(self):
+    print('testing to_palette with packed buffers...', end="")
+    image = sample_image()
+    im_black, im_colour = Inkyimage(image).to_palette('bwr', dither=False)
+    black, colour = Inkyimage(image).to_palette('bwr', dither=False,
+                                                packed=True)
+    # rows are padded to full bytes
+    self.assertEqual(len(black), (image.width + 7) // 8 * image.height)
+    self.assertEqual(black, im_black.tobytes())
+    self.assertEqual(colour, im_colour.tobytes())
+    # the solid colours: red, blue (nearest to black), black and white
+    self.assertEqual([im_black.getpixel((x, 5)) for x in [5, 25, 45, 65]],
+                     [255, 0, 0, 255])
+    self.assertEqual([im_colour.getpixel((x, 5)) for x in [5, 25, 45, 65]],
+                     [0, 255, 255, 255])
+    with self.assertRaises(ValueError):
+      Inkyimage(image).to_palette('rgb')
+    print('OK')
+
+  def test_error_diffusion(self):
+    print('testing the error diffusion kernels...', end="")
+    for size in [(61, 37), (1, 5), (7, 1), (2, 2)]:
+      image = sample_image(*size)
+      # bwr has colours at the same distance from red and black, where
+      # rounding differences may pick the other one
+      for palette in ['bw', 'bwy']:
+        for method in inky_image.kernels:
+          self.assertTrue(
+            (dither_image(image, palette, method) ==
+             scan_dither(image, palette, method)).all(), (size, method))
+
+    # a mid grey becomes about half black, half white
+    grey = Image.new('RGB', (64, 48), (128, 128, 128))
+    for method in inky_image.dither_methods:
+      indices = dither_image(grey, 'bwr', method)
+      self.assertAlmostEqual(indices.mean(), 0.5, delta=0.05)
+    with self.assertRaises(ValueError):
+      dither_image(grey, 'bwr', 'random')
+    print('OK')
+
+  def test_auto_dither(self):
+    print('testing dithering methods in to_palette...', end="")
+    small = sample_image()
+    large = sample_image(1000, 500)
+    for image, method in [(small, 'floyd-steinberg'), (large, 'ordered')]:
+      bands = Inkyimage(image).to_palette('bwr', dither='auto', packed=True)
+      self.assertEqual(bands, Inkyimage(image).to_palette(
+        'bwr', dither=method, packed=True))
+    # Floyd-Steinberg is left to PIL, like dither=True
+    self.assertEqual(
+      Inkyimage(small).to_palette('bwy', dither='floyd-steinberg'),
+      Inkyimage(small).to_palette('bwy', dither=True))
+    im_black, im_colour = Inkyimage(small).to_palette('bw', dither='atkinson')
+    self.assertEqual(im_colour.getextrema(), (255, 255))
+    print('OK')
+
+  def test_load_reduced(self):
+    print('testing reducing large images while loading...', end="")
+    folder = tempfile.mkdtemp()
+    try:
+      photo = sample_image(40, 30).resize((2000, 1500), Image.BICUBIC)
+      for extension in ['jpg', 'png']:
+        path = os.path.join(folder, f'photo.{extension}')
+        photo.save(path)
+
+        full, reduced = Inkyimage(), Inkyimage()
+        full.load(path)
+        reduced.load(path, size=(200, 120))
+        self.assertEqual(full.image.size, (2000, 1500))
+        # reduced by 4, JPEGs while decoding
+        self.assertEqual(reduced.image.size, (500, 375))
+
+        # both look the same once resized for the display
+        for image in [full, reduced]:
+          image.resize(width=200, height=120)
+        self.assertEqual(full.image.size, reduced.image.size)
+        difference = numpy.abs(numpy.asarray(full.image, dtype=float) -
+                               numpy.asarray(reduced.image.convert('RGB')))
+        self.assertLess(difference.mean(), 2)
+    finally:
+      shutil.rmtree(folder)
+    print('OK')
+
+
+if __name__ == '__main__':
+
+  logger = logging.getLogger()
+  logger.level = logging.DEBUG
+  logger.addHandler(logging.StreamHandler(sys.stdout))
+
+  unittest.main()
@@ -6,6 +6,7 @@ Calendar test (inkycal_calendar)
 Copyright by aceisace
 """
 
+import arrow
 import unittest
 from inkycal.modules import Calendar as Module
 from helper_functions import *
@@ -83,6 +84,23 @@ class module_test(unittest.TestCase):
       if use_preview == True and environment == 'Raspberry':
         preview(merge(im_black, im_colour))
 
+  def test_next_update(self):
+    print('testing the next update without events...', end="")
+    test = {'config': dict(tests[1]['config'], refresh_interval=30)}
+    module = Module(test)
+    last_update = arrow.now(module.timezone).floor('day').shift(hours=+10)
+    self.assertEqual(module.next_update(last_update),
+                     last_update.shift(minutes=+30))
+    # counted from the full minute Inkycal woke up at
+    self.assertEqual(module.next_update(last_update.shift(seconds=+3)),
+                     last_update.shift(minutes=+30))
+    # without a refresh_interval, the calendar follows the update_interval
+    self.assertIsNone(Module(tests[1]).next_update(last_update))
+    late = last_update.shift(hours=+13, minutes=+50)
+    self.assertEqual(module.next_update(late),
+                     last_update.floor('day').shift(days=+1))
+    print('OK')
+
 if __name__ == '__main__':
 
   logger = logging.getLogger()
@@ -6,9 +6,15 @@ Slideshow test (inkycal_slideshow)
 Copyright by aceisace
 """
 
+import os
+import shutil
+import tempfile
+import time
 import unittest
 from inkycal.modules import Slideshow as Module
+from inkycal.modules.inkycal_slideshow import FolderIndex
 from inkycal.custom import top_level
+from inkycal.custom.cache import ImageCache
 from helper_functions import *
 environment = get_environment()
 
@@ -130,6 +136,148 @@ class module_test(unittest.TestCase):
 
     print('OK')
 
+  def test_prepared_slides(self):
+    print('testing slides are prepared in the background...', end="")
+    folder, cache = tempfile.mkdtemp(), tempfile.mkdtemp()
+    for name in ['coffee.png', 'logo.png']:
+      shutil.copy(os.path.join(test_path, name), folder)
+    config = {'name': 'Slideshow',
+              'config': dict(tests[0]['config'], path=folder)}
+    rendered = []
+
+    def module_with_cache():
+      module = Module(config)
+      module._cache = ImageCache(cache)
+      render = module._render
+      module._render = lambda path, size: (
+        rendered.append((path, size)) or render(path, size))
+      return module, render
+
+    try:
+      module, render = module_with_cache()
+      first = module.generate_image()
+      # the next slide is rendered while the first one is shown
+      module._pending[module.images.peek()].result()
+      self.assertEqual([path for path, _ in rendered], list(module.images))
+
+      second = module.generate_image()
+      self.assertEqual(len(rendered), 2)
+      expected = render(*rendered[1])
+      for band, band_expected in zip(second, expected):
+        self.assertEqual(band.tobytes(), band_expected.tobytes())
+
+      # after a restart, the slideshow continues with slides from the cache
+      module, render = module_with_cache()
+      for band, band_expected in zip(module.generate_image(), first):
+        self.assertEqual(band.tobytes(), band_expected.tobytes())
+      module._pending[module.images.peek()].result()
+      self.assertEqual(len(rendered), 2)
+
+      # only the slide which is shown next is kept pending
+      os.remove(module.images.peek())
+      module._check_images()
+      module._prepare(module.images.peek(), rendered[0][1])
+      self.assertEqual(list(module._pending), [module.images.peek()])
+    finally:
+      shutil.rmtree(folder)
+      shutil.rmtree(cache)
+    print('OK')
+
+
+class folder_index_test(unittest.TestCase):
+
+  def setUp(self):
+    self.folder = tempfile.mkdtemp()
+    self.state_file = os.path.join(self.folder, 'state', 'folder.json')
+    for name in ['b.jpg', 'a.PNG', 'notes.txt', 'album/c.jpeg',
+                 'album/old/d.jpg', 'album/animation.gif']:
+      self.add(name)
+
+  def tearDown(self):
+    shutil.rmtree(self.folder)
+
+  def add(self, name):
+    path = os.path.join(self.folder, 'images', name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, 'w').close()
+    return path
+
+  def index(self, shuffle=False):
+    index = FolderIndex(os.path.join(self.folder, 'images'),
+                        state_file=self.state_file, shuffle=shuffle)
+    index.refresh()
+    return index
+
+  def names(self, index):
+    return [os.path.relpath(path, index.folder) for path in index]
+
+  def test_order(self):
+    print('testing the slideshow folder index...', end="")
+    index = self.index()
+    self.assertEqual(self.names(index),
+                     ['a.PNG', 'album/c.jpeg', 'album/old/d.jpg', 'b.jpg'])
+    self.assertEqual([index.next() for _ in range(5)],
+                     list(index) + [list(index)[0]])
+    self.assertFalse(index.refresh())
+
+    # added and removed images are picked up, the cursor stays in place
+    time.sleep(0.01)
+    self.add('album/old/aa.jpg')
+    os.remove(os.path.join(index.folder, 'album', 'c.jpeg'))
+    self.assertTrue(index.refresh())
+    self.assertEqual(index.current, os.path.join(index.folder, 'a.PNG'))
+    self.assertEqual(self.names(index)[1:3],
+                     ['album/old/aa.jpg', 'album/old/d.jpg'])
+    index.next()
+    os.remove(index.next())
+    shutil.rmtree(os.path.join(index.folder, 'album', 'old'))
+    index.refresh()
+    self.assertEqual(self.names(index), ['a.PNG', 'b.jpg'])
+    self.assertEqual(index.next(), os.path.join(index.folder, 'b.jpg'))
+    print('OK')
+
+  def test_restart(self):
+    print('testing the folder index is kept across restarts...', end="")
+    index = self.index()
+    index.next()
+    index.next()
+    # the cursor is not stored on every move, but on exit
+    self.assertIsNone(self.index().current)
+    index._store_on_exit()
+    scandir = os.scandir
+    try:
+      # an unchanged folder is not listed again
+      os.scandir = None
+      restarted = self.index()
+    finally:
+      os.scandir = scandir
+    self.assertEqual(list(restarted), list(index))
+    self.assertEqual(restarted.next(), list(index)[2])
+    print('OK')
+
+  def test_shuffle(self):
+    print('testing the shuffled folder index...', end="")
+    index = self.index(shuffle=True)
+    shown = [index.next(), index.next()]
+    time.sleep(0.01)
+    added = self.add('e.jpg')
+    index.refresh()
+    # each image once per round, a new image before the round is over
+    shown += [index.next() for _ in range(3)]
+    self.assertEqual(sorted(shown), sorted(index))
+    self.assertIn(added, shown)
+    self.assertEqual(list(self.index(shuffle=True)), list(index))
+
+    # every round is shuffled again, the next image is known in advance
+    rounds = []
+    for _ in range(10):
+      upcoming = index.peek()
+      self.assertEqual(index.next(), upcoming)
+      rounds.append([upcoming] + [index.next() for _ in range(4)])
+      self.assertEqual(sorted(rounds[-1]), sorted(index))
+    self.assertGreater(len(set(map(tuple, rounds))), 1)
+    print('OK')
+
 if __name__ == '__main__':
 
   logger = logging.getLogger()
@@ -6,8 +6,11 @@ Main test (main)
 Copyright by aceisace
 """
 import os
+import time
 import unittest
 
+from PIL import Image
+
 from inkycal import Inkycal
 
 test_config = """
@@ -68,6 +71,49 @@ class module_test(unittest.TestCase):
 
     os.remove('dummy.json')
 
+  def test_late_images(self):
+    with open('dummy.json', mode="w") as file:
+      file.write(test_config)
+    print('testing the late images of a slow module...', end = "")
+    inky = Inkycal('dummy.json', render=False)
+    os.remove('dummy.json')
+    inky._module_timeouts[1] = 0.2
+
+    class SlowModule:
+      def generate_image(self):
+        time.sleep(0.5)
+        return (Image.new('RGB', (528, 80), 'white'),
+                Image.new('RGB', (528, 80), 'white'))
+
+    inky.module_1 = SlowModule()
+    inky._module_images.pop(1, None)
+    self.assertEqual(inky._generate_images([1]), {1: 'timeout'})
+    self.assertNotIn(1, inky._module_images)
+    time.sleep(0.5)
+    self.assertEqual(inky._generate_images([1]), {1: 'timeout'})
+    self.assertIn(1, inky._module_images)
+    print('OK')
+
+  def test_info_section(self):
+    with open('dummy.json', mode="w") as file:
+      file.write(test_config)
+    print('testing the info-section follows the module status...', end = "")
+    inky = Inkycal('dummy.json', render=False)
+    os.remove('dummy.json')
+
+    inky.info = 'cached images'
+    inky._assemble()
+    # only the time changed, the info of the last image is kept
+    inky.info = 'later, cached images'
+    inky._assemble()
+    self.assertEqual(inky._shown_info[1], 'cached images')
+
+    inky._module_status = {1: 'OK', 2: 'OK', 3: 'timeout'}
+    inky.info = 'module 3: timeout!'
+    inky._assemble()
+    self.assertEqual(inky._shown_info[1], 'module 3: timeout!')
+    print('OK')
+
 
 if __name__ == '__main__':
   unittest.main()
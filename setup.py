@@ -14,7 +14,7 @@ __author_email__ = "aceisace63@yahoo.com"
 __url__ = "https://github.com/aceisace/Inkycal"
 
 __install_requires__ = ['pyowm==3.1.1',                   # weather
-                        'Pillow>=7.1.1' ,                 # imaging
+                        'Pillow>=8.0.0' ,                 # imaging
                         'icalendar==4.0.6',               # iCalendar parsing
                         'recurring-ical-events==0.1.17b0',# parse recurring events
                         'feedparser==6.0.8',              # RSS-feeds